@@ -0,0 +1,115 @@
+import math
+import re
+from itertools import zip_longest
+from typing import NamedTuple, Optional
+
+PADRAO_CONSUMO = re.compile('Ponta|Fora Ponta|FPonta', re.IGNORECASE)
+
+
+class LinhaFatura(NamedTuple):
+    item_fatura: Optional[str]
+    quantidade: float
+    valor: float
+
+
+def _nulo(valor):
+    return valor is None or (isinstance(valor, float) and math.isnan(valor))
+
+
+def _soma(valores):
+    """Soma ignorando NaN, com a compensação de Kahan usada pelo ``groupby().sum()`` do pandas."""
+    soma = 0.0
+    compensacao = 0.0
+    for valor in valores:
+        if math.isnan(valor):
+            continue
+        y = valor - compensacao
+        t = soma + y
+        compensacao = t - soma - y
+        soma = t
+    return soma
+
+
+def montar_linhas(itens, quantidades, valores, converter):
+    """Alinha as colunas extraídas do PDF (completando as mais curtas com ``None``) e converte os números."""
+    linhas = []
+    for item, quantidade, valor in zip_longest(itens, quantidades, valores):
+        quantidade = converter(quantidade)
+        valor = converter(valor)
+        if _nulo(quantidade) and _nulo(valor):
+            continue
+        linhas.append(LinhaFatura(item, quantidade, valor))
+    return linhas
+
+
+def agrupar_por_item(linhas):
+    """Soma quantidade e valor por item, em ordem alfabética e descartando linhas sem item."""
+    grupos = {}
+    for linha in linhas:
+        if _nulo(linha.item_fatura):
+            continue
+        grupos.setdefault(linha.item_fatura, []).append(linha)
+    return [
+        LinhaFatura(item, _soma(l.quantidade for l in grupo), _soma(l.valor for l in grupo))
+        for item, grupo in sorted(grupos.items())
+    ]
+
+
+def sem_quantidades_repetidas(linhas):
+    """Mantém apenas a primeira linha de cada quantidade."""
+    vistas = set()
+    resultado = []
+    for linha in linhas:
+        chave = 'nan' if math.isnan(linha.quantidade) else linha.quantidade
+        if chave in vistas:
+            continue
+        vistas.add(chave)
+        resultado.append(linha)
+    return resultado
+
+
+def somar_consumo(linhas, itens_consumo):
+    """Soma as quantidades dos itens de consumo (ponta / fora ponta), ignorando quantidades repetidas."""
+    return sum(
+        linha.quantidade
+        for linha in sem_quantidades_repetidas(linhas)
+        if linha.item_fatura in itens_consumo and PADRAO_CONSUMO.search(linha.item_fatura)
+        and not math.isnan(linha.quantidade)
+    ) + 0.0
+
+
+def somar_total_valor(linhas, itens_total, itens_exclusao):
+    """Valor da primeira linha de total da fatura ou, na falta dela, a soma dos demais valores."""
+    for linha in linhas:
+        if linha.item_fatura in itens_total:
+            return linha
+    soma_total = sum(
+        linha.valor
+        for linha in sem_quantidades_repetidas(linhas)
+        if linha.item_fatura not in itens_exclusao and not math.isnan(linha.valor)
+    )
+    return soma_total if soma_total else None
+
+
+def separar_categorias(linhas, itens_fatura, itens_exclusao):
+    """Separa os itens de fatura padronizados dos encargos válidos."""
+    itens = []
+    encargos = []
+    for linha in linhas:
+        if linha.item_fatura in itens_fatura:
+            itens.append(linha._asdict())
+        elif not _nulo(linha.quantidade) and not _nulo(linha.valor) and linha.item_fatura not in itens_exclusao:
+            encargos.append(linha._asdict())
+    return {
+        'itens_fatura': itens,
+        'encargos': encargos
+    }
+
+
+def para_dataframe(linhas):
+    """Converte as linhas em um ``pandas.DataFrame``; o pandas só é necessário para quem chamar esta função."""
+    try:
+        import pandas as pd
+    except ImportError as erro:
+        raise ImportError('O pandas é necessário para converter as linhas da fatura em DataFrame.') from erro
+    return pd.DataFrame(list(linhas), columns=list(LinhaFatura._fields))
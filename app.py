@@ -1,20 +1,54 @@
+import hashlib
+import json
+import logging
 import os
-import re
-from flask import Flask, request, jsonify
-from io import BytesIO
-import requests
-import pandas as pd
-import numpy as np
+import sqlite3
+import threading
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from flask import Flask, Response, request, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
 import pdfplumber
+from pdfminer.pdfpage import PDFPage
+from pdfminer.psparser import PSException
+from pdfplumber.page import Page
 from flask_cors import CORS, cross_origin
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
-import calendar
+from agregacao import agrupar_por_item, montar_linhas, separar_categorias, somar_consumo, somar_total_valor
+from cache_resultados import cache_do_ambiente
+from campos import (CAMPOS_CABECALHO, CAMPOS_ITENS, PADRAO_BANDEIRA_CELESC, PADRAO_BANDEIRA_CELESC_SEM_ROTULO,
+                    PADRAO_BANDEIRA_COPEL, PADRAO_BANDEIRA_CPFL, PADRAO_DIAS_BANDEIRA_CPFL, PADROES_DADOS,
+                    PADROES_DADOS_ENERGISA, campos_cabecalho, validar_campos)
+from canonizacao import carregar_canonizador
+from classificacao import ClassificadorFaturas, FaturaNaoSuportada
+from deteccao_colunas import detector_do_ambiente
+from download_pdf import ErroDownload, baixador_do_ambiente
+from historico import AGRUPAMENTOS, historico_do_ambiente, normalizar_periodo
+from layouts import COLUNAS_ITENS, Continuacao, carregar_layouts, extrair_textos, validar_continuacoes
+from memoria import (PDF_LIMITE_MEMORIA, DocumentoGrandeDemais, EnvioGrandeDemais, MemoriaInsuficiente, abrir_pdf,
+                     ler_fluxo, orcamento_do_ambiente, tamanho_pdf)
+from metricas import DISTRIBUIDORA_DESCONHECIDA, REGISTRO, Medicao, etapa, medicao_atual, medindo
+from perfil import AmostradorPilhas, amostrador_atual, perfil_do_ambiente
+from serializacao import JSON, MSGPACK, NDJSON, ProvedorJSON, codificar, formatos_disponiveis, normalizar
+from tarefas import ConflitoIdempotencia, ExecutorTarefas, descrever, fila_do_ambiente
+from trabalhadores import ErroTrabalhador, LimiteExcedido, PrazoExcedido, pool_do_ambiente
 
 app = Flask(__name__)
+app.json = ProvedorJSON(app)
+# Tamanho máximo do corpo de uma requisição; cada PDF enviado tem ainda o limite dos downloads.
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('REQUISICAO_TAMANHO_MAXIMO', 256 * 1024 * 1024))
+logger = logging.getLogger(__name__)
 
 cors = CORS(app, resources={r"/api/*": {"origins": "https://127.0.0.1:5000"}})
 
+# LOTE
+LOTE_TAMANHO_MAXIMO = int(os.environ.get('LOTE_TAMANHO_MAXIMO', 1000))
+LOTE_THREADS_DOWNLOAD = int(os.environ.get('LOTE_THREADS_DOWNLOAD', 16))
+LOTE_PROCESSOS_EXTRACAO = int(os.environ.get('LOTE_PROCESSOS_EXTRACAO', os.cpu_count() or 1))
+
+# TAREFAS
+TAREFAS_THREADS = int(os.environ.get('TAREFAS_THREADS', 4))
+TAREFAS_ESPERA_MAXIMA = float(os.environ.get('TAREFAS_ESPERA_MAXIMA', 30))
+
 FATURA_DICT = {
     1: "Consumo Ponta TUSD",
     2: "Consumo Fora Ponta TUSD",
@@ -44,52 +78,28 @@ FATURA_DICT = {
     26: "Subsídio Demanda Isenta TUSD"
 }
 
+ITENS_FATURAS_EXCLUSAO = ['SUBTOTAL', 'TOTAL','Subtotal','Total', 'Total', 'Total Devoluções/Ajustes', 'Total a Pagar', 'Total Distribuidora', 'L ANÇAMENTOS E SERVIÇO']
+
 # TIPOS DE FATURA
 TIPO_FATURA = [('COPEL', 'Copel Distribuição'), ('CPFL', 'Cia Piratininga'), ('ENERGISA', 'ENERGISA')]
 TIPO_FATURA_CELESC = [('CELESC', 'Celesc'), ('CELESC', 'CELESC')]
-TIPO_FATURA_COORDENADAS = (0, 570, 595, 841)
-
-# CELESC
-CELESC_COPEL_COORDENADAS_DADOS = (0, 120, 320, 235)
-CELESC_COORDENADAS_BANDEIRA_TARIFA1 = (420, 275, 590, 330)
-CELESC_COORDENADAS_BANDEIRA_TARIFA2 = (143, 560, 282, 665)
-CELESC_COORDENADAS_VERIFICAR_MODELO = (27,580,59,600)
-
-# CELESC MODELO 1
-CELESC1_COORDENADAS_ITEM_FATURA = (27,400,105,582)
-CELESC1_COORDENADAS_QUANTIDADE = (130,400,170,582)
-CELESC1_COORDENADAS_VALOR = (200,400,241,582)
-
-# CELESC MODELO 2 E 3
-CELESC2_COORDENADAS_ITEM_FATURA = (10,245,144,402)
-CELESC2_COORDENADAS_QUANTIDADE = (168,245,217,402)
-CELESC2_COORDENADAS_VALOR = (260,245,300,402)
-
-CELESC3_COORDENADAS_ITEM_FATURA = (10,90,144,730)
-CELESC3_COORDENADAS_QUANTIDADE = (168,90,217,730)
-CELESC3_COORDENADAS_VALOR = (260,90,300,730)
-
-# COPEL
-COPEL_COORDENADAS_BANDEIRA_TARIFA = (0, 50, 595, 165)
-COPEL_COORDENADAS_DIAS = (430, 100, 500, 150)
-COPEL_COORDENADAS_ITEM_FATURA = (40,280,144,470)
-COPEL_COORDENADAS_QUANTIDADE = (168,280,210,470)
-COPEL_COORDENADAS_VALOR = (240,280,285,470)
-
-# CPFL
-CPFL_COORDENADAS_DATA = (0, 240, 595, 285)
-CPFL_COORDENADAS_BANDEIRA_TARIFA = (300, 130, 420, 180)
-CPFL_COORDENADAS_CONSUMO_TOTAL_IN = (300, 285, 350, 300)
-CPFL_COORDENADAS_CONSUMO_TOTAL_OUT = (490, 285, 530, 300)
-CPFL_COORDENADAS_ITEM_FATURA = (60,310,150,470)
-CPFL_COORDENADAS_QUANTIDADE = (190,310,220,470)
-CPFL_COORDENADAS_VALOR = (310,310,350,470)
-
-# ENERGISA
-ENERGISA_COORDENADAS_DATA = (0, 120, 340, 485)
-ENERGISA_COORDENADAS_ITEM_FATURA = (20,370,160,550)
-ENERGISA_COORDENADAS_QUANTIDADE = (190,370,225,550)
-ENERGISA_COORDENADAS_VALOR = (260,370,295,550)
+
+# LAYOUTS: regiões de cada distribuidora e modelo, definidas em layouts.json
+LAYOUTS = carregar_layouts()
+
+# Continuação da tabela de lançamentos nas páginas seguintes, por modelo
+CONTINUACOES_ITENS = validar_continuacoes(LAYOUTS, {
+    'CELESC2_3': Continuacao('CELESC3', paginas_minimas=3, terminadores=frozenset({'TOTAL'})),
+})
+
+# Regras de renomeação dos lançamentos de cada distribuidora, definidas em renomeacoes.json
+DISTRIBUIDORA_DO_MODELO = {'CELESC1': 'CELESC', 'CELESC2_3': 'CELESC'}
+canonizador_itens = carregar_canonizador(FATURA_DICT, conhecidos=ITENS_FATURAS_EXCLUSAO)
+
+classificador_faturas = ClassificadorFaturas(TIPO_FATURA, TIPO_FATURA_CELESC, LAYOUTS['CLASSIFICACAO'])
+
+# Colunas da tabela de lançamentos ajustadas às posições reais das palavras, por modelo de página
+detector_colunas = detector_do_ambiente()
 
 def converter_para_float(_value):
     if _value is None:
@@ -104,171 +114,272 @@ def converter_para_float(_value):
         return 0.0
 
 
+class SessaoDocumento:
+    """Mantém um PDF aberto durante uma extração.
+
+    O arquivo é aberto uma única vez, cada página é processada sob demanda
+    e o texto de cada coordenada fica em cache até o fechamento da sessão.
+    Só a página em uso mantém os objetos analisados: ao passar para outra
+    página, os caches da anterior são liberados, de modo que a memória de
+    um documento longo não cresce com o número de páginas.
+    """
+
+    def __init__(self, pdf):
+        self._origem = pdf
+        self._pdf = None
+        self._paginas_pdf = None
+        self._paginas = []
+        self._pagina_em_uso = None
+        self._doctop = 0
+        self._textos = {}
+        # Layouts ajustados para este documento (colunas detectadas), no lugar dos de LAYOUTS.
+        self.layouts = {}
+
+    def __enter__(self):
+        self.abrir()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.fechar()
+
+    def abrir(self):
+        if self._pdf is None:
+            if hasattr(self._origem, 'seek'):
+                self._origem.seek(0)
+            with etapa('abertura'):
+                self._pdf = pdfplumber.open(self._origem)
+                self._paginas_pdf = PDFPage.create_pages(self._pdf.doc)
+        return self
+
+    @property
+    def metadados(self):
+        return self.abrir()._pdf.metadata
+
+    @property
+    def numero_paginas(self):
+        self._carregar_paginas(None)
+        return len(self._paginas)
+
+    def _carregar_paginas(self, ate):
+        # Cria os objetos de página sob demanda, como pdfplumber.PDF.pages faria,
+        # sem percorrer o documento inteiro para ler apenas as primeiras páginas.
+        self.abrir()
+        while ate is None or len(self._paginas) <= ate:
+            page_obj = next(self._paginas_pdf, None)
+            if page_obj is None:
+                break
+            pagina = Page(self._pdf, page_obj, page_number=len(self._paginas) + 1, initial_doctop=self._doctop)
+            self._doctop += pagina.height
+            self._paginas.append(pagina)
+
+    def tem_pagina(self, numero: int):
+        self._carregar_paginas(numero)
+        return numero < len(self._paginas)
+
+    def pagina(self, numero: int):
+        self._carregar_paginas(numero if numero >= 0 else None)
+        pagina = self._paginas[numero]
+        if self._pagina_em_uso is not None and self._pagina_em_uso is not pagina:
+            self._pagina_em_uso.close()
+        self._pagina_em_uso = pagina
+        return pagina
+
+    def texto(self, coordinates, page: int = 0):
+        return self.textos([tuple(coordinates)], page)[tuple(coordinates)]
+
+    def textos(self, coordenadas, page: int = 0):
+        """Texto de várias coordenadas da mesma página, extraídas em uma única passada."""
+        faltantes = [bbox for bbox in coordenadas if (page, bbox) not in self._textos]
+        if faltantes:
+            for bbox, texto in extrair_textos(self.pagina(page), faltantes).items():
+                self._textos[(page, bbox)] = texto
+        return {bbox: self._textos[(page, bbox)] for bbox in coordenadas}
+
+    def layout(self, nome):
+        return self.layouts.get(nome) or LAYOUTS[nome]
+
+    def texto_regiao(self, layout, nome, rotulo=None):
+        """Texto de uma região do layout; as demais regiões da mesma página são extraídas junto.
+
+        ``None`` quando o documento não tem a página da região.
+        """
+        regiao = layout[nome]
+        if (regiao.pagina, regiao.coordenadas) in self._textos:
+            return self._textos[(regiao.pagina, regiao.coordenadas)]
+        if not self.tem_pagina(regiao.pagina):
+            return None
+        mesma_pagina = [r.coordenadas for r in layout.values() if r.pagina == regiao.pagina]
+        with etapa('regiao', rotulo or nome):
+            return self.textos(mesma_pagina, regiao.pagina)[regiao.coordenadas]
+
+    def fechar(self):
+        for pagina in self._paginas:
+            pagina.close()
+        self._paginas.clear()
+        self._pagina_em_uso = None
+        self._textos.clear()
+        self.layouts.clear()
+        self._paginas_pdf = None
+        self._doctop = 0
+        if self._pdf is not None:
+            self._pdf.close()
+            self._pdf = None
+
+
+def _linhas(texto):
+    return texto.split('\n') if texto else []
+
+
+def paginas_itens(sessao, modelo):
+    """Gera, página a página, as colunas ``(itens, quantidades, valores)`` da tabela de lançamentos.
+
+    A primeira página vem das regiões do layout do modelo. Se o modelo tem
+    continuação (``CONTINUACOES_ITENS``), as páginas seguintes são lidas sob
+    demanda com as regiões da continuação, cada uma em uma única passada,
+    até a primeira linha terminadora, o fim do documento ou
+    ``paginas_maximas`` páginas de continuação.
+    """
+    layout = sessao.layout(modelo)
+    colunas = tuple(_linhas(sessao.texto_regiao(layout, coluna, f'{modelo}.{coluna}')) for coluna in COLUNAS_ITENS)
+    yield colunas
+    continuacao = CONTINUACOES_ITENS.get(modelo)
+    if continuacao is None or not sessao.tem_pagina(continuacao.paginas_minimas - 1):
+        return
+    regioes = [LAYOUTS[continuacao.layout][coluna] for coluna in COLUNAS_ITENS]
+    coordenadas = [regiao.coordenadas for regiao in regioes]
+    pagina = regioes[0].pagina
+    ultima = pagina + continuacao.paginas_maximas
+    while not continuacao.terminadores.intersection(linha.strip() for linha in colunas[0]) and sessao.tem_pagina(pagina):
+        if pagina == ultima:
+            logger.warning('Tabela de lançamentos do modelo %s sem terminador em %s páginas de continuação.',
+                           modelo, continuacao.paginas_maximas)
+            return
+        with etapa('regiao', f'{continuacao.layout}.continuacao'):
+            textos = sessao.textos(coordenadas, pagina)
+        colunas = tuple(_linhas(textos[bbox]) for bbox in coordenadas)
+        yield colunas
+        pagina += 1
+
+
 class APILeitorFaturas:
     def __init__(self, pdf):
         self._pdf = pdf
+        self._sessao = None
+        # Classificação da última fatura extraída.
+        self.tipo_fatura = None
+        self.modelo = None
 
     @property
     def pdf(self):
         return self._pdf
 
-    def extrair_documento(self):
-        tipo_fatura = None
-        with pdfplumber.open(self._pdf) as pdf:
-            pagina = pdf.pages[0]
-            text = pagina.within_bbox(TIPO_FATURA_COORDENADAS).extract_text()
-            if not text:
-                return {'status': 400, 'message': 'Não foi possível extrair o tipo de fatura.'}
-            for tipo in TIPO_FATURA:
-                if tipo[1] in text:
-                    tipo_fatura = tipo[0]
-                    break
-            for tipo in TIPO_FATURA_CELESC:
-                if tipo[1] in text:
-                    tipo_fatura = tipo[0]
-                    break
-            if not tipo_fatura:
-                return {'status': 400, 'message': 'Tipo de fatura não reconhecido.'}
-                
-        if tipo_fatura == 'COPEL':
-            result_itens_fatura = self.busca_itens_fatura('COPEL')
-        if tipo_fatura == 'CPFL':
-            result_itens_fatura = self.busca_itens_fatura('CPFL')
-        if tipo_fatura == 'ENERGISA':
-            result_itens_fatura = self.busca_itens_fatura('ENERGISA')
-        if tipo_fatura == 'CELESC':
-            modelo = self.busca_valor_pela_coordenada(CELESC_COORDENADAS_VERIFICAR_MODELO, 0)
-            if 'LEGENDA' in modelo:
-                result_itens_fatura = self.busca_itens_fatura('CELESC1')
-            else:
-                result_itens_fatura = self.busca_itens_fatura('CELESC2_3')
-                if len(pdf.pages) > 2:
-                    somar_itens_fatura = True
-                    result_itens_fatura = self.busca_itens_fatura('CELESC2_3', somar_itens_fatura)
-
-        data_values = {}
-        data_values = {
-            **self.obter_valores_padrao(tipo_fatura),
-            **data_values,
-            'lancamentos': result_itens_fatura['itens_fatura'],
-            'encargos': result_itens_fatura['encargos'],
-            'soma_consumo_total': result_itens_fatura['soma_consumo_total'],
-            # 'soma_total_valor': result_itens_fatura['soma_total_valor']
-        }
-
-        data_values['consumo_total'] = result_itens_fatura['soma_consumo_total'] if result_itens_fatura['soma_consumo_total'] else data_values['consumo_total']
+    def extrair_documento(self, campos=None):
+        """Extrai os dados da fatura; ``campos`` limita a resposta (e a leitura do PDF) aos campos pedidos."""
+        with SessaoDocumento(self._pdf) as sessao:
+            self._sessao = sessao
+            try:
+                return self._extrair_documento(campos)
+            finally:
+                self._sessao = None
 
-        print(data_values)
+    def _extrair_documento(self, campos=None):
+        if not self._sessao.tem_pagina(0):
+            return {'status': 400, 'message': 'O PDF não tem páginas.'}
+        try:
+            with etapa('classificacao'):
+                tipo_fatura, modelo = classificador_faturas.classificar(self._sessao)
+        except FaturaNaoSuportada as erro:
+            return {'status': 400, 'message': str(erro)}
+        self.tipo_fatura, self.modelo = tipo_fatura, modelo
+        medicao = medicao_atual()
+        if medicao is not None:
+            medicao.classificar(tipo_fatura, modelo)
+
+        ler_itens = campos is None or any(campo in CAMPOS_ITENS for campo in campos)
+        if ler_itens:
+            # Antes do cabeçalho, para que as regiões da mesma página sejam lidas juntas com as colunas detectadas.
+            self._sessao.layouts[modelo] = detector_colunas.layout(self._sessao, modelo, LAYOUTS[modelo])
+
+        campos_cabecalho = CAMPOS_CABECALHO if campos is None else [campo for campo in CAMPOS_CABECALHO if campo in campos]
+        data_values = self.obter_valores_padrao(tipo_fatura, campos_cabecalho)
+
+        # Os lançamentos só são lidos quando algum campo pedido depende deles.
+        if ler_itens:
+            result_itens_fatura = self.busca_itens_fatura(modelo)
+
+            data_values = {
+                **data_values,
+                'lancamentos': result_itens_fatura['itens_fatura'],
+                'encargos': result_itens_fatura['encargos'],
+                'soma_consumo_total': result_itens_fatura['soma_consumo_total'],
+                # 'soma_total_valor': result_itens_fatura['soma_total_valor']
+            }
+            if 'consumo_total' in data_values:
+                data_values['consumo_total'] = result_itens_fatura['soma_consumo_total'] if result_itens_fatura['soma_consumo_total'] else data_values['consumo_total']
+
+        if campos is not None:
+            data_values = {campo: data_values[campo] for campo in campos}
+
+        logger.debug('Fatura %s (%s) extraída: %s.', tipo_fatura, modelo, ', '.join(data_values))
         return {'status': 200,
                 'message': 'Dados extraídos com sucesso.',
                 'data': data_values}
 
     def busca_valor_pela_coordenada(self, coordinates, page: int = 0, split=False):
-        with pdfplumber.open(self._pdf) as pdf:
-            first_page = pdf.pages[page]
-            text = first_page.within_bbox(coordinates).extract_text()
-            if not text:
-                return None
-            if split:
-                text = text.split('\n')
-            return text
-
-    def busca_itens_fatura(self, tipo_fatura, somar_itens_fatura=False):
-        page = 0
-        if tipo_fatura == 'COPEL':
-            cords_item_fatura = COPEL_COORDENADAS_ITEM_FATURA
-            cords_quantidade = COPEL_COORDENADAS_QUANTIDADE
-            cords_valor = COPEL_COORDENADAS_VALOR
-        if tipo_fatura == 'CPFL':
-            cords_item_fatura = CPFL_COORDENADAS_ITEM_FATURA
-            cords_quantidade = CPFL_COORDENADAS_QUANTIDADE
-            cords_valor = CPFL_COORDENADAS_VALOR
-        if tipo_fatura == 'ENERGISA':
-            cords_item_fatura = ENERGISA_COORDENADAS_ITEM_FATURA
-            cords_quantidade = ENERGISA_COORDENADAS_QUANTIDADE
-            cords_valor = ENERGISA_COORDENADAS_VALOR
-        if tipo_fatura == 'CELESC1':
-            cords_item_fatura = CELESC1_COORDENADAS_ITEM_FATURA
-            cords_quantidade = CELESC1_COORDENADAS_QUANTIDADE
-            cords_valor = CELESC1_COORDENADAS_VALOR
-        if tipo_fatura == 'CELESC2_3':
-            cords_item_fatura = CELESC2_COORDENADAS_ITEM_FATURA
-            cords_quantidade = CELESC2_COORDENADAS_QUANTIDADE
-            cords_valor = CELESC2_COORDENADAS_VALOR
-        
-        lista_item_fatura = self.busca_valor_pela_coordenada(cords_item_fatura, page, split=True)
-        lista_quantidade = self.busca_valor_pela_coordenada(cords_quantidade, page, split=True)
-        lista_valor = self.busca_valor_pela_coordenada(cords_valor, page, split=True)
-
-        if somar_itens_fatura:
-            page = 1
-            somar_item_fatura = self.busca_valor_pela_coordenada(CELESC3_COORDENADAS_ITEM_FATURA, page, split=True)
-            somar_quantidade = self.busca_valor_pela_coordenada(CELESC3_COORDENADAS_QUANTIDADE, page, split=True)
-            somar_valor = self.busca_valor_pela_coordenada(CELESC3_COORDENADAS_VALOR, page, split=True)
-            lista_item_fatura = lista_item_fatura + somar_item_fatura
-            lista_quantidade = lista_quantidade + somar_quantidade
-            lista_valor = lista_valor + somar_valor
-
-        if tipo_fatura == 'CELESC1' or tipo_fatura == 'CELESC2_3':
-            lista_item_fatura = [item[5:] if item.startswith('(') else item for item in lista_item_fatura]
-            lista_item_fatura = self.renomear_lista_celesc(lista_item_fatura)
-
-        if tipo_fatura == 'COPEL':
-            lista_item_fatura = self.renomear_lista_copel(lista_item_fatura)
-        
-        if tipo_fatura == 'CPFL':
-            lista_item_fatura = self.renomear_lista_cpfl(lista_item_fatura)
-
-        if tipo_fatura == 'ENERGISA':
-            lista_item_fatura = self.renomear_lista_energisa(lista_item_fatura)
-            if 'L ANÇAMENTOS E SERVIÇOS' in lista_item_fatura:
-                lista_item_fatura.remove('L ANÇAMENTOS E SERVIÇOS')
-
-        max_length = max(len(lista_item_fatura), len(lista_quantidade), len(lista_valor))
-        lista_item_fatura += [None] * (max_length - len(lista_item_fatura))
-        lista_quantidade += [None] * (max_length - len(lista_quantidade))
-        lista_valor += [None] * (max_length - len(lista_valor))
-
-        df = pd.DataFrame({
-            'item_fatura': lista_item_fatura,
-            'quantidade': lista_quantidade,
-            'valor': lista_valor
-        })
-
-        df['quantidade'] = df['quantidade'].apply(converter_para_float)
-        df['valor'] = df['valor'].apply(converter_para_float)
-        df = df[~((df['quantidade'].isna()) & (df['valor'].isna()))]
-        df['quantidade'] = df['quantidade'].replace('.', '', regex=True).replace(',', '.', regex=True)
-        df = df.groupby('item_fatura').agg({
-            'quantidade': 'sum',
-            'valor': 'sum'
-        }).reset_index()
-        
-        df_consumo_total = df.copy()
-        df_consumo_total = df_consumo_total.drop_duplicates(subset=['item_fatura'])
-        df_consumo_total = df_consumo_total.drop_duplicates(subset=['quantidade'])
-
+        if self._sessao is None:
+            with SessaoDocumento(self._pdf) as sessao:
+                text = sessao.texto(coordinates, page)
+        else:
+            text = self._sessao.texto(coordinates, page)
+        if not text:
+            return None
+        if split:
+            text = text.split('\n')
+        return text
+
+    def busca_regiao(self, layout, nome, split=False):
+        if self._sessao is None:
+            with SessaoDocumento(self._pdf) as sessao:
+                text = sessao.texto_regiao(LAYOUTS[layout], nome, f'{layout}.{nome}')
+        else:
+            text = self._sessao.texto_regiao(self._sessao.layout(layout), nome, f'{layout}.{nome}')
+        if not text:
+            return None
+        if split:
+            text = text.split('\n')
+        return text
+
+    def busca_itens_fatura(self, tipo_fatura):
+        if self._sessao is None:
+            with SessaoDocumento(self._pdf) as sessao:
+                return self.agrega_itens_fatura(tipo_fatura, paginas_itens(sessao, tipo_fatura))
+        return self.agrega_itens_fatura(tipo_fatura, paginas_itens(self._sessao, tipo_fatura))
+
+    def agrega_itens_fatura(self, tipo_fatura, paginas):
+        """Agrega as colunas ``(itens, quantidades, valores)`` de cada página da tabela de lançamentos.
+
+        As páginas são consumidas à medida que ``paginas`` as gera; a leitura
+        das regiões é medida à parte da agregação.
+        """
+        with etapa('agregacao'):
+            return self._agrega_itens_fatura(tipo_fatura, paginas)
+
+    def _agrega_itens_fatura(self, tipo_fatura, paginas):
+        distribuidora = DISTRIBUIDORA_DO_MODELO.get(tipo_fatura, tipo_fatura)
+        linhas = []
+        for lista_item_fatura, lista_quantidade, lista_valor in paginas:
+            lista_item_fatura = canonizador_itens.canonizar(distribuidora, lista_item_fatura)
+            linhas.extend(montar_linhas(lista_item_fatura, lista_quantidade, lista_valor, converter_para_float))
+        linhas = agrupar_por_item(linhas)
 
         itens_especificos = {1, 2, 6, 7}
-        filtro_itens_dict = df_consumo_total['item_fatura'].isin(
-            [FATURA_DICT[item] for item in itens_especificos]
-        )
-        filtro_palavras_chave  = df_consumo_total['item_fatura'].str.contains('Ponta|Fora Ponta|FPonta', case=False, na=False)
-        filtro_combinado = filtro_itens_dict & filtro_palavras_chave
-        df_consumo_total_filtrado = df_consumo_total.loc[filtro_combinado]
-        soma_consumo_total = df_consumo_total_filtrado['quantidade'].sum()
-
-        print('---SOMA TOTAL:   ')
-        print(soma_consumo_total)
-        print('-'*40)
-        total_keywords = ['TOTAL', 'Total a Pagar', 'Total']
-        soma_total_valor = df.loc[df['item_fatura'].isin(total_keywords)]
+        soma_consumo_total = somar_consumo(linhas, {FATURA_DICT[item] for item in itens_especificos})
 
-        itens_faturas_exclusao = ['SUBTOTAL', 'TOTAL','Subtotal','Total', 'Total', 'Total Devoluções/Ajustes', 'Total a Pagar', 'Total Distribuidora', 'L ANÇAMENTOS E SERVIÇO']
-        soma_total = df_consumo_total.loc[~df['item_fatura'].isin(itens_faturas_exclusao)]['valor'].sum()
-        soma_total_valor = soma_total_valor.values[0] if not soma_total_valor.empty else soma_total if soma_total else None
+        logger.debug('Soma do consumo (%s): %s', tipo_fatura, soma_consumo_total)
+        total_keywords = ['TOTAL', 'Total a Pagar', 'Total']
+        soma_total_valor = somar_total_valor(linhas, total_keywords, ITENS_FATURAS_EXCLUSAO)
 
-        result_json = self.transforma_em_json(df)
+        result_json = self.transforma_em_json(linhas)
 
         return {
             'itens_fatura' : result_json['itens_fatura'],
@@ -277,246 +388,537 @@ class APILeitorFaturas:
             'soma_total_valor': soma_total_valor
         }
 
-    def obter_valores_padrao(self, tipo_fatura):
-        dados_dicionario = {}
-        dados_texto = ''
-        consumo_total = None
-        tipo_bandeira = None
-        dias_bandeira = None
-        padrao_bandeira_celesc = re.compile(r'(Bandeira)\s+(\w+)\s+(\d{1,2})')
-        padrao_bandeira_copel = re.compile(r'TARIFA HORARIA\s+(\S+)')
-        padrao_bandeira_cpfl = re.compile(r'(\S+)')
-        padrao_dias_bandeira_cpfl = re.compile(r'(\d+)\s+Dias')
+    def obter_valores_padrao(self, tipo_fatura, campos=CAMPOS_CABECALHO):
+        cabecalho = campos_cabecalho(tipo_fatura, lambda nome: self.busca_regiao(tipo_fatura, nome))
+        with etapa('cabecalho'):
+            return cabecalho.valores(campos)
 
-        try:
-            if tipo_fatura == 'CELESC' or tipo_fatura == 'COPEL':
-                dados_texto = self.busca_valor_pela_coordenada(CELESC_COPEL_COORDENADAS_DADOS, 0)
-
-            if tipo_fatura == 'CPFL':
-                dados_texto = self.busca_valor_pela_coordenada(CPFL_COORDENADAS_DATA, 0)
-                consumo_total_in = self.busca_valor_pela_coordenada(CPFL_COORDENADAS_CONSUMO_TOTAL_IN, 1)
-                consumo_total_out = self.busca_valor_pela_coordenada(CPFL_COORDENADAS_CONSUMO_TOTAL_OUT, 1)
-                if consumo_total_in and consumo_total_out:
-                    consumo_total = float(consumo_total_in.replace('.', '').replace(',', '.')) + float(consumo_total_out.replace('.', '').replace(',', '.')) 
-                text_bandeira = self.busca_valor_pela_coordenada(CPFL_COORDENADAS_BANDEIRA_TARIFA, 1)
-                bandeira = padrao_bandeira_cpfl.findall(text_bandeira)
-                dias_bandeira = padrao_dias_bandeira_cpfl.findall(text_bandeira)
-                if bandeira:
-                    tipo_bandeira = bandeira[0]
-                else:
-                    tipo_bandeira = None
-                if dias_bandeira:
-                    dias_bandeira = dias_bandeira[0]
-                else:
-                    dias_bandeira = None
-
-            if tipo_fatura == 'COPEL':
-                dias_bandeira = self.busca_valor_pela_coordenada(COPEL_COORDENADAS_DIAS, 0)
-                text_with_bandeira = self.busca_valor_pela_coordenada(COPEL_COORDENADAS_BANDEIRA_TARIFA, 2)
-                bandeira = padrao_bandeira_copel.findall(text_with_bandeira)
-                dados_texto += text_with_bandeira
-                if bandeira:
-                    tipo_bandeira = bandeira[0]
-                else:
-                    tipo_bandeira = None
-
-            if tipo_fatura == 'CELESC':
-                text_bandeira = self.busca_valor_pela_coordenada(CELESC_COORDENADAS_BANDEIRA_TARIFA1, 0)
-                bandeira = padrao_bandeira_celesc.findall(text_bandeira)
-                if not bandeira:
-                    text_bandeira1 = self.busca_valor_pela_coordenada(CELESC_COORDENADAS_BANDEIRA_TARIFA2, 0)
-                    bandeira = padrao_bandeira_celesc.findall(text_bandeira1)
-                    if not bandeira:
-                        padrao_bandeira_celesc = re.compile(r'(\w+)\s+(\d{1,2})')
-                        bandeira = padrao_bandeira_celesc.findall(text_bandeira)
-                
-                dias_bandeira = None
-                if len(bandeira) == 1 and len(bandeira[0]) == 3:
-                    _, tipo_bandeira, dias_bandeira = bandeira[0]
-                if len(bandeira) == 1 and len(bandeira[0]) == 2:
-                    tipo_bandeira, dias_bandeira = bandeira[0]
-                else:
-                    try:
-                        tipo_bandeira = bandeira[0][1]
-                    except:
-                        tipo_bandeira = None
-
-            if tipo_fatura == 'ENERGISA':
-                dados_texto = self.busca_valor_pela_coordenada(ENERGISA_COORDENADAS_DATA, 0)
-                padrao_bandeira_energisa = re.compile(r'TARIF[ÁA]RIA\s+(\w+)')
-                bandeira = padrao_bandeira_energisa.findall(dados_texto)
-                if bandeira == 1:
-                    tipo_bandeira = bandeira[0]
-                else:
-                    try:
-                        tipo_bandeira = bandeira[0]
-                    except:
-                        tipo_bandeira = None
+    def transforma_em_json(self, linhas):
+        return separar_categorias(linhas, set(FATURA_DICT.values()), ITENS_FATURAS_EXCLUSAO)
 
-        except:
-            dados_texto = ''
 
-        if(tipo_fatura == "ENERGISA"):
-            padrao_numero_unidade = re.compile(r'\b[A-Za-z]\d{10}\b')
-            padrao_consumo_total = re.compile(r'\bKWH\s([\d,.]+)\b')
 
-        else:
-            padrao_numero_unidade = re.compile(r'\b\d{8,9}\b')
-            padrao_consumo_total = re.compile(r'\b(\d+\s?kWh)\b')
-
-        padrao_referencia = re.compile(r'\b(\d{2}/\d{4})\b')
-        padrao_vencimento = re.compile(r'\b(\d{2}/\d{2}/\d{4})\b')
-        padrao_valor_vencimento = re.compile(r'(?:R\$ ?)?([\d.]+,\d{2})')
-
-        if(tipo_fatura == "ENERGISA" or tipo_fatura == "CPFL"):
-            date = padrao_referencia.findall(dados_texto)
-            date_format = "%m/%Y"
-            date_obj = datetime.strptime(date[0], date_format)
-            new_date_obj = date_obj - relativedelta(months=1)
-            new_date_str = new_date_obj.strftime(date_format)
-            matches_referencia = [new_date_str]
-
-            if not dias_bandeira:
-                year = new_date_obj.year
-                month = new_date_obj.month
-                num_days = calendar.monthrange(year, month)[1]
-                dias_bandeira = num_days
+@app.route('/api/itens-nao-mapeados', methods=['GET'])
+@cross_origin(origin='*', methods=['GET'], allow_headers=['Content-Type'])
+def itens_nao_mapeados():
+    return jsonify({'status': 200, 'data': canonizador_itens.relatorio_nao_mapeados()})
 
-        else:
-            matches_referencia = padrao_referencia.findall(dados_texto)
 
-        matches_numero_unidade = padrao_numero_unidade.findall(dados_texto)
-        matches_vencimento = padrao_vencimento.findall(dados_texto)
-        matches_consumo_total = padrao_consumo_total.findall(dados_texto)
-        matches_valor_vencimento = padrao_valor_vencimento.findall(dados_texto)
+@app.errorhandler(RequestEntityTooLarge)
+def requisicao_grande_demais(erro):
+    return jsonify({'status': 413, 'message': f'A requisição excede o limite de {app.config["MAX_CONTENT_LENGTH"]} bytes.'})
 
-        if(tipo_fatura == "ENERGISA"):
-            try:
-                def converter_para_float(s):
-                    s = s.replace('.', '').replace(',', '.')
-                    return float(s)
-                soma_total = sum(converter_para_float(numero) for numero in matches_consumo_total)
-                matches_consumo_total = [soma_total]
-            except ValueError as e:
-                matches_consumo_total = []
-
-        dados_dicionario["referencia"] = matches_referencia[0] if matches_referencia else None
-        dados_dicionario["unidade_consumidora"] = matches_numero_unidade[0] if matches_numero_unidade else None
-        dados_dicionario["vencimento"] = matches_vencimento[1] if len(matches_vencimento) >= 2 else matches_vencimento[
-            0] if matches_vencimento else None
-        dados_dicionario["consumo_total"] = matches_consumo_total[0] if matches_consumo_total else consumo_total
-        dados_dicionario["valor_fatura"] = float(matches_valor_vencimento[0].replace('.', '').replace(',', '.')) if matches_valor_vencimento else None
-        dados_dicionario["bandeira"] = tipo_bandeira
-        dados_dicionario["dias_bandeira"] = dias_bandeira
-        return dados_dicionario
-
-    def renomear_lista_copel(self, list):
-        lista_renomeada = [
-            FATURA_DICT[6] if item == 'TE CDE COVID PONTA' else
-            FATURA_DICT[7] if item == 'TE CDE COVID FORA PONTA' else
-            FATURA_DICT[9] if item == 'ENERGIA REAT EXCED TE PONTA' else
-            FATURA_DICT[10] if item == 'ENERGIA REAT EXCED TE F PONTA' else
-            FATURA_DICT[12] if item == 'DEMANDA DE DISTRIBUICAO TUSD' else
-            FATURA_DICT[11] if item == 'DEMANDA REATIVA EXCED USD' else
-            FATURA_DICT[24] if item == 'ENERGIA ELETRICA ACL-COM ICMS ST' else
-            FATURA_DICT[25] if item == 'ENERGIA ELETRICA ACL-COM ICMS ST' else
-            item
-            for item in list
-        ]
-        return lista_renomeada
-
-    def renomear_lista_cpfl(self, list):
-        lista_renomeada = [
-            FATURA_DICT[6] if item == 'Cons Ponta - TE' or item == 'Cons Ponta TE' else  
-            FATURA_DICT[7] if item == 'Cons FPonta TE' or item == 'Cons Fora Ponta - TE' or item == 'Cons FPonta - TE' else
-            FATURA_DICT[9] if item == 'Consumo Reativo Exc Ponta' else
-            FATURA_DICT[10] if item == 'Consumo Reativo Exc Fora Ponta' else
-            FATURA_DICT[12] if item == 'Demanda' else
-            FATURA_DICT[14] if item == 'Demanda' else
-            item
-            for item in list
-        ]
-        return lista_renomeada
-    
-    def renomear_lista_energisa(self, list):
-        lista_renomeada = [
-            FATURA_DICT[6] if item == 'Consumo em kWh - Ponta' else
-            FATURA_DICT[7] if item == 'Consumo em kWh - Fora Ponta' else
-            FATURA_DICT[23] if item == 'Energia Atv Injetada - Fora Ponta' else
-            FATURA_DICT[10] if item == 'Energia Reativa Exced em KWh - Fponta' else
-            FATURA_DICT[12] if item == 'Demanda de Potência Medida - Fora Ponta' else
-            FATURA_DICT[18] if item == 'Demanda de Potência Ativa - Ultrap - F Ponta' else
-            item
-            for item in list
-        ]
-        return lista_renomeada
-
-    def renomear_lista_celesc(self, list):
-        lista_renomeada = [
-            FATURA_DICT[1] if item == 'Consumo Ponta TUSD' or item == 'Consumo TUSD' else
-            FATURA_DICT[2] if item == 'Consumo Fora Ponta TUSD' else
-            FATURA_DICT[6] if item == 'Consumo Ponta TE' or item == 'Consumo TE' else
-            FATURA_DICT[7] if item == 'Consumo Fora Ponta TE' else
-            FATURA_DICT[10] if item == 'Energia Reativa Excedente' else
-            FATURA_DICT[12] if item == 'Demanda' else
-            FATURA_DICT[16] if item == 'Demanda Reativa' else
-            item
-            for item in list
-        ]
-        return lista_renomeada
-        
-    def transforma_em_json(self, df):
-        itens_faturas_exclusao = ['SUBTOTAL', 'TOTAL','Subtotal','Total', 'Total', 'Total Devoluções/Ajustes', 'Total a Pagar', 'Total Distribuidora', 'L ANÇAMENTOS E SERVIÇO']
-        df['categoria'] = df['item_fatura'].apply(lambda x: 'itens de fatura' if x in FATURA_DICT.values() else 'encargos')
-        df['encargo_valido'] = df.apply(
-            lambda row: (
-                row['categoria'] == 'encargos' and 
-                pd.notnull(row['quantidade']) and 
-                pd.notnull(row['valor']) and 
-                row['item_fatura'] not in itens_faturas_exclusao
-            ), axis=1
-        )
-        itens_fatura = df[df['categoria'] == 'itens de fatura'][['item_fatura', 'quantidade', 'valor']]
-        encargos = df[df['encargo_valido'] == True][['item_fatura', 'quantidade', 'valor']]
-        itens_fatura_list = itens_fatura.to_dict(orient='records')
-        encargos_list = encargos.to_dict(orient='records')
-        
-        return {
-            'itens_fatura': itens_fatura_list,
-            'encargos': encargos_list
-        }
+
+# Com o servidor.py, as métricas dos processos HTTP são somadas por um diretório (``MetricasCompartilhadas``).
+metricas_compartilhadas = None
+
+
+@app.route('/metrics', methods=['GET'])
+def metricas():
+    texto = REGISTRO.exposicao() if metricas_compartilhadas is None else metricas_compartilhadas.exposicao()
+    return Response(texto, content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
+# Marcado quando o módulo termina de carregar, em qualquer servidor WSGI. O servidor.py desmarca durante o
+# aquecimento e o encerramento de cada processo e marca de novo quando os executores estão iniciados.
+pronto = threading.Event()
 
-@app.route('/api/extract', methods=['GET'])
+
+@app.route('/healthz', methods=['GET'])
+def saude():
+    return jsonify({'status': 200, 'message': 'Processo ativo.'})
+
+
+@app.route('/readyz', methods=['GET'])
+def prontidao():
+    # Aqui o código HTTP acompanha o status: balanceadores e probes olham só o código da resposta.
+    if not pronto.is_set():
+        return jsonify({'status': 503, 'message': 'Processo em aquecimento ou encerramento.'}), 503
+    return jsonify({'status': 200, 'message': 'Processo pronto.'})
+
+
+# CACHE
+VERSAO_EXTRATOR = '6'
+
+
+def versao_layouts():
+    """Versão usada nas chaves do cache.
+
+    Combina ``VERSAO_EXTRATOR`` com o registro de layouts, os tipos de fatura, os
+    padrões dos campos, as tabelas de itens e regras de renomeação e o arquivo
+    das colunas detectadas, de modo que qualquer alteração neles invalida
+    automaticamente os resultados já guardados.
+    """
+    entradas = {
+        'LAYOUTS': LAYOUTS,
+        'CONTINUACOES_ITENS': CONTINUACOES_ITENS,
+        'TIPO_FATURA': TIPO_FATURA,
+        'TIPO_FATURA_CELESC': TIPO_FATURA_CELESC,
+        'DISTRIBUIDORA_DO_MODELO': DISTRIBUIDORA_DO_MODELO,
+        'PADROES_DADOS': PADROES_DADOS,
+        'PADROES_DADOS_ENERGISA': PADROES_DADOS_ENERGISA,
+        'PADRAO_BANDEIRA_CELESC': PADRAO_BANDEIRA_CELESC,
+        'PADRAO_BANDEIRA_CELESC_SEM_ROTULO': PADRAO_BANDEIRA_CELESC_SEM_ROTULO,
+        'PADRAO_BANDEIRA_COPEL': PADRAO_BANDEIRA_COPEL,
+        'PADRAO_BANDEIRA_CPFL': PADRAO_BANDEIRA_CPFL,
+        'PADRAO_DIAS_BANDEIRA_CPFL': PADRAO_DIAS_BANDEIRA_CPFL,
+        'FATURA_DICT': FATURA_DICT,
+        'ITENS_FATURAS_EXCLUSAO': ITENS_FATURAS_EXCLUSAO,
+    }
+    partes = [VERSAO_EXTRATOR]
+    partes.extend(f'{nome}={valor!r}' for nome, valor in entradas.items())
+    partes.append(json.dumps(canonizador_itens.regras, sort_keys=True))
+    partes.append(detector_colunas.versao())
+    return hashlib.sha256('\n'.join(partes).encode()).hexdigest()[:16]
+
+
+cache_extracoes = cache_do_ambiente(versao_layouts())
+
+
+@app.route('/api/extract', methods=['GET', 'POST'])
 @cross_origin(origin='*', methods=['GET', 'POST'], allow_headers=['Content-Type'])
 def extrair_pdf():
-    if request.method == 'GET':
-        pdf_url = request.args.get('url')
+    medicao = Medicao()
+    perfilar = perfil_requisicoes.deve_perfilar(request.headers.get('X-Perfil'))
+    with medindo(medicao), (AmostradorPilhas(perfil_requisicoes.intervalo) if perfilar else nullcontext()) as amostrador:
+        result = extrair_requisicao()
+        with etapa('serializacao'):
+            resposta = responder(result)
+    medicao.registrar(result.get('status'))
+    if amostrador is not None:
+        logger.info('Perfil gravado em %s', perfil_requisicoes.gravar(amostrador, medicao.distribuidora, medicao.modelo))
+    return resposta
+
+
+def extrair_requisicao():
+    try:
+        campos = validar_campos(request.values.getlist('fields'))
+    except ValueError as erro:
+        return {'status': 400, 'message': str(erro)}
+
+    try:
+        if request.method == 'POST' and 'arquivo' in request.files:
+            conteudo = ler_envio(request.files['arquivo'])
+            return examina_conteudo(conteudo, campos, extrair=extrair_em_processo)
+
+        pdf_url = request.values.get('url')
         if not pdf_url:
-            return jsonify({'status': 400, 'message': 'Nenhum arquivo foi seledcionado'})
-        result = examina_pdf(pdf_url)
-        return jsonify(result)
+            return {'status': 400, 'message': 'Nenhum arquivo foi seledcionado'}
+        return examina_pdf(pdf_url, campos)
+    except ErroDownload as erro:
+        return {'status': 400, 'message': f'Não foi possível baixar o PDF: {erro}'}
+    except ERROS_EXTRACAO as erro:
+        return erro_extracao(erro)
+    except Exception as erro:
+        logger.exception('Falha na extração da fatura.')
+        return {'status': 500, 'message': f'Erro ao extrair os dados da fatura: {erro}'}
+
+
+@app.route('/api/extract/batch', methods=['POST'])
+@cross_origin(origin='*', methods=['POST'], allow_headers=['Content-Type'])
+def extrair_lote():
+    itens = []
+    if request.files:
+        try:
+            for arquivo in request.files.getlist('arquivos'):
+                itens.append((arquivo.filename, None, ler_envio(arquivo)))
+        except EnvioGrandeDemais as erro:
+            return jsonify(erro_extracao(erro))
+    else:
+        dados = request.get_json(silent=True) or {}
+        for pdf_url in dados.get('urls') or []:
+            itens.append((pdf_url, pdf_url, None))
+    if not itens:
+        return jsonify({'status': 400, 'message': 'Nenhum arquivo foi selecionado'})
+    if len(itens) > LOTE_TAMANHO_MAXIMO:
+        return jsonify({'status': 400, 'message': f'O lote excede o limite de {LOTE_TAMANHO_MAXIMO} faturas.'})
+    formato = MSGPACK if request.accept_mimetypes.best_match(formatos_disponiveis()) == MSGPACK else NDJSON
+    return Response(linhas_lote(itens, formato), mimetype=formato)
+
+
+@app.route('/api/extract/jobs', methods=['POST'])
+@cross_origin(origin='*', methods=['POST'], allow_headers=['Content-Type', 'Idempotency-Key', 'X-Inquilino'])
+def criar_tarefa():
+    dados = request.get_json(silent=True) or {}
+    try:
+        campos = validar_campos(request.values.getlist('fields') + list(dados.get('fields') or []))
+    except ValueError as erro:
+        return jsonify({'status': 400, 'message': str(erro)})
+
+    pdf_url = None
+    conteudo = None
+    if 'arquivo' in request.files:
+        try:
+            conteudo = ler_envio(request.files['arquivo'])
+        except EnvioGrandeDemais as erro:
+            return jsonify(erro_extracao(erro))
+    else:
+        pdf_url = dados.get('url') or request.values.get('url')
+    if not pdf_url and conteudo is None:
+        return jsonify({'status': 400, 'message': 'Nenhum arquivo foi selecionado'})
+
+    try:
+        tarefa, criada = executor_tarefas().enviar(
+            inquilino_requisicao(), url=pdf_url, conteudo=conteudo, campos=campos,
+            chave_idempotencia=request.headers.get('Idempotency-Key'))
+    except ConflitoIdempotencia as erro:
+        return jsonify({'status': 409, 'message': str(erro)})
+    return jsonify({'status': 202,
+                    'message': 'Tarefa criada.' if criada else 'Tarefa já existente para esta chave de idempotência.',
+                    'data': descrever(tarefa)})
+
+
+@app.route('/api/extract/jobs/<identificador>', methods=['GET'])
+@cross_origin(origin='*', methods=['GET'], allow_headers=['Content-Type', 'X-Inquilino'])
+def consultar_tarefa(identificador):
+    try:
+        espera = min(float(request.args.get('aguardar') or 0), TAREFAS_ESPERA_MAXIMA)
+    except ValueError:
+        return jsonify({'status': 400, 'message': 'O parâmetro aguardar deve ser um número de segundos.'})
+
+    fila = executor_tarefas().fila
+    tarefa = fila.obter(identificador)
+    if tarefa is None or tarefa.inquilino != inquilino_requisicao():
+        return jsonify({'status': 404, 'message': 'Tarefa não encontrada.'})
+    if espera > 0:
+        tarefa = fila.aguardar(identificador, espera)
+    return responder({'status': 200, 'data': descrever(tarefa)})
+
+
+def responder(dados):
+    """Resposta no formato pedido pelo cabeçalho ``Accept`` (JSON, NDJSON ou msgpack), JSON por padrão."""
+    formato = request.accept_mimetypes.best_match(formatos_disponiveis(), default=JSON)
+    return Response(codificar(dados, formato), mimetype=formato)
+
+
+def inquilino_requisicao():
+    return request.headers.get('X-Inquilino') or 'padrao'
+
+
+@app.route('/api/historico/unidades/<unidade_consumidora>', methods=['GET'])
+@cross_origin(origin='*', methods=['GET'], allow_headers=['Content-Type'])
+def historico_unidade(unidade_consumidora):
+    if historico_faturas is None:
+        return jsonify({'status': 404, 'message': 'O histórico de faturas não está habilitado (HISTORICO_SQLITE).'})
+    try:
+        inicio, fim = periodos_requisicao()
+    except ValueError as erro:
+        return jsonify({'status': 400, 'message': str(erro)})
+    faturas = historico_faturas.faturas(
+        unidade_consumidora, inicio, fim, distribuidora=request.args.get('distribuidora'),
+        lancamentos=request.args.get('lancamentos', '').lower() in ('1', 'true', 'sim'))
+    return responder({'status': 200, 'data': faturas})
+
+
+@app.route('/api/historico/agregados', methods=['GET'])
+@cross_origin(origin='*', methods=['GET'], allow_headers=['Content-Type'])
+def historico_agregados():
+    if historico_faturas is None:
+        return jsonify({'status': 404, 'message': 'O histórico de faturas não está habilitado (HISTORICO_SQLITE).'})
+    agrupar = request.args.get('agrupar') or 'periodo'
+    if agrupar not in AGRUPAMENTOS:
+        return jsonify({'status': 400, 'message': f'O parâmetro agrupar deve ser um de: {", ".join(AGRUPAMENTOS)}.'})
+    try:
+        inicio, fim = periodos_requisicao()
+    except ValueError as erro:
+        return jsonify({'status': 400, 'message': str(erro)})
+    unidades = [unidade.strip() for texto in request.args.getlist('unidades')
+                for unidade in texto.split(',') if unidade.strip()]
+    agregados = historico_faturas.agregados(
+        agrupar, inicio, fim, distribuidora=request.args.get('distribuidora'), unidades=unidades)
+    return responder({'status': 200, 'data': agregados})
+
+
+def periodos_requisicao():
+    """Parâmetros ``inicio`` e ``fim`` da consulta ao histórico, normalizados para ``AAAA-MM``."""
+    return tuple(normalizar_periodo(request.args[nome]) if request.args.get(nome) else None
+                 for nome in ('inicio', 'fim'))
+
+
+def linhas_lote(itens, formato=NDJSON):
+    for resultado, medicao in _processa_lote(itens):
+        with medicao.etapa('serializacao'):
+            linha = codificar(resultado, formato)
+        medicao.registrar(resultado.get('status'))
+        yield linha
+
+
+baixador_pdf = baixador_do_ambiente()
+perfil_requisicoes = perfil_do_ambiente()
+orcamento_memoria = orcamento_do_ambiente()
+historico_faturas = historico_do_ambiente()
+
+
+def ler_envio(arquivo):
+    """PDF enviado na requisição, com o mesmo tamanho máximo dos downloads."""
+    return ler_fluxo(arquivo.stream, PDF_LIMITE_MEMORIA, baixador_pdf.tamanho_maximo)
+
 
+def baixar_pdf(pdf_url):
+    with etapa('download'):
+        return baixador_pdf.baixar(pdf_url)
 
-def examina_pdf(pdf_url):
-    conteudo_pdf = requests.get(pdf_url)
-    conteudo_pdf.raise_for_status()
-    conteudo_pdf = BytesIO(conteudo_pdf.content)
-    result_api = APILeitorFaturas(conteudo_pdf).extrair_documento()
-    if result_api['status'] == 400:
+
+def extrair_conteudo(conteudo, campos=None):
+    """Extrai um PDF em ``bytes`` ou ``ArquivoPDF`` (lido por ``mmap``), dentro do orçamento de memória do processo."""
+    with orcamento_memoria.reservar(tamanho_pdf(conteudo)), abrir_pdf(conteudo) as pdf:
+        leitor = APILeitorFaturas(pdf)
+        resultado = leitor.extrair_documento(campos)
+    with etapa('serializacao'):
+        resultado = normalizar(resultado)
+    if historico_faturas is not None and campos is None and resultado['status'] == 200:
+        registrar_historico(leitor, resultado['data'])
+    return resultado
+
+
+def registrar_historico(leitor, dados):
+    """Grava uma extração completa no histórico; uma falha do histórico não falha a extração."""
+    try:
+        with etapa('historico'):
+            registrada = historico_faturas.registrar(leitor.tipo_fatura, leitor.modelo, dados)
+    except sqlite3.Error:
+        logger.exception('Falha ao gravar a fatura %s no histórico.', dados.get('unidade_consumidora'))
+        return
+    if not registrada:
+        logger.debug('Fatura %s sem unidade consumidora ou referência; fora do histórico.', leitor.tipo_fatura)
+
+
+# Falhas da extração respondidas com um erro estruturado (``erro_extracao``).
+ERROS_EXTRACAO = (PSException, MemoriaInsuficiente, ErroTrabalhador)
+
+
+def erro_extracao(erro):
+    """Resposta para PDFs inválidos, as recusas do orçamento de memória e as falhas dos processos de extração."""
+    if isinstance(erro, PSException):
+        return {'status': 400, 'message': f'O arquivo não é um PDF válido: {erro}', 'erro': {'tipo': 'pdf_invalido'}}
+    if isinstance(erro, PrazoExcedido):
+        return {'status': 504, 'message': str(erro), 'erro': {'tipo': 'prazo_excedido', 'prazo_segundos': erro.prazo}}
+    if isinstance(erro, LimiteExcedido):
+        return {'status': 422, 'message': str(erro), 'erro': {'tipo': 'limite_excedido', 'limite': erro.limite}}
+    if isinstance(erro, ErroTrabalhador):
+        return {'status': 500, 'message': str(erro), 'erro': {'tipo': 'processo_encerrado'}}
+    status = 413 if isinstance(erro, DocumentoGrandeDemais) else 503
+    return {'status': status, 'message': str(erro)}
+
+
+def extrair_conteudo_medido(conteudo, campos=None, intervalo_perfil=None):
+    """``extrair_conteudo`` para os processos de extração: devolve também as medições das etapas.
+
+    Com ``intervalo_perfil``, a extração é perfilada e as pilhas amostradas vão junto com as medições.
+    Os itens não mapeados pelo canonizador também vão junto, para serem contados em ``incorporar_medicao``.
+    """
+    with medindo(Medicao()) as medicao, canonizador_itens.coletando() as nao_mapeados, \
+            (AmostradorPilhas(intervalo_perfil) if intervalo_perfil else nullcontext()) as amostrador:
+        resultado = extrair_conteudo(conteudo, campos)
+    dados = medicao.dados()
+    dados['nao_mapeados'] = nao_mapeados
+    if amostrador is not None:
+        dados['pilhas'] = dict(amostrador.pilhas)
+    return resultado, dados
+
+
+def extrair_em_processo(conteudo, campos=None):
+    """Extrai no pool de processos, levando as medições (e o perfil, se houver) para a requisição corrente."""
+    amostrador = amostrador_atual()
+    intervalo_perfil = amostrador.intervalo if amostrador is not None else None
+    resultado, dados_medicao = executor_extracao().submit(extrair_conteudo_medido, conteudo, campos, intervalo_perfil).result()
+    pilhas = dados_medicao.pop('pilhas', None)
+    if pilhas:
+        amostrador.incorporar(pilhas)
+    incorporar_medicao(medicao_atual(), dados_medicao)
+    return resultado
+
+
+def incorporar_medicao(medicao, dados_medicao):
+    """Leva para este processo o que ``extrair_conteudo_medido`` devolveu além do resultado."""
+    canonizador_itens.contar(dados_medicao.pop('nao_mapeados', ()))
+    if medicao is not None:
+        medicao.incorporar(dados_medicao)
+
+
+def baixar_pdf_medido(medicao, pdf_url):
+    with medindo(medicao):
+        return baixar_pdf(pdf_url)
+
+
+def examina_pdf(pdf_url, campos=None):
+    return examina_conteudo(baixar_pdf(pdf_url), campos, extrair=extrair_em_processo)
+
+
+def consulta_cache(chave):
+    """Resultado guardado para ``chave``; a medição corrente recebe a classificação guardada junto."""
+    with etapa('cache'):
+        entrada = cache_extracoes.obter(chave)
+    if entrada is None:
+        return None
+    medicao = medicao_atual()
+    if medicao is not None:
+        medicao.cache = True
+        medicao.classificar(*entrada['classificacao'])
+    return entrada['resultado']
+
+
+def guardar_cache(chave, resultado, medicao=None):
+    """Guarda o resultado com a distribuidora e o modelo da medição (a corrente, se não informada)."""
+    medicao = medicao or medicao_atual()
+    classificacao = (medicao.distribuidora, medicao.modelo) if medicao is not None else (
+        DISTRIBUIDORA_DESCONHECIDA, DISTRIBUIDORA_DESCONHECIDA)
+    cache_extracoes.guardar(chave, {'resultado': resultado, 'classificacao': classificacao})
+
+
+def filtrar_campos(result_api, campos):
+    if campos is None or 'data' not in result_api:
         return result_api
+    return {**result_api, 'data': {campo: result_api['data'][campo] for campo in campos}}
+
+
+def examina_conteudo(conteudo, campos=None, extrair=extrair_conteudo):
+    """Extrai (ou busca no cache) o resultado de um PDF.
+
+    Com ``campos``, uma extração completa já guardada é filtrada; senão, só os
+    campos pedidos são extraídos e guardados em uma chave própria.
+    """
+    chave = cache_extracoes.chave(conteudo)
+    result_api = consulta_cache(chave)
+    if result_api is not None:
+        return filtrar_campos(result_api, campos)
+    if campos is not None:
+        chave = f'{chave}:{",".join(campos)}'
+        result_api = consulta_cache(chave)
+    if result_api is None:
+        result_api = extrair(conteudo, campos)
+        guardar_cache(chave, result_api)
     return result_api
 
 
+_executores = {}
+_executores_lock = threading.Lock()
+
+
+def executor_downloads():
+    with _executores_lock:
+        if 'downloads' not in _executores:
+            _executores['downloads'] = ThreadPoolExecutor(max_workers=LOTE_THREADS_DOWNLOAD)
+        return _executores['downloads']
+
+
+def executor_extracao():
+    with _executores_lock:
+        if 'extracao' not in _executores:
+            _executores['extracao'] = pool_do_ambiente(LOTE_PROCESSOS_EXTRACAO, precarregar=('app',))
+        return _executores['extracao']
+
+
+def executor_tarefas():
+    with _executores_lock:
+        if 'tarefas' not in _executores:
+            _executores['tarefas'] = ExecutorTarefas(fila_do_ambiente(), processa_tarefa, threads=TAREFAS_THREADS).iniciar()
+        return _executores['tarefas']
+
+
+def iniciar_executores():
+    """Inicia os processos de extração e, depois deles, as threads que retomam e consomem a fila de tarefas."""
+    executor_extracao()
+    executor_tarefas()
+
+
+@app.before_request
+def garantir_executores():
+    # Sob um servidor WSGI qualquer, a fila volta a ser consumida já na primeira requisição, e não só no
+    # primeiro pedido de tarefa.
+    if 'tarefas' not in _executores:
+        iniciar_executores()
+
+
+def encerrar_executores():
+    """Conclui as tarefas em execução e encerra os pools de download e de extração."""
+    with _executores_lock:
+        executores = dict(_executores)
+        _executores.clear()
+    if 'tarefas' in executores:
+        executores['tarefas'].parar()
+    for nome in ('downloads', 'extracao'):
+        if nome in executores:
+            executores[nome].shutdown()
+
+
+def processa_tarefa(tarefa):
+    """Executa uma tarefa da fila: baixa o PDF (se necessário) e extrai no pool de processos, usando o cache."""
+    medicao = Medicao()
+    with medindo(medicao):
+        try:
+            conteudo = tarefa.conteudo if tarefa.conteudo is not None else baixar_pdf(tarefa.url)
+            resultado = examina_conteudo(conteudo, tarefa.campos, extrair=extrair_em_processo)
+        except ErroDownload as erro:
+            resultado = {'status': 400, 'message': f'Não foi possível baixar o PDF: {erro}'}
+        except ERROS_EXTRACAO as erro:
+            resultado = erro_extracao(erro)
+    medicao.registrar(resultado.get('status'))
+    return resultado
+
+
+def _processa_lote(itens):
+    """Processa um lote de faturas, gerando ``(resultado, medicao)`` de cada item assim que ele termina.
+
+    Cada item é uma tupla ``(origem, url, conteudo)``: itens com ``url`` são
+    baixados no pool de threads e os demais já trazem os bytes do PDF. PDFs
+    já presentes no cache são respondidos na hora; os demais são extraídos
+    no pool de processos, de modo que uma fatura lenta ou inválida não
+    atrasa as demais. Quem consome registra a medição depois de serializar
+    o resultado.
+    """
+    pendentes = {}
+
+    def extrair(indice, origem, conteudo, medicao):
+        chave = cache_extracoes.chave(conteudo)
+        with medindo(medicao):
+            resultado = consulta_cache(chave)
+        if resultado is None:
+            pendentes[executor_extracao().submit(extrair_conteudo_medido, conteudo)] = (indice, origem, chave, medicao)
+        return resultado
+
+    for indice, (origem, pdf_url, conteudo) in enumerate(itens):
+        medicao = Medicao()
+        if pdf_url is not None:
+            pendentes[executor_downloads().submit(baixar_pdf_medido, medicao, pdf_url)] = (indice, origem, None, medicao)
+            continue
+        resultado = extrair(indice, origem, conteudo, medicao)
+        if resultado is not None:
+            yield {'indice': indice, 'origem': origem, **resultado}, medicao
+
+    while pendentes:
+        concluidos, _ = wait(pendentes, return_when=FIRST_COMPLETED)
+        for futuro in concluidos:
+            indice, origem, chave, medicao = pendentes.pop(futuro)
+            try:
+                resultado = futuro.result()
+            except Exception as erro:
+                if chave is None:
+                    resultado = {'status': 400, 'message': f'Não foi possível baixar o PDF: {erro}'}
+                elif isinstance(erro, ERROS_EXTRACAO):
+                    resultado = erro_extracao(erro)
+                else:
+                    resultado = {'status': 500, 'message': f'Erro ao extrair os dados da fatura: {erro}'}
+            else:
+                if chave is None:
+                    resultado = extrair(indice, origem, resultado, medicao)
+                    if resultado is None:
+                        continue
+                else:
+                    resultado, dados_medicao = resultado
+                    incorporar_medicao(medicao, dados_medicao)
+                    guardar_cache(chave, resultado, medicao)
+            yield {'indice': indice, 'origem': origem, **resultado}, medicao
+
+
+# A aplicação está inicializada.
+pronto.set()
+
+
 if __name__ == '__main__':
+   # Servidor de desenvolvimento; em produção, use servidor.py.
+   logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
    port = int(os.environ.get('PORT', 8080))
-   app.run(host='0.0.0.0', port=port, debug=True)
-
-# caminho_faturas = os.path.join(os.getcwd(), 'Faturas')
-# os.listdir(caminho_faturas)
-# lista_caminhos_pdfs = [os.path.join(caminho_faturas,arq) for arq in os.listdir(caminho_faturas) if arq.endswith('.pdf')]
-# for index, item in enumerate(lista_caminhos_pdfs):
-#     print('-'*50)
-#     print(f'{index} - {item}')
-#     result_api = APILeitorFaturas(item).extrair_documento()
+   # Inicia os processos de extração e retoma as tarefas que ficaram na fila antes do reinício.
+   iniciar_executores()
+   app.run(host='0.0.0.0', port=port, debug=os.environ.get('FLASK_DEBUG') == '1')
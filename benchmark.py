@@ -0,0 +1,331 @@
+"""Benchmark da extração com faturas sintéticas.
+
+Gera localmente um PDF para cada layout suportado (COPEL, CPFL, ENERGISA e
+CELESC modelos 1, 2 e 3), com o texto posicionado nas regiões de
+``layouts.json``, e mede a latência de cada etapa, a vazão (faturas por
+segundo por núcleo) e o pico de memória. O resultado é gravado em JSON para
+ser comparado entre commits:
+
+    python benchmark.py --repeticoes 50 --processos 4 --saida resultado.json
+    python benchmark.py --comparar resultado.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import app
+from campos import campos_cabecalho
+from classificacao import ClassificadorFaturas
+from pdf_sintetico import gerar_pdf
+
+ENTRELINHA = 10
+
+# Conteúdo de cada fatura sintética: linhas de texto por região de layout,
+# escritas a partir do canto superior esquerdo da região, e textos avulsos
+# (página, x, top, texto) para a identificação da distribuidora.
+CABECALHO_COPEL = ['UC 12345678 REF 08/2023', 'VENC 10/09/2023 15/09/2023', 'CONSUMO 450 kWh', 'R$ 1.234,56']
+CABECALHO_CELESC = ['UC 87654321 REF 06/2023', 'VENC 10/07/2023 R$ 321,00', '300 kWh']
+CABECALHO_CELESC2_3 = ['UC 11223344 REF 05/2023', 'VENC 10/06/2023 R$ 777,00', '500 kWh']
+
+ITENS_CELESC2_3 = {
+    'item_fatura': ['(001)Consumo Ponta TUSD', '(002)Consumo Fora Ponta TUSD', 'Energia Reativa Excedente'],
+    'quantidade': ['120', '380', '10'],
+    'valor': ['100,00', '200,00', '5,00'],
+}
+
+FATURAS_SINTETICAS = {
+    'COPEL': {
+        'paginas': 3,
+        'regioes': {
+            ('COPEL', 'dados'): CABECALHO_COPEL,
+            ('COPEL', 'dias'): ['30'],
+            ('COPEL', 'bandeira'): ['TARIFA HORARIA VERDE 30'],
+            ('COPEL', 'item_fatura'): ['TE CDE COVID PONTA', 'TE CDE COVID FORA PONTA', 'DEMANDA DE DISTRIBUICAO TUSD', 'ILUM PUBLICA', 'TE CDE COVID PONTA'],
+            ('COPEL', 'quantidade'): ['100,00', '1.200,00', '80,00', '1,00', '10,00'],
+            ('COPEL', 'valor'): ['50,00', '500,00', '900,00', '30,00', '5,00'],
+        },
+        'textos': [(0, 10, 800, 'Copel Distribuição S.A.')],
+    },
+    'CPFL': {
+        'paginas': 2,
+        'regioes': {
+            ('CPFL', 'dados'): ['UC 123456789 Conta 09/2023', 'Venc 20/09/2023 R$ 987,65'],
+            ('CPFL', 'bandeira'): ['Amarela', '15 Dias'],
+            ('CPFL', 'consumo_total_in'): ['1.500,5'],
+            ('CPFL', 'consumo_total_out'): ['250,25'],
+            ('CPFL', 'item_fatura'): ['Cons Ponta TE', 'Cons FPonta TE', 'Demanda', 'Multa'],
+            ('CPFL', 'quantidade'): ['200', '900', '50', '1'],
+            ('CPFL', 'valor'): ['80,00', '300,00', '400,00', '9,99'],
+        },
+        'textos': [(0, 10, 800, 'Cia Piratininga de Forca e Luz')],
+    },
+    'ENERGISA': {
+        'paginas': 1,
+        'regioes': {
+            ('ENERGISA', 'dados'): ['UC A1234567890 REF 07/2023', 'BANDEIRA TARIFARIA VERDE', 'VENC 05/08/2023 05/08/2023', 'KWH 1.234,00 R$ 555,55'],
+            ('ENERGISA', 'item_fatura'): ['L ANÇAMENTOS E SERVIÇOS', 'Consumo em kWh - Ponta', 'Consumo em kWh - Fora Ponta', 'Contrib Ilum Publica'],
+            ('ENERGISA', 'quantidade'): ['', '100', '800', '1'],
+            ('ENERGISA', 'valor'): ['', '60,00', '400,00', '20,00'],
+        },
+        'textos': [(0, 10, 800, 'ENERGISA MT')],
+    },
+    'CELESC1': {
+        'paginas': 1,
+        'regioes': {
+            ('CELESC', 'dados'): CABECALHO_CELESC,
+            ('CELESC', 'bandeira_tarifa1'): ['Bandeira Verde 30'],
+            ('CLASSIFICACAO', 'modelo_celesc'): ['LEGENDA'],
+            ('CELESC1', 'item_fatura'): ['(001)Consumo TUSD', '(002)Consumo TE', 'Demanda', 'COSIP', 'TOTAL'],
+            ('CELESC1', 'quantidade'): ['150', '150', '30', '1', ''],
+            ('CELESC1', 'valor'): ['100,00', '90,00', '50,00', '10,00', '250,00'],
+        },
+        'textos': [(0, 100, 800, 'Celesc Distribuicao')],
+    },
+    'CELESC2': {
+        'paginas': 2,
+        'regioes': {
+            ('CELESC', 'dados'): CABECALHO_CELESC2_3,
+            ('CELESC', 'bandeira_tarifa2'): ['Bandeira Amarela 12'],
+            ('CLASSIFICACAO', 'modelo_celesc'): ['NOTA'],
+            **{('CELESC2_3', nome): linhas for nome, linhas in ITENS_CELESC2_3.items()},
+        },
+        'textos': [(0, 100, 800, 'CELESC')],
+    },
+    'CELESC3': {
+        'paginas': 3,
+        'regioes': {
+            ('CELESC', 'dados'): CABECALHO_CELESC2_3,
+            ('CELESC', 'bandeira_tarifa2'): ['Bandeira Amarela 12'],
+            ('CLASSIFICACAO', 'modelo_celesc'): ['NOTA'],
+            **{('CELESC2_3', nome): linhas for nome, linhas in ITENS_CELESC2_3.items()},
+            ('CELESC3', 'item_fatura'): ['Consumo Ponta TE', 'Consumo Fora Ponta TE', 'TOTAL'],
+            ('CELESC3', 'quantidade'): ['120', '380', ''],
+            ('CELESC3', 'valor'): ['70,00', '150,00', '525,00'],
+        },
+        'textos': [(0, 100, 800, 'CELESC')],
+    },
+}
+
+ETAPAS = ('abertura', 'classificacao', 'regioes', 'cabecalho', 'agregacao', 'serializacao', 'total')
+
+
+def gerar_faturas(layouts=None):
+    """Gera os PDFs sintéticos a partir das coordenadas do registro de layouts."""
+    layouts = layouts or app.LAYOUTS
+    faturas = {}
+    for nome, fatura in FATURAS_SINTETICAS.items():
+        paginas = [[] for _ in range(fatura['paginas'])]
+        for (layout, regiao), linhas in fatura['regioes'].items():
+            pagina, (x0, top, _, _) = layouts[layout][regiao].pagina, layouts[layout][regiao].coordenadas
+            for numero, linha in enumerate(linhas):
+                if linha:
+                    paginas[pagina].append((x0 + 1, top + 4 + numero * ENTRELINHA, linha))
+        for pagina, x, top, texto in fatura['textos']:
+            paginas[pagina].append((x, top, texto))
+        faturas[nome] = gerar_pdf(paginas)
+    return faturas
+
+
+def _cronometrar(tempos, etapa, funcao, *args):
+    inicio = time.perf_counter()
+    resultado = funcao(*args)
+    tempos[etapa].append(time.perf_counter() - inicio)
+    return resultado
+
+
+def medir_etapas(conteudo, tempos):
+    """Executa as etapas da extração separadamente, acumulando a duração de cada uma em ``tempos``."""
+    # Classificador novo: mede a leitura de todas as regiões de classificação, sem resultado anterior.
+    classificador = ClassificadorFaturas(app.TIPO_FATURA, app.TIPO_FATURA_CELESC, app.LAYOUTS['CLASSIFICACAO'])
+    leitor = app.APILeitorFaturas(io.BytesIO(conteudo))
+    sessao = _cronometrar(tempos, 'abertura', app.SessaoDocumento(io.BytesIO(conteudo)).abrir)
+    try:
+        tipo_fatura, modelo = _cronometrar(tempos, 'classificacao', classificador.classificar, sessao)
+
+        def ler_regioes():
+            # Colunas detectadas já guardadas depois da primeira repetição, como na API.
+            sessao.layouts[modelo] = app.detector_colunas.layout(sessao, modelo, app.LAYOUTS[modelo])
+            layout = sessao.layout(tipo_fatura)
+            textos = {nome: sessao.texto_regiao(layout, nome) for nome in layout}
+            return textos, list(app.paginas_itens(sessao, modelo))
+
+        textos, paginas = _cronometrar(tempos, 'regioes', ler_regioes)
+        cabecalho = _cronometrar(tempos, 'cabecalho', lambda: campos_cabecalho(tipo_fatura, textos.get).valores())
+        itens = _cronometrar(tempos, 'agregacao', leitor.agrega_itens_fatura, modelo, paginas)
+    finally:
+        sessao.fechar()
+
+    resultado = {'status': 200, 'data': {**cabecalho, 'lancamentos': itens['itens_fatura'], 'encargos': itens['encargos']}}
+    _cronometrar(tempos, 'serializacao', app.app.json.dumps, resultado)
+    _cronometrar(tempos, 'total', app.extrair_conteudo, conteudo)
+
+
+def _estatisticas(amostras):
+    ordenadas = sorted(amostras)
+    p95 = ordenadas[min(len(ordenadas) - 1, round(0.95 * (len(ordenadas) - 1)))]
+    return {
+        'amostras': len(amostras),
+        'media_ms': round(statistics.fmean(amostras) * 1000, 4),
+        'mediana_ms': round(statistics.median(amostras) * 1000, 4),
+        'p95_ms': round(p95 * 1000, 4),
+        'min_ms': round(ordenadas[0] * 1000, 4),
+    }
+
+
+def medir_latencias(faturas, repeticoes, aquecimento=2):
+    resultado = {}
+    for nome, conteudo in faturas.items():
+        for _ in range(aquecimento):
+            medir_etapas(conteudo, {etapa: [] for etapa in ETAPAS})
+        tempos = {etapa: [] for etapa in ETAPAS}
+        for _ in range(repeticoes):
+            medir_etapas(conteudo, tempos)
+        resultado[nome] = {etapa: _estatisticas(amostras) for etapa, amostras in tempos.items()}
+    return resultado
+
+
+def _extrair_varias(conteudos):
+    for conteudo in conteudos:
+        app.extrair_conteudo(conteudo)
+    return len(conteudos)
+
+
+def medir_vazao(faturas, repeticoes, processos):
+    """Faturas por segundo extraindo o conjunto de layouts ``repeticoes`` vezes em ``processos`` processos."""
+    conteudos = list(faturas.values()) * repeticoes
+    if processos <= 1:
+        inicio = time.perf_counter()
+        total = _extrair_varias(conteudos)
+        duracao = time.perf_counter() - inicio
+    else:
+        partes = [conteudos[i::processos] for i in range(processos)]
+        with ProcessPoolExecutor(max_workers=processos) as executor:
+            # Aquece os processos (importações e primeira extração) antes de medir.
+            list(executor.map(_extrair_varias, [list(faturas.values())] * processos))
+            inicio = time.perf_counter()
+            total = sum(executor.map(_extrair_varias, partes))
+            duracao = time.perf_counter() - inicio
+    return {
+        'processos': processos,
+        'faturas': total,
+        'segundos': round(duracao, 4),
+        'faturas_por_segundo': round(total / duracao, 2),
+        'faturas_por_segundo_por_nucleo': round(total / duracao / processos, 2),
+    }
+
+
+def pico_memoria():
+    """Pico de RSS (KiB) deste processo e do maior processo filho já encerrado."""
+    if resource is None:
+        return {}
+    fator = 1024 if sys.platform == 'darwin' else 1  # macOS informa em bytes
+    return {
+        'rss_pico_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // fator,
+        'rss_pico_filhos_kib': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // fator,
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def executar(repeticoes=30, processos=1, layouts=None):
+    faturas = gerar_faturas()
+    if layouts:
+        faturas = {nome: faturas[nome] for nome in layouts}
+    latencias = medir_latencias(faturas, repeticoes)
+    vazao = medir_vazao(faturas, repeticoes, processos)
+    return {
+        'commit': _commit(),
+        'versao_extrator': app.VERSAO_EXTRATOR,
+        'data': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'nucleos': os.cpu_count(),
+        'repeticoes': repeticoes,
+        'latencias': latencias,
+        'vazao': vazao,
+        'memoria': pico_memoria(),
+    }
+
+
+def _resumo(resultado):
+    linhas = [f'{"layout":<10}' + ''.join(f'{etapa:>14}' for etapa in ETAPAS) + '   (mediana, ms)']
+    for nome, etapas in resultado['latencias'].items():
+        linhas.append(f'{nome:<10}' + ''.join(f'{etapas[etapa]["mediana_ms"]:>14.3f}' for etapa in ETAPAS))
+    vazao = resultado['vazao']
+    linhas.append(f'vazão: {vazao["faturas_por_segundo"]} faturas/s em {vazao["processos"]} processo(s), '
+                  f'{vazao["faturas_por_segundo_por_nucleo"]} por núcleo')
+    if resultado['memoria']:
+        linhas.append(f'pico de RSS: {resultado["memoria"]["rss_pico_kib"]} KiB '
+                      f'(filhos: {resultado["memoria"]["rss_pico_filhos_kib"]} KiB)')
+    return '\n'.join(linhas)
+
+
+def comparar(base, resultado):
+    """Variação percentual da mediana de cada etapa e da vazão em relação a um resultado anterior."""
+    linhas = [f'comparação com {base.get("commit") or "resultado anterior"} (variação da mediana; negativo é mais rápido)']
+    for nome, etapas in resultado['latencias'].items():
+        if nome not in base.get('latencias', {}):
+            continue
+        variacoes = []
+        for etapa in ETAPAS:
+            anterior = base['latencias'][nome].get(etapa, {}).get('mediana_ms')
+            variacoes.append(f'{(etapas[etapa]["mediana_ms"] / anterior - 1) * 100:>+13.1f}%' if anterior else f'{"-":>14}')
+        linhas.append(f'{nome:<10}' + ''.join(variacoes))
+    anterior = base.get('vazao', {}).get('faturas_por_segundo_por_nucleo')
+    if anterior:
+        atual = resultado['vazao']['faturas_por_segundo_por_nucleo']
+        linhas.append(f'vazão por núcleo: {anterior} -> {atual} ({(atual / anterior - 1) * 100:+.1f}%)')
+    return '\n'.join(linhas)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark da extração de faturas com PDFs sintéticos.')
+    parser.add_argument('--repeticoes', type=int, default=30, help='extrações medidas por layout (padrão: 30)')
+    parser.add_argument('--processos', type=int, default=1, help='processos usados na medição de vazão (padrão: 1)')
+    parser.add_argument('--layouts', nargs='+', choices=sorted(FATURAS_SINTETICAS), help='layouts a medir (padrão: todos)')
+    parser.add_argument('--saida', help='arquivo JSON de saída (padrão: saída padrão)')
+    parser.add_argument('--comparar', metavar='JSON', help='resultado anterior para comparar as medianas e a vazão')
+    parser.add_argument('--gerar-pdfs', metavar='PASTA', help='apenas grava os PDFs sintéticos na pasta indicada')
+    args = parser.parse_args(argv)
+
+    if args.gerar_pdfs:
+        os.makedirs(args.gerar_pdfs, exist_ok=True)
+        for nome, conteudo in gerar_faturas().items():
+            with open(os.path.join(args.gerar_pdfs, f'{nome}.pdf'), 'wb') as arquivo:
+                arquivo.write(conteudo)
+        return
+
+    resultado = executar(args.repeticoes, args.processos, args.layouts)
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(texto + '\n')
+    else:
+        print(texto)
+    print(_resumo(resultado), file=sys.stderr)
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as arquivo:
+            print(comparar(json.load(arquivo), resultado), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
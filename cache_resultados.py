@@ -0,0 +1,117 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from memoria import resumo_sha256
+from serializacao import de_json, para_json
+
+
+def chave_conteudo(conteudo, versao):
+    """Chave do cache: hash dos bytes do PDF (em memória ou em um ``ArquivoPDF``) combinado com a versão do extrator."""
+    return resumo_sha256(conteudo).hexdigest() + ':' + versao
+
+
+class CacheMemoria:
+    """Cache LRU em memória limitado pelo tamanho total dos resultados serializados."""
+
+    def __init__(self, limite_bytes):
+        self._limite_bytes = limite_bytes
+        self._entradas = OrderedDict()
+        self._tamanho = 0
+        self._lock = threading.Lock()
+
+    def obter(self, chave):
+        with self._lock:
+            texto = self._entradas.get(chave)
+            if texto is not None:
+                self._entradas.move_to_end(chave)
+            return texto
+
+    def guardar(self, chave, texto):
+        tamanho = len(texto)
+        if tamanho > self._limite_bytes:
+            return
+        with self._lock:
+            anterior = self._entradas.pop(chave, None)
+            if anterior is not None:
+                self._tamanho -= len(anterior)
+            self._entradas[chave] = texto
+            self._tamanho += tamanho
+            while self._tamanho > self._limite_bytes:
+                _, removido = self._entradas.popitem(last=False)
+                self._tamanho -= len(removido)
+
+
+class CacheSQLite:
+    """Cache em disco compartilhado entre os processos de um mesmo host."""
+
+    def __init__(self, caminho):
+        self._caminho = caminho
+        with self._conectar() as conexao:
+            conexao.execute('PRAGMA journal_mode=WAL')
+            conexao.execute(
+                'CREATE TABLE IF NOT EXISTS resultados ('
+                'chave TEXT PRIMARY KEY, resultado TEXT NOT NULL, criado_em REAL NOT NULL)'
+            )
+
+    def _conectar(self):
+        return sqlite3.connect(self._caminho, timeout=30)
+
+    def obter(self, chave):
+        conexao = self._conectar()
+        try:
+            linha = conexao.execute('SELECT resultado FROM resultados WHERE chave = ?', (chave,)).fetchone()
+        finally:
+            conexao.close()
+        return linha[0] if linha else None
+
+    def guardar(self, chave, texto):
+        conexao = self._conectar()
+        try:
+            with conexao:
+                conexao.execute(
+                    'INSERT OR REPLACE INTO resultados (chave, resultado, criado_em) VALUES (?, ?, ?)',
+                    (chave, texto, time.time())
+                )
+        finally:
+            conexao.close()
+
+
+class CacheResultados:
+    """Cache de extrações endereçado pelo conteúdo do PDF.
+
+    Consulta primeiro a memória e depois, se configurado, o SQLite; um
+    acerto no disco é promovido para a memória.
+    """
+
+    def __init__(self, versao, limite_memoria_bytes, caminho_sqlite=None):
+        self.versao = versao
+        self._memoria = CacheMemoria(limite_memoria_bytes)
+        self._disco = CacheSQLite(caminho_sqlite) if caminho_sqlite else None
+
+    def chave(self, conteudo):
+        return chave_conteudo(conteudo, self.versao)
+
+    def obter(self, chave):
+        texto = self._memoria.obter(chave)
+        if texto is None and self._disco is not None:
+            texto = self._disco.obter(chave)
+            if texto is not None:
+                self._memoria.guardar(chave, texto)
+        return de_json(texto) if texto is not None else None
+
+    def guardar(self, chave, resultado):
+        texto = para_json(resultado).decode()
+        self._memoria.guardar(chave, texto)
+        if self._disco is not None:
+            self._disco.guardar(chave, texto)
+
+
+def cache_do_ambiente(versao):
+    return CacheResultados(
+        versao,
+        limite_memoria_bytes=int(os.environ.get('CACHE_MEMORIA_BYTES', 64 * 1024 * 1024)),
+        caminho_sqlite=os.environ.get('CACHE_SQLITE') or None,
+    )
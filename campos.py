@@ -0,0 +1,289 @@
+import calendar
+import re
+from datetime import datetime
+from functools import lru_cache
+
+from dateutil.relativedelta import relativedelta
+
+# Campos do cabeçalho da fatura, na ordem em que aparecem na resposta.
+CAMPOS_CABECALHO = ('referencia', 'unidade_consumidora', 'vencimento', 'consumo_total', 'valor_fatura', 'bandeira', 'dias_bandeira')
+
+# Campos que dependem da leitura dos lançamentos (busca_itens_fatura).
+CAMPOS_ITENS = ('lancamentos', 'encargos', 'soma_consumo_total', 'consumo_total')
+
+CAMPOS_DISPONIVEIS = CAMPOS_CABECALHO + tuple(campo for campo in CAMPOS_ITENS if campo not in CAMPOS_CABECALHO)
+
+PADROES_DADOS = {
+    'referencia': r'\b(\d{2}/\d{4})\b',
+    'unidade_consumidora': r'\b\d{8,9}\b',
+    'vencimento': r'\b(\d{2}/\d{2}/\d{4})\b',
+    'consumo_total': r'\b(\d+\s?kWh)\b',
+    'valor_fatura': r'(?:R\$ ?)?([\d.]+,\d{2})',
+}
+
+PADROES_DADOS_ENERGISA = {
+    **PADROES_DADOS,
+    'unidade_consumidora': r'\b[A-Za-z]\d{10}\b',
+    'consumo_total': r'\bKWH\s([\d,.]+)\b',
+    'bandeira': r'TARIF[ÁA]RIA\s+(\w+)',
+}
+
+PADRAO_BANDEIRA_CELESC = re.compile(r'(Bandeira)\s+(\w+)\s+(\d{1,2})')
+PADRAO_BANDEIRA_CELESC_SEM_ROTULO = re.compile(r'(\w+)\s+(\d{1,2})')
+PADRAO_BANDEIRA_COPEL = re.compile(r'TARIFA HORARIA\s+(\S+)')
+PADRAO_BANDEIRA_CPFL = re.compile(r'(\S+)')
+PADRAO_DIAS_BANDEIRA_CPFL = re.compile(r'(\d+)\s+Dias')
+
+
+def converter_valor(texto):
+    return float(texto.replace('.', '').replace(',', '.'))
+
+
+def validar_campos(campos):
+    """Normaliza a lista de campos pedida pelo cliente; ``None`` quando nenhum foi informado."""
+    nomes = [nome.strip() for texto in campos for nome in texto.split(',') if nome.strip()]
+    if not nomes:
+        return None
+    desconhecidos = sorted(set(nomes) - set(CAMPOS_DISPONIVEIS))
+    if desconhecidos:
+        raise ValueError(f'Campos desconhecidos: {", ".join(desconhecidos)}.')
+    return tuple(campo for campo in CAMPOS_DISPONIVEIS if campo in nomes)
+
+
+class Varredor:
+    """Equivale a um ``findall`` por padrão, percorrendo o texto uma única vez para todos eles.
+
+    Os padrões são combinados em lookaheads opcionais, de modo que em cada
+    posição do texto todos são testados juntos; cada padrão mantém o fim da
+    sua última ocorrência para não aceitar ocorrências sobrepostas, como o
+    ``findall`` faria.
+    """
+
+    def __init__(self, padroes):
+        self.padroes = {nome: re.compile(padrao) for nome, padrao in padroes.items()}
+        self._combinar(tuple(sorted(self.padroes)))
+
+    @lru_cache(maxsize=64)
+    def _combinar(self, nomes):
+        partes = []
+        grupos = {}
+        indice = 1
+        for nome in nomes:
+            padrao = self.padroes[nome]
+            partes.append(f'(?=({padrao.pattern}))?')
+            grupos[nome] = (indice, padrao.groups)
+            indice += 1 + padrao.groups
+        # Só há ocorrência nas posições em que ao menos um dos padrões começa.
+        condicao = '(?!)'
+        for grupo, _ in reversed(list(grupos.values())):
+            condicao = f'(?({grupo})|{condicao})'
+        return re.compile(''.join(partes) + condicao), grupos
+
+    def varrer(self, texto, nomes):
+        nomes = tuple(sorted(nomes))
+        ocorrencias = {nome: [] for nome in nomes}
+        if not nomes:
+            return ocorrencias
+        combinado, grupos = self._combinar(nomes)
+        fim = dict.fromkeys(nomes, 0)
+        for encontrado in combinado.finditer(texto):
+            inicio = encontrado.start()
+            for nome, (grupo, subgrupos) in grupos.items():
+                if encontrado.start(grupo) < 0 or inicio < fim[nome]:
+                    continue
+                fim[nome] = encontrado.end(grupo)
+                if subgrupos == 0:
+                    valor = encontrado.group(grupo)
+                elif subgrupos == 1:
+                    valor = encontrado.group(grupo + 1) or ''
+                else:
+                    valor = tuple(encontrado.group(g) or '' for g in range(grupo + 1, grupo + 1 + subgrupos))
+                ocorrencias[nome].append(valor)
+        return ocorrencias
+
+
+VARREDOR_PADRAO = Varredor(PADROES_DADOS)
+VARREDOR_ENERGISA = Varredor(PADROES_DADOS_ENERGISA)
+
+
+def _mes_anterior(referencia):
+    try:
+        return datetime.strptime(referencia, '%m/%Y') - relativedelta(months=1)
+    except (TypeError, ValueError):
+        return None
+
+
+class CamposCabecalho:
+    """Campos do cabeçalho de uma fatura, calculados sob demanda.
+
+    ``regiao`` devolve o texto de uma região do layout da distribuidora; cada
+    região só é lida quando algum campo pedido precisa dela. Os padrões de
+    todos os campos pedidos são procurados no texto de ``dados`` em uma
+    única passada (``Varredor``).
+    """
+
+    varredor = VARREDOR_PADRAO
+
+    def __init__(self, regiao):
+        self._regiao = regiao
+        self._textos = {}
+        self._ocorrencias = {}
+        self._valores = {}
+
+    def texto(self, nome):
+        if nome not in self._textos:
+            self._textos[nome] = self._regiao(nome)
+        return self._textos[nome]
+
+    def dados(self):
+        return self.texto('dados') or ''
+
+    def requisitos(self, campo):
+        """Padrões de ``varredor`` usados para calcular ``campo``."""
+        return (campo,) if campo in self.varredor.padroes else ()
+
+    def ocorrencias(self, nome):
+        if nome not in self._ocorrencias:
+            self._ocorrencias.update(self.varredor.varrer(self.dados(), [nome]))
+        return self._ocorrencias[nome]
+
+    def primeira(self, nome):
+        ocorrencias = self.ocorrencias(nome)
+        return ocorrencias[0] if ocorrencias else None
+
+    def valores(self, campos=CAMPOS_CABECALHO):
+        faltantes = {padrao for campo in campos for padrao in self.requisitos(campo)} - set(self._ocorrencias)
+        if faltantes:
+            self._ocorrencias.update(self.varredor.varrer(self.dados(), faltantes))
+        return {campo: self.valor(campo) for campo in campos}
+
+    def valor(self, campo):
+        if campo not in self._valores:
+            self._valores[campo] = getattr(self, f'_{campo}')()
+        return self._valores[campo]
+
+    def _referencia(self):
+        return self.primeira('referencia')
+
+    def _unidade_consumidora(self):
+        return self.primeira('unidade_consumidora')
+
+    def _vencimento(self):
+        ocorrencias = self.ocorrencias('vencimento')
+        return ocorrencias[1] if len(ocorrencias) >= 2 else ocorrencias[0] if ocorrencias else None
+
+    def _consumo_total(self):
+        return self.primeira('consumo_total')
+
+    def _valor_fatura(self):
+        valor = self.primeira('valor_fatura')
+        return converter_valor(valor) if valor else None
+
+    def _bandeira(self):
+        return None
+
+    def _dias_bandeira(self):
+        return None
+
+
+class CamposCELESC(CamposCabecalho):
+    def _bandeira_e_dias(self):
+        texto = self.texto('bandeira_tarifa1') or ''
+        bandeira = PADRAO_BANDEIRA_CELESC.findall(texto)
+        if not bandeira:
+            bandeira = PADRAO_BANDEIRA_CELESC.findall(self.texto('bandeira_tarifa2') or '')
+            if not bandeira:
+                bandeira = PADRAO_BANDEIRA_CELESC_SEM_ROTULO.findall(texto)
+
+        if len(bandeira) == 1 and len(bandeira[0]) == 3:
+            return bandeira[0][1], bandeira[0][2]
+        if len(bandeira) == 1 and len(bandeira[0]) == 2:
+            return bandeira[0]
+        return (bandeira[0][1] if bandeira else None), None
+
+    def _bandeira(self):
+        return self.valor('bandeira_e_dias')[0]
+
+    def _dias_bandeira(self):
+        return self.valor('bandeira_e_dias')[1]
+
+
+class CamposCOPEL(CamposCabecalho):
+    def dados(self):
+        # O quadro da bandeira (página 2) também faz parte dos dados da COPEL.
+        return (self.texto('dados') or '') + (self.texto('bandeira') or '')
+
+    def _bandeira(self):
+        bandeira = PADRAO_BANDEIRA_COPEL.findall(self.texto('bandeira') or '')
+        return bandeira[0] if bandeira else None
+
+    def _dias_bandeira(self):
+        return self.texto('dias')
+
+
+class CamposMesAnterior(CamposCabecalho):
+    """Distribuidoras cuja referência impressa é o mês seguinte ao do consumo."""
+
+    def requisitos(self, campo):
+        if campo == 'dias_bandeira':
+            return ('referencia',)
+        return super().requisitos(campo)
+
+    def _referencia(self):
+        data = _mes_anterior(self.primeira('referencia'))
+        return data.strftime('%m/%Y') if data else None
+
+    def _dias_no_mes(self):
+        data = _mes_anterior(self.primeira('referencia'))
+        return calendar.monthrange(data.year, data.month)[1] if data else None
+
+    def _dias_bandeira(self):
+        return self._dias_no_mes()
+
+
+class CamposCPFL(CamposMesAnterior):
+    def _consumo_total(self):
+        consumo = self.primeira('consumo_total')
+        if consumo:
+            return consumo
+        consumo_in = self.texto('consumo_total_in')
+        consumo_out = self.texto('consumo_total_out')
+        if not consumo_in or not consumo_out:
+            return None
+        try:
+            return converter_valor(consumo_in) + converter_valor(consumo_out)
+        except ValueError:
+            return None
+
+    def _bandeira(self):
+        bandeira = PADRAO_BANDEIRA_CPFL.findall(self.texto('bandeira') or '')
+        return bandeira[0] if bandeira else None
+
+    def _dias_bandeira(self):
+        dias = PADRAO_DIAS_BANDEIRA_CPFL.findall(self.texto('bandeira') or '')
+        return dias[0] if dias else self._dias_no_mes()
+
+
+class CamposENERGISA(CamposMesAnterior):
+    varredor = VARREDOR_ENERGISA
+
+    def _consumo_total(self):
+        try:
+            return sum(converter_valor(numero) for numero in self.ocorrencias('consumo_total'))
+        except ValueError:
+            return None
+
+    def _bandeira(self):
+        return self.primeira('bandeira')
+
+
+CAMPOS_POR_DISTRIBUIDORA = {
+    'CELESC': CamposCELESC,
+    'COPEL': CamposCOPEL,
+    'CPFL': CamposCPFL,
+    'ENERGISA': CamposENERGISA,
+}
+
+
+def campos_cabecalho(distribuidora, regiao):
+    return CAMPOS_POR_DISTRIBUIDORA.get(distribuidora, CamposCabecalho)(regiao)
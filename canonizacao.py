@@ -0,0 +1,140 @@
+import contextvars
+import json
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+
+CAMINHO_RENOMEACOES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'renomeacoes.json')
+
+TabelaCanonizacao = namedtuple('TabelaCanonizacao', ['prefixo', 'itens', 'padrao', 'grupos', 'ignorar'])
+
+_coleta_atual = contextvars.ContextVar('coleta_nao_mapeados', default=None)
+
+
+def normalizar(texto):
+    """Chave de comparação: sem acentos, sem diferença de caixa e com espaços simples."""
+    decomposto = unicodedata.normalize('NFKD', texto)
+    sem_acentos = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    return ' '.join(sem_acentos.casefold().split())
+
+
+def _compilar(distribuidora, regras, fatura_dict):
+    def nome_canonico(codigo, origem):
+        if codigo not in fatura_dict:
+            raise ValueError(f'Renomeação {distribuidora}: "{origem}" aponta para o item {codigo}, inexistente em FATURA_DICT.')
+        return fatura_dict[codigo]
+
+    itens = {}
+    for origem, codigo in regras.get('itens', {}).items():
+        chave = normalizar(origem)
+        nome = nome_canonico(codigo, origem)
+        if itens.get(chave, nome) != nome:
+            raise ValueError(f'Renomeação {distribuidora}: "{origem}" está mapeado para itens diferentes.')
+        itens[chave] = nome
+
+    grupos = {}
+    alternativas = []
+    for indice, (expressao, codigo) in enumerate(regras.get('padroes', {}).items()):
+        re.compile(expressao)
+        grupos[f'p{indice}'] = nome_canonico(codigo, expressao)
+        alternativas.append(f'(?P<p{indice}>{expressao})')
+    padrao = re.compile('|'.join(alternativas)) if alternativas else None
+
+    prefixos = regras.get('prefixos', [])
+    prefixo = re.compile('^(?:' + '|'.join(prefixos) + ')', re.DOTALL) if prefixos else None
+
+    ignorar = frozenset(normalizar(item) for item in regras.get('ignorar', []))
+    return TabelaCanonizacao(prefixo, itens, padrao, grupos, ignorar)
+
+
+class Canonizador:
+    """Converte os nomes dos lançamentos de cada distribuidora para os nomes de ``FATURA_DICT``.
+
+    As regras de cada distribuidora são compiladas uma vez: nomes exatos
+    viram um dicionário de chaves normalizadas, os padrões viram uma única
+    expressão regular com um grupo por padrão, e os prefixos a remover viram
+    outra. Itens que não correspondem a nenhuma regra seguem com o nome
+    original e são contados em ``nao_mapeados`` (até ``limite`` nomes
+    distintos). Dentro de ``coletando``, eles são guardados em uma lista em
+    vez de contados, para que um processo de extração os devolva junto com
+    o resultado e o processo que responde a requisição os conte com
+    ``contar``.
+    """
+
+    def __init__(self, regras, fatura_dict, conhecidos=(), limite=10000):
+        self.regras = regras
+        self._tabelas = {distribuidora: _compilar(distribuidora, r, fatura_dict) for distribuidora, r in regras.items()}
+        self._conhecidos = frozenset(normalizar(nome) for nome in (*fatura_dict.values(), *conhecidos))
+        self._lock = threading.Lock()
+        self._limite = limite
+        self.nao_mapeados = Counter()
+
+    def canonizar(self, distribuidora, itens):
+        tabela = self._tabelas.get(distribuidora)
+        if tabela is None:
+            return list(itens)
+        resultado = []
+        nao_mapeados = []
+        for item in itens:
+            if item is None:
+                resultado.append(item)
+                continue
+            if tabela.prefixo is not None:
+                item = tabela.prefixo.sub('', item, count=1)
+            chave = normalizar(item)
+            if chave in tabela.ignorar:
+                continue
+            nome = tabela.itens.get(chave)
+            if nome is None and tabela.padrao is not None:
+                encontrado = tabela.padrao.fullmatch(chave)
+                if encontrado:
+                    nome = next(tabela.grupos[grupo] for grupo, valor in encontrado.groupdict().items() if valor is not None)
+            if nome is None:
+                nome = item
+                if chave not in self._conhecidos:
+                    nao_mapeados.append((distribuidora, item))
+            resultado.append(nome)
+        coleta = _coleta_atual.get()
+        if coleta is not None:
+            coleta.extend(nao_mapeados)
+        else:
+            self.contar(nao_mapeados)
+        return resultado
+
+    def contar(self, nao_mapeados):
+        """Conta pares ``(distribuidora, item)`` não mapeados, inclusive os vindos de outro processo."""
+        if not nao_mapeados:
+            return
+        with self._lock:
+            for distribuidora, item in nao_mapeados:
+                chave = (distribuidora, item)
+                if chave in self.nao_mapeados or len(self.nao_mapeados) < self._limite:
+                    self.nao_mapeados[chave] += 1
+
+    @staticmethod
+    @contextmanager
+    def coletando():
+        """Guarda na lista devolvida, em vez de contar, os itens não mapeados canonizados dentro do bloco."""
+        coleta = []
+        token = _coleta_atual.set(coleta)
+        try:
+            yield coleta
+        finally:
+            _coleta_atual.reset(token)
+
+    def relatorio_nao_mapeados(self):
+        with self._lock:
+            contagem = self.nao_mapeados.most_common()
+        return [
+            {'distribuidora': distribuidora, 'item_fatura': item, 'ocorrencias': ocorrencias}
+            for (distribuidora, item), ocorrencias in contagem
+        ]
+
+
+def carregar_canonizador(fatura_dict, conhecidos=(), caminho=CAMINHO_RENOMEACOES):
+    with open(caminho, encoding='utf-8') as arquivo:
+        regras = json.load(arquivo)
+    return Canonizador(regras, fatura_dict, conhecidos)
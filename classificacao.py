@@ -0,0 +1,104 @@
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+from pdfminer.pdftypes import resolve1
+
+from layouts import extrair_textos_minimo
+
+Classificacao = namedtuple('Classificacao', ['tipo_fatura', 'modelo'])
+
+
+class FaturaNaoSuportada(Exception):
+    pass
+
+
+def impressao_digital(sessao):
+    """Identifica o modelo de PDF pelo gerador e pela geometria e fontes da primeira página.
+
+    Retorna ``None`` quando o PDF não traz Producer nem Creator, pois nesse
+    caso não há nada estável para diferenciar os geradores.
+    """
+    metadados = sessao.metadados
+    produtor = metadados.get('Producer')
+    criador = metadados.get('Creator')
+    if not produtor and not criador:
+        return None
+    pagina = sessao.pagina(0)
+    recursos = pagina.page_obj.resources
+    fontes = resolve1(recursos.get('Font')) or {}
+    nomes_fontes = sorted(f'{nome}={resolve1(fonte).get("BaseFont")}' for nome, fonte in fontes.items() if resolve1(fonte))
+    nomes_imagens = sorted(str(nome) for nome in (resolve1(recursos.get('XObject')) or {}))
+    partes = [str(produtor), str(criador), repr(pagina.mediabox), str(pagina.rotation), *nomes_fontes, *nomes_imagens]
+    return hashlib.sha1('\x1f'.join(partes).encode('utf-8', 'replace')).hexdigest()
+
+
+class ClassificadorFaturas:
+    """Identifica a distribuidora e o modelo da fatura lendo só as regiões de classificação da página 0.
+
+    O resultado vem sempre do texto das regiões: a impressão digital
+    (``impressao_digital``) identifica o gerador do PDF, não o conteúdo, e
+    PDFs de distribuidoras ou modelos diferentes podem ter a mesma. O último
+    resultado de cada impressão só escolhe as regiões lidas na primeira
+    passada: quando a impressão já levou a uma fatura de outra distribuidora
+    que não a CELESC, a região do modelo da CELESC não é lida, a menos que o
+    texto da fatura mostre que ela é da CELESC.
+    """
+
+    def __init__(self, tipos_fatura, tipos_fatura_celesc, layout, limite=4096):
+        self._tipos_fatura = tipos_fatura
+        self._tipos_fatura_celesc = tipos_fatura_celesc
+        self._regiao_tipo = layout['tipo_fatura']
+        self._regiao_modelo = layout['modelo_celesc']
+        self._limite = limite
+        self._impressoes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def classificar(self, sessao):
+        impressao = impressao_digital(sessao)
+        anterior = None
+        if impressao is not None:
+            with self._lock:
+                anterior = self._impressoes.get(impressao)
+        resultado = self._classificar(sessao, anterior)
+        if impressao is not None:
+            with self._lock:
+                self._impressoes[impressao] = resultado
+                self._impressoes.move_to_end(impressao)
+                while len(self._impressoes) > self._limite:
+                    self._impressoes.popitem(last=False)
+        return resultado
+
+    def _classificar(self, sessao, anterior=None):
+        pagina = sessao.pagina(self._regiao_tipo.pagina)
+        coordenadas = [self._regiao_tipo.coordenadas]
+        ler_modelo = anterior is None or anterior.tipo_fatura == 'CELESC'
+        if ler_modelo and self._regiao_modelo.pagina == self._regiao_tipo.pagina:
+            coordenadas.append(self._regiao_modelo.coordenadas)
+        textos = extrair_textos_minimo(pagina, coordenadas)
+
+        text = textos[self._regiao_tipo.coordenadas]
+        if not text:
+            raise FaturaNaoSuportada('Não foi possível extrair o tipo de fatura.')
+        tipo_fatura = None
+        for tipo in self._tipos_fatura:
+            if tipo[1] in text:
+                tipo_fatura = tipo[0]
+                break
+        for tipo in self._tipos_fatura_celesc:
+            if tipo[1] in text:
+                tipo_fatura = tipo[0]
+                break
+        if not tipo_fatura:
+            raise FaturaNaoSuportada('Tipo de fatura não reconhecido.')
+
+        if tipo_fatura != 'CELESC':
+            return Classificacao(tipo_fatura, tipo_fatura)
+        if self._regiao_modelo.coordenadas in textos:
+            modelo = textos[self._regiao_modelo.coordenadas]
+        else:
+            modelo = extrair_textos_minimo(sessao.pagina(self._regiao_modelo.pagina),
+                                           [self._regiao_modelo.coordenadas])[self._regiao_modelo.coordenadas]
+        if modelo and 'LEGENDA' in modelo:
+            return Classificacao(tipo_fatura, 'CELESC1')
+        return Classificacao(tipo_fatura, 'CELESC2_3')
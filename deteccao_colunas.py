@@ -0,0 +1,244 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from classificacao import impressao_digital
+from layouts import COLUNAS_ITENS, Regiao
+from metricas import etapa
+
+logger = logging.getLogger(__name__)
+
+PADRAO_NUMERO = re.compile(r'-?\d[\d.]*(,\d+)?-?')
+
+# Distância máxima (em pontos) entre palavras da mesma coluna.
+TOLERANCIA_COLUNA = 4
+# Quanto uma coluna pode ter se deslocado em relação às coordenadas de layouts.json.
+DESLOCAMENTO_MAXIMO = 40
+MARGEM = 1
+
+Coluna = namedtuple('Coluna', ['x0', 'x1', 'palavras', 'numeros'])
+
+
+def impressao_layout(sessao, modelo, regioes):
+    """Identifica o modelo de página: distribuidora e modelo, geometria, gerador e fontes, e as regiões configuradas."""
+    pagina = sessao.pagina(regioes[0].pagina)
+    partes = [modelo, repr(regioes), repr(pagina.mediabox), str(pagina.rotation), impressao_digital(sessao) or '']
+    return hashlib.sha1('\x1f'.join(partes).encode('utf-8', 'replace')).hexdigest()
+
+
+def agrupar_colunas(palavras, tolerancia=TOLERANCIA_COLUNA):
+    """Agrupa as palavras em colunas juntando os intervalos horizontais que se sobrepõem (ou quase)."""
+    colunas = []
+    for palavra in sorted(palavras, key=lambda palavra: palavra['x0']):
+        numero = PADRAO_NUMERO.fullmatch(palavra['text']) is not None
+        if colunas and palavra['x0'] <= colunas[-1].x1 + tolerancia:
+            coluna = colunas[-1]
+            colunas[-1] = Coluna(coluna.x0, max(coluna.x1, palavra['x1']), coluna.palavras + 1, coluna.numeros + numero)
+        else:
+            colunas.append(Coluna(palavra['x0'], palavra['x1'], 1, int(numero)))
+    return colunas
+
+
+def _distancia(coluna, x0, x1):
+    """Sobreposição (negativa) ou distância entre a coluna e o intervalo ``x0``-``x1``."""
+    return max(x0, coluna.x0) - min(x1, coluna.x1)
+
+
+def _sobrepostas(colunas, x0, x1):
+    return {indice for indice, coluna in enumerate(colunas) if _distancia(coluna, x0, x1) < 0}
+
+
+def ajustar_regioes(colunas, regioes, limites):
+    """Alarga as regiões configuradas até cobrirem as colunas de palavras associadas a elas.
+
+    Cada região é associada ao grupo de palavras mais próximo, até
+    ``DESLOCAMENTO_MAXIMO`` pontos de distância, e passa a ser a união da
+    região configurada com esse grupo: uma região só cresce (ou se desloca
+    crescendo), nunca perde texto que as coordenadas configuradas já
+    liam. Devolve ``None`` quando a associação não é coerente (a coluna do
+    item com texto, as demais com números, em ordem) ou quando uma região
+    alargada passaria a alcançar outra coluna de palavras ou a região
+    vizinha. ``limites`` são as coordenadas horizontais da página.
+    """
+    indices = []
+    for regiao in regioes:
+        x0, _, x1, _ = regiao.coordenadas
+        distancia, indice = min(((_distancia(coluna, x0, x1), indice) for indice, coluna in enumerate(colunas)),
+                                default=(None, None))
+        if indice is None or distancia > DESLOCAMENTO_MAXIMO:
+            return None
+        indices.append(indice)
+    if indices != sorted(set(indices)):
+        return None
+    item, *numericas = (colunas[indice] for indice in indices)
+    if item.numeros * 2 >= item.palavras or any(coluna.numeros * 2 < coluna.palavras for coluna in numericas):
+        return None
+
+    ajustadas = []
+    for regiao, indice in zip(regioes, indices):
+        x0, topo, x1, base = regiao.coordenadas
+        coluna = colunas[indice]
+        novo_x0 = max(min(x0, coluna.x0 - MARGEM), limites[0])
+        novo_x1 = min(max(x1, coluna.x1 + MARGEM), limites[1])
+        if _sobrepostas(colunas, novo_x0, novo_x1) - _sobrepostas(colunas, x0, x1) - {indice}:
+            return None
+        ajustadas.append(Regiao(regiao.nome, regiao.pagina, (round(novo_x0, 1), topo, round(novo_x1, 1), base)))
+    if any(anterior.coordenadas[2] > seguinte.coordenadas[0] for anterior, seguinte in zip(ajustadas, ajustadas[1:])):
+        return None
+    return {regiao.nome: regiao for regiao in ajustadas}
+
+
+def detectar_colunas(pagina, regioes):
+    """Ajusta as colunas de item, quantidade e valor às posições das palavras na página.
+
+    ``regioes`` são as regiões configuradas de ``COLUNAS_ITENS``; as palavras
+    da faixa vertical delas (com ``DESLOCAMENTO_MAXIMO`` pontos de folga dos
+    lados) são agrupadas em colunas e as regiões são alargadas por
+    ``ajustar_regioes``. Devolve ``None`` quando não há ajuste coerente.
+    """
+    topo = min(regiao.coordenadas[1] for regiao in regioes)
+    base = max(regiao.coordenadas[3] for regiao in regioes)
+    esquerda = max(min(regiao.coordenadas[0] for regiao in regioes) - DESLOCAMENTO_MAXIMO, pagina.bbox[0])
+    direita = min(max(regiao.coordenadas[2] for regiao in regioes) + DESLOCAMENTO_MAXIMO, pagina.bbox[2])
+    palavras = pagina.within_bbox((esquerda, topo, direita, base)).extract_words()
+    return ajustar_regioes(agrupar_colunas(palavras), regioes, (pagina.bbox[0], pagina.bbox[2]))
+
+
+class LayoutsDetectados:
+    """Colunas detectadas por impressão de layout, em SQLite, com cópia em memória.
+
+    Uma impressão cuja detecção falhou fica registrada com ``None``, para
+    não ser detectada de novo. Vale a primeira detecção guardada de cada
+    impressão, mesmo quando dois processos a detectam ao mesmo tempo, e ela
+    não muda mais: o resultado de um documento depende só das colunas da
+    impressão dele, que são as mesmas enquanto o arquivo existir.
+    ``identificador`` distingue o arquivo (um arquivo novo pode detectar
+    colunas diferentes) e entra na chave do cache de resultados.
+    """
+
+    def __init__(self, caminho):
+        self._caminho = caminho
+        self._memoria = {}
+        self._lock = threading.Lock()
+        self._tabela_criada = False
+
+    def _conectar(self):
+        conexao = sqlite3.connect(self._caminho, timeout=30)
+        if not self._tabela_criada:
+            conexao.execute('PRAGMA journal_mode=WAL')
+            conexao.execute(
+                'CREATE TABLE IF NOT EXISTS layouts_detectados ('
+                'impressao TEXT PRIMARY KEY, modelo TEXT NOT NULL, regioes TEXT, criado_em REAL NOT NULL)'
+            )
+            conexao.execute('CREATE TABLE IF NOT EXISTS identificacao (identificador TEXT NOT NULL)')
+            with conexao:
+                conexao.execute('INSERT INTO identificacao SELECT ? WHERE NOT EXISTS (SELECT 1 FROM identificacao)',
+                                (uuid.uuid4().hex,))
+            self._tabela_criada = True
+        return conexao
+
+    def obter(self, impressao):
+        """``(encontrado, colunas)`` da impressão; ``colunas`` é ``None`` quando a detecção falhou."""
+        with self._lock:
+            if impressao in self._memoria:
+                return True, self._memoria[impressao]
+        conexao = self._conectar()
+        try:
+            linha = conexao.execute(
+                'SELECT regioes FROM layouts_detectados WHERE impressao = ?', (impressao,)).fetchone()
+        finally:
+            conexao.close()
+        if linha is None:
+            return False, None
+        colunas = None
+        if linha[0] is not None:
+            colunas = {nome: Regiao(nome, pagina, tuple(coordenadas))
+                       for nome, (pagina, coordenadas) in json.loads(linha[0]).items()}
+        with self._lock:
+            self._memoria[impressao] = colunas
+        return True, colunas
+
+    def guardar(self, impressao, modelo, colunas):
+        """Guarda as colunas da impressão, se nenhum processo guardou antes; devolve as que valem."""
+        regioes = None
+        if colunas is not None:
+            regioes = json.dumps({nome: (regiao.pagina, regiao.coordenadas) for nome, regiao in colunas.items()})
+        conexao = self._conectar()
+        try:
+            with conexao:
+                conexao.execute(
+                    'INSERT OR IGNORE INTO layouts_detectados (impressao, modelo, regioes, criado_em) VALUES (?, ?, ?, ?)',
+                    (impressao, modelo, regioes, time.time()))
+        finally:
+            conexao.close()
+        return self.obter(impressao)[1]
+
+    def identificador(self):
+        conexao = self._conectar()
+        try:
+            return conexao.execute('SELECT identificador FROM identificacao').fetchone()[0]
+        finally:
+            conexao.close()
+
+
+class DetectorColunas:
+    """Ajusta as colunas da tabela de lançamentos de cada modelo de página às posições reais das palavras.
+
+    Na primeira vez que uma impressão de layout (``impressao_layout``) é
+    vista, as colunas de item, quantidade e valor são ajustadas às palavras
+    da página (``detectar_colunas``) e guardadas; os documentos seguintes
+    com a mesma impressão usam as colunas guardadas sem nova detecção.
+    Quando a detecção falha, as coordenadas de ``layouts.json`` continuam
+    valendo. Sem ``layouts_detectados`` (o padrão), nada é ajustado.
+    """
+
+    def __init__(self, layouts_detectados=None):
+        self.layouts_detectados = layouts_detectados
+
+    @property
+    def ativo(self):
+        return self.layouts_detectados is not None
+
+    def versao(self):
+        """Parte da versão do cache que depende das colunas detectadas; vazia sem detecção."""
+        return f'deteccao={self.layouts_detectados.identificador()}' if self.ativo else ''
+
+    def layout(self, sessao, modelo, layout):
+        """``layout`` do modelo com as colunas de lançamentos detectadas para o documento da sessão."""
+        if not self.ativo or any(coluna not in layout for coluna in COLUNAS_ITENS):
+            return layout
+        regioes = [layout[coluna] for coluna in COLUNAS_ITENS]
+        if len({regiao.pagina for regiao in regioes}) != 1:
+            return layout
+        impressao = impressao_layout(sessao, modelo, regioes)
+        encontrado, colunas = self.layouts_detectados.obter(impressao)
+        if not encontrado:
+            with etapa('deteccao'):
+                colunas = detectar_colunas(sessao.pagina(regioes[0].pagina), regioes)
+            if colunas is None:
+                logger.warning('Colunas de lançamentos do modelo %s não detectadas; usando layouts.json.', modelo)
+            else:
+                logger.info('Colunas de lançamentos do modelo %s detectadas: %s.', modelo,
+                            ', '.join(f'{nome} {regiao.coordenadas}' for nome, regiao in colunas.items()))
+            colunas = self.layouts_detectados.guardar(impressao, modelo, colunas)
+        if colunas is None:
+            return layout
+        return {**layout, **colunas}
+
+
+def detector_do_ambiente():
+    """Detecção só com ``DETECCAO_COLUNAS=1``; as colunas são compartilhadas pelo SQLite de ``LAYOUTS_DETECTADOS_SQLITE``."""
+    if os.environ.get('DETECCAO_COLUNAS', '0') != '1':
+        return DetectorColunas()
+    caminho = os.environ.get('LAYOUTS_DETECTADOS_SQLITE')
+    if not caminho:
+        raise ValueError('DETECCAO_COLUNAS=1 requer LAYOUTS_DETECTADOS_SQLITE (arquivo em que as colunas detectadas '
+                         'são guardadas e compartilhadas pelos processos).')
+    return DetectorColunas(LayoutsDetectados(caminho))
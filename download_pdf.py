@@ -0,0 +1,140 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from memoria import PDF_LIMITE_MEMORIA, TAMANHO_PARTE, guardar_partes, tamanho_pdf
+
+
+class ErroDownload(Exception):
+    pass
+
+
+class PDFMuitoGrande(ErroDownload):
+    pass
+
+
+class BaixadorPDF:
+    """Baixa PDFs reaproveitando conexões keep-alive.
+
+    Aplica timeouts de conexão e leitura, limita o tamanho do arquivo durante
+    o streaming, repete falhas transitórias com backoff e usa ETag /
+    Last-Modified para requisições condicionais. Downloads simultâneos da
+    mesma URL são unificados em uma única requisição. Corpos maiores que
+    ``limite_memoria`` são gravados em um arquivo temporário e devolvidos
+    como ``ArquivoPDF``; os demais, como ``bytes``.
+    """
+
+    def __init__(self, tamanho_maximo, timeout_conexao, timeout_leitura, tentativas, backoff, conexoes,
+                 limite_validados_bytes, limite_memoria=PDF_LIMITE_MEMORIA):
+        self.tamanho_maximo = tamanho_maximo
+        self._limite_memoria = limite_memoria
+        self._timeout = (timeout_conexao, timeout_leitura)
+        self._limite_validados_bytes = limite_validados_bytes
+        retry = Retry(
+            total=tentativas,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=conexoes, pool_maxsize=conexoes, max_retries=retry)
+        self._sessao = requests.Session()
+        self._sessao.mount('http://', adapter)
+        self._sessao.mount('https://', adapter)
+        self._lock = threading.Lock()
+        self._em_andamento = {}
+        self._validados = OrderedDict()
+        self._tamanho_validados = 0
+
+    def baixar(self, url):
+        with self._lock:
+            futuro = self._em_andamento.get(url)
+            responsavel = futuro is None
+            if responsavel:
+                futuro = Future()
+                self._em_andamento[url] = futuro
+        if not responsavel:
+            return futuro.result()
+
+        try:
+            conteudo = self._baixar(url)
+        except BaseException as erro:
+            futuro.set_exception(erro)
+            raise
+        else:
+            futuro.set_result(conteudo)
+            return conteudo
+        finally:
+            with self._lock:
+                self._em_andamento.pop(url, None)
+
+    def _baixar(self, url):
+        with self._lock:
+            validado = self._validados.get(url)
+        cabecalhos = {}
+        if validado:
+            etag, modificado_em, _ = validado
+            if etag:
+                cabecalhos['If-None-Match'] = etag
+            if modificado_em:
+                cabecalhos['If-Modified-Since'] = modificado_em
+
+        try:
+            with self._sessao.get(url, headers=cabecalhos, stream=True, timeout=self._timeout) as resposta:
+                if resposta.status_code == 304 and validado:
+                    return validado[2]
+                resposta.raise_for_status()
+                conteudo = self._ler_corpo(resposta)
+                etag = resposta.headers.get('ETag')
+                modificado_em = resposta.headers.get('Last-Modified')
+        except requests.RequestException as erro:
+            raise ErroDownload(str(erro)) from erro
+
+        if etag or modificado_em:
+            self._guardar_validado(url, (etag, modificado_em, conteudo))
+        return conteudo
+
+    def _ler_corpo(self, resposta):
+        tamanho_declarado = resposta.headers.get('Content-Length')
+        if tamanho_declarado and tamanho_declarado.isdigit() and int(tamanho_declarado) > self.tamanho_maximo:
+            raise PDFMuitoGrande(f'O PDF excede o limite de {self.tamanho_maximo} bytes.')
+        return guardar_partes(self._partes_limitadas(resposta), self._limite_memoria)
+
+    def _partes_limitadas(self, resposta):
+        total = 0
+        for parte in resposta.iter_content(chunk_size=TAMANHO_PARTE):
+            total += len(parte)
+            if total > self.tamanho_maximo:
+                raise PDFMuitoGrande(f'O PDF excede o limite de {self.tamanho_maximo} bytes.')
+            yield parte
+
+    def _guardar_validado(self, url, validado):
+        tamanho = tamanho_pdf(validado[2])
+        if tamanho > self._limite_validados_bytes:
+            return
+        with self._lock:
+            anterior = self._validados.pop(url, None)
+            if anterior is not None:
+                self._tamanho_validados -= tamanho_pdf(anterior[2])
+            self._validados[url] = validado
+            self._tamanho_validados += tamanho
+            while self._tamanho_validados > self._limite_validados_bytes:
+                _, removido = self._validados.popitem(last=False)
+                self._tamanho_validados -= tamanho_pdf(removido[2])
+
+
+def baixador_do_ambiente():
+    return BaixadorPDF(
+        tamanho_maximo=int(os.environ.get('DOWNLOAD_TAMANHO_MAXIMO', 50 * 1024 * 1024)),
+        timeout_conexao=float(os.environ.get('DOWNLOAD_TIMEOUT_CONEXAO', 5)),
+        timeout_leitura=float(os.environ.get('DOWNLOAD_TIMEOUT_LEITURA', 30)),
+        tentativas=int(os.environ.get('DOWNLOAD_TENTATIVAS', 3)),
+        backoff=float(os.environ.get('DOWNLOAD_BACKOFF', 0.5)),
+        conexoes=int(os.environ.get('DOWNLOAD_CONEXOES', 32)),
+        limite_validados_bytes=int(os.environ.get('DOWNLOAD_VALIDADOS_BYTES', 32 * 1024 * 1024)),
+    )
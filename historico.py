@@ -0,0 +1,212 @@
+import os
+import re
+import sqlite3
+import time
+
+from campos import converter_valor
+from serializacao import CASAS_QUANTIDADE, CASAS_VALOR
+
+PADRAO_REFERENCIA = re.compile(r'(\d{1,2})/(\d{4})')
+PADRAO_PERIODO = re.compile(r'(\d{4})-(\d{2})')
+PADRAO_DATA = re.compile(r'(\d{2})/(\d{2})/(\d{4})')
+# Número no formato brasileiro, possivelmente acompanhado de unidade ou moeda ("450 kWh", "R$ 1.234,56").
+PADRAO_NUMERO = re.compile(r'-?\d[\d.]*(?:,\d+)?')
+
+COLUNAS_FATURA = (
+    'distribuidora', 'modelo', 'unidade_consumidora', 'periodo', 'referencia', 'vencimento',
+    'consumo_total', 'valor_fatura', 'bandeira', 'dias_bandeira', 'soma_consumo_total',
+)
+AGRUPAMENTOS = ('periodo', 'distribuidora', 'unidade_consumidora')
+
+
+def normalizar_periodo(texto):
+    """Converte ``MM/AAAA`` (como em ``referencia``) ou ``AAAA-MM`` para ``AAAA-MM``."""
+    texto = (texto or '').strip()
+    encontrado = PADRAO_PERIODO.fullmatch(texto)
+    if encontrado:
+        ano, mes = int(encontrado[1]), int(encontrado[2])
+    else:
+        encontrado = PADRAO_REFERENCIA.fullmatch(texto)
+        if not encontrado:
+            raise ValueError(f'Período inválido: {texto!r} (use AAAA-MM ou MM/AAAA).')
+        mes, ano = int(encontrado[1]), int(encontrado[2])
+    if not 1 <= mes <= 12:
+        raise ValueError(f'Período inválido: {texto!r} (mês fora de 1 a 12).')
+    return f'{ano:04d}-{mes:02d}'
+
+
+def _numero(valor):
+    if valor is None or isinstance(valor, (int, float)):
+        return valor
+    encontrado = PADRAO_NUMERO.search(str(valor))
+    return converter_valor(encontrado[0]) if encontrado else None
+
+
+def _inteiro(valor):
+    numero = _numero(valor)
+    return int(numero) if numero is not None else None
+
+
+def _data(valor):
+    encontrado = PADRAO_DATA.fullmatch(str(valor or '').strip())
+    return f'{encontrado[3]}-{encontrado[2]}-{encontrado[1]}' if encontrado else None
+
+
+def normalizar_fatura(distribuidora, modelo, dados):
+    """Linha da tabela ``faturas`` a partir dos dados extraídos; ``None`` sem unidade consumidora ou referência."""
+    unidade = str(dados.get('unidade_consumidora') or '').strip()
+    try:
+        periodo = normalizar_periodo(dados.get('referencia'))
+    except ValueError:
+        return None
+    if not unidade:
+        return None
+    return {
+        'distribuidora': distribuidora,
+        'modelo': modelo,
+        'unidade_consumidora': unidade,
+        'periodo': periodo,
+        'referencia': dados.get('referencia'),
+        'vencimento': _data(dados.get('vencimento')),
+        'consumo_total': _numero(dados.get('consumo_total')),
+        'valor_fatura': _numero(dados.get('valor_fatura')),
+        'bandeira': dados.get('bandeira'),
+        'dias_bandeira': _inteiro(dados.get('dias_bandeira')),
+        'soma_consumo_total': _numero(dados.get('soma_consumo_total')),
+    }
+
+
+class HistoricoFaturas:
+    """Histórico das faturas extraídas em SQLite, indexado por unidade consumidora e período.
+
+    Cada fatura é identificada pela distribuidora, unidade consumidora e
+    período (``AAAA-MM``, derivado de ``referencia``); extrair de novo a
+    mesma fatura substitui o registro anterior. Os lançamentos e encargos
+    ficam em uma tabela própria. As consultas leem só os índices e as
+    tabelas, sem tocar nos PDFs.
+    """
+
+    def __init__(self, caminho):
+        self._caminho = caminho
+        conexao = self._conectar()
+        try:
+            conexao.execute('PRAGMA journal_mode=WAL')
+            conexao.execute(
+                'CREATE TABLE IF NOT EXISTS faturas ('
+                'id INTEGER PRIMARY KEY, distribuidora TEXT NOT NULL, modelo TEXT NOT NULL, '
+                'unidade_consumidora TEXT NOT NULL, periodo TEXT NOT NULL, referencia TEXT, vencimento TEXT, '
+                'consumo_total REAL, valor_fatura REAL, bandeira TEXT, dias_bandeira INTEGER, soma_consumo_total REAL, '
+                'registrado_em REAL NOT NULL, '
+                'UNIQUE (unidade_consumidora, periodo, distribuidora))'
+            )
+            conexao.execute('CREATE INDEX IF NOT EXISTS faturas_periodo ON faturas (periodo, distribuidora)')
+            conexao.execute(
+                'CREATE TABLE IF NOT EXISTS lancamentos ('
+                'fatura_id INTEGER NOT NULL REFERENCES faturas (id), categoria TEXT NOT NULL, '
+                'item_fatura TEXT, quantidade REAL, valor REAL)'
+            )
+            conexao.execute('CREATE INDEX IF NOT EXISTS lancamentos_fatura ON lancamentos (fatura_id)')
+        finally:
+            conexao.close()
+
+    def _conectar(self):
+        return sqlite3.connect(self._caminho, timeout=30, isolation_level=None)
+
+    def registrar(self, distribuidora, modelo, dados):
+        """Grava uma extração completa; devolve ``False`` quando faltam a unidade consumidora ou a referência."""
+        fatura = normalizar_fatura(distribuidora, modelo, dados)
+        if fatura is None:
+            return False
+        lancamentos = [
+            (categoria, linha.get('item_fatura'), linha.get('quantidade'), linha.get('valor'))
+            for categoria, chave in (('lancamento', 'lancamentos'), ('encargo', 'encargos'))
+            for linha in dados.get(chave) or ()
+        ]
+        conexao = self._conectar()
+        try:
+            conexao.execute('BEGIN IMMEDIATE')
+            try:
+                chave = (fatura['unidade_consumidora'], fatura['periodo'], fatura['distribuidora'])
+                conexao.execute(
+                    'DELETE FROM lancamentos WHERE fatura_id IN '
+                    '(SELECT id FROM faturas WHERE unidade_consumidora = ? AND periodo = ? AND distribuidora = ?)', chave)
+                conexao.execute(
+                    'DELETE FROM faturas WHERE unidade_consumidora = ? AND periodo = ? AND distribuidora = ?', chave)
+                cursor = conexao.execute(
+                    f'INSERT INTO faturas ({", ".join(COLUNAS_FATURA)}, registrado_em) '
+                    f'VALUES ({", ".join("?" * len(COLUNAS_FATURA))}, ?)',
+                    (*(fatura[coluna] for coluna in COLUNAS_FATURA), time.time()))
+                conexao.executemany(
+                    'INSERT INTO lancamentos (fatura_id, categoria, item_fatura, quantidade, valor) VALUES (?, ?, ?, ?, ?)',
+                    [(cursor.lastrowid, *lancamento) for lancamento in lancamentos])
+            except BaseException:
+                conexao.execute('ROLLBACK')
+                raise
+            conexao.execute('COMMIT')
+        finally:
+            conexao.close()
+        return True
+
+    @staticmethod
+    def _filtros(inicio, fim, distribuidora, unidades=None):
+        condicoes = []
+        parametros = []
+        if unidades:
+            condicoes.append(f'unidade_consumidora IN ({", ".join("?" * len(unidades))})')
+            parametros.extend(unidades)
+        if inicio:
+            condicoes.append('periodo >= ?')
+            parametros.append(inicio)
+        if fim:
+            condicoes.append('periodo <= ?')
+            parametros.append(fim)
+        if distribuidora:
+            condicoes.append('distribuidora = ?')
+            parametros.append(distribuidora)
+        return ' AND '.join(condicoes) or '1', parametros
+
+    def faturas(self, unidade_consumidora, inicio=None, fim=None, distribuidora=None, lancamentos=False):
+        """Faturas de uma unidade consumidora entre os períodos ``inicio`` e ``fim`` (``AAAA-MM``, inclusivos)."""
+        condicao, parametros = self._filtros(inicio, fim, distribuidora, [unidade_consumidora])
+        conexao = self._conectar()
+        try:
+            linhas = conexao.execute(
+                f'SELECT id, {", ".join(COLUNAS_FATURA)} FROM faturas WHERE {condicao} '
+                'ORDER BY periodo, distribuidora', parametros).fetchall()
+            faturas = {linha[0]: dict(zip(COLUNAS_FATURA, linha[1:])) for linha in linhas}
+            if lancamentos and faturas:
+                for fatura in faturas.values():
+                    fatura['lancamentos'] = []
+                    fatura['encargos'] = []
+                for fatura_id, categoria, item, quantidade, valor in conexao.execute(
+                        f'SELECT fatura_id, categoria, item_fatura, quantidade, valor FROM lancamentos '
+                        f'WHERE fatura_id IN ({", ".join("?" * len(faturas))}) ORDER BY rowid', list(faturas)):
+                    destino = 'lancamentos' if categoria == 'lancamento' else 'encargos'
+                    faturas[fatura_id][destino].append({'item_fatura': item, 'quantidade': quantidade, 'valor': valor})
+        finally:
+            conexao.close()
+        return list(faturas.values())
+
+    def agregados(self, agrupar='periodo', inicio=None, fim=None, distribuidora=None, unidades=None):
+        """Totais de consumo e valor por ``agrupar`` (período, distribuidora ou unidade consumidora)."""
+        if agrupar not in AGRUPAMENTOS:
+            raise ValueError(f'Agrupamento inválido: {agrupar!r} (use {", ".join(AGRUPAMENTOS)}).')
+        condicao, parametros = self._filtros(inicio, fim, distribuidora, unidades)
+        conexao = self._conectar()
+        try:
+            linhas = conexao.execute(
+                f'SELECT {agrupar}, COUNT(*), COUNT(DISTINCT unidade_consumidora), '
+                f'ROUND(SUM(consumo_total), {CASAS_QUANTIDADE}), ROUND(SUM(valor_fatura), {CASAS_VALOR}) '
+                f'FROM faturas WHERE {condicao} GROUP BY {agrupar} ORDER BY {agrupar}', parametros).fetchall()
+        finally:
+            conexao.close()
+        return [
+            {agrupar: grupo, 'faturas': faturas, 'unidades': unidades_grupo,
+             'consumo_total': consumo, 'valor_fatura': valor}
+            for grupo, faturas, unidades_grupo, consumo, valor in linhas
+        ]
+
+
+def historico_do_ambiente():
+    caminho = os.environ.get('HISTORICO_SQLITE')
+    return HistoricoFaturas(caminho) if caminho else None
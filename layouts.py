@@ -0,0 +1,151 @@
+import json
+import math
+import os
+from collections import namedtuple
+
+from pdfminer.layout import LTChar, LTContainer
+from pdfplumber.page import test_proposed_bbox
+from pdfplumber.utils import chars_to_textmap
+
+CAMINHO_LAYOUTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'layouts.json')
+
+# Altura das faixas horizontais do índice espacial usado em extrair_textos.
+ALTURA_FAIXA = 20
+
+Regiao = namedtuple('Regiao', ['nome', 'pagina', 'coordenadas'])
+
+# Tabela de lançamentos que continua nas páginas seguintes: ``layout`` tem as
+# regiões das páginas de continuação (a partir da página das suas regiões),
+# procuradas só em documentos com ao menos ``paginas_minimas`` páginas, até a
+# primeira página com uma linha em ``terminadores``.
+# paginas_maximas: páginas de continuação lidas no máximo, mesmo sem linha terminadora.
+Continuacao = namedtuple('Continuacao', ['layout', 'paginas_minimas', 'terminadores', 'paginas_maximas'],
+                         defaults=(20,))
+
+COLUNAS_ITENS = ('item_fatura', 'quantidade', 'valor')
+
+
+def _validar_regiao(layout, nome, dados):
+    if not isinstance(dados, dict):
+        raise ValueError(f'Região {layout}.{nome} deve ser um objeto com "pagina" e "coordenadas".')
+    pagina = dados.get('pagina')
+    coordenadas = dados.get('coordenadas')
+    if not isinstance(pagina, int) or isinstance(pagina, bool) or pagina < 0:
+        raise ValueError(f'Região {layout}.{nome}: "pagina" deve ser um inteiro não negativo.')
+    if (not isinstance(coordenadas, list) or len(coordenadas) != 4
+            or not all(isinstance(c, (int, float)) and not isinstance(c, bool) for c in coordenadas)):
+        raise ValueError(f'Região {layout}.{nome}: "coordenadas" deve ter 4 números (x0, top, x1, bottom).')
+    x0, top, x1, bottom = coordenadas
+    if x0 >= x1 or top >= bottom:
+        raise ValueError(f'Região {layout}.{nome}: coordenadas {coordenadas} não formam um retângulo válido.')
+    return Regiao(nome, pagina, tuple(coordenadas))
+
+
+def carregar_layouts(caminho=CAMINHO_LAYOUTS):
+    """Carrega e valida o registro de layouts.
+
+    O arquivo mapeia cada layout (distribuidora e modelo) para suas regiões
+    nomeadas, cada uma com a página e as coordenadas ``(x0, top, x1, bottom)``.
+    """
+    with open(caminho, encoding='utf-8') as arquivo:
+        dados = json.load(arquivo)
+    if not isinstance(dados, dict):
+        raise ValueError('O registro de layouts deve ser um objeto JSON.')
+    layouts = {}
+    for layout, regioes in dados.items():
+        if not isinstance(regioes, dict) or not regioes:
+            raise ValueError(f'Layout {layout} deve ter ao menos uma região.')
+        layouts[layout] = {nome: _validar_regiao(layout, nome, regiao) for nome, regiao in regioes.items()}
+    return layouts
+
+
+def validar_continuacoes(layouts, continuacoes):
+    """Confere se cada continuação aponta para um layout com as colunas da tabela de lançamentos em uma única página."""
+    for modelo, continuacao in continuacoes.items():
+        regioes = layouts.get(continuacao.layout)
+        if modelo not in layouts or regioes is None:
+            raise ValueError(f'Continuação {modelo} -> {continuacao.layout}: layout inexistente.')
+        faltantes = [coluna for coluna in COLUNAS_ITENS if coluna not in regioes]
+        if faltantes:
+            raise ValueError(f'Continuação {modelo} -> {continuacao.layout}: faltam as regiões {", ".join(faltantes)}.')
+        if len({regioes[coluna].pagina for coluna in COLUNAS_ITENS}) != 1:
+            raise ValueError(f'Continuação {modelo} -> {continuacao.layout}: as colunas devem estar na mesma página.')
+        if continuacao.paginas_maximas < 1:
+            raise ValueError(f'Continuação {modelo} -> {continuacao.layout}: paginas_maximas deve ser pelo menos 1.')
+    return continuacoes
+
+
+def _contem(char, coordenadas):
+    x0, top, x1, bottom = coordenadas
+    return (char['x0'] >= x0 and char['x1'] <= x1 and char['top'] >= top and char['bottom'] <= bottom
+            and (char['x1'] - char['x0']) + (char['bottom'] - char['top']) > 0)
+
+
+def _indice_faixas(pagina, coordenadas):
+    faixas = {}
+    for bbox in coordenadas:
+        test_proposed_bbox(bbox, pagina.bbox)
+        for faixa in range(math.floor(bbox[1] / ALTURA_FAIXA), math.floor(bbox[3] / ALTURA_FAIXA) + 1):
+            faixas.setdefault(faixa, []).append(bbox)
+    return faixas
+
+
+def _montar_textos(caracteres):
+    return {
+        bbox: chars_to_textmap(
+            chars,
+            layout_bbox=bbox,
+            layout_width=bbox[2] - bbox[0],
+            layout_height=bbox[3] - bbox[1],
+        ).as_string
+        for bbox, chars in caracteres.items()
+    }
+
+
+def extrair_textos(pagina, coordenadas):
+    """Extrai o texto de várias regiões de uma página percorrendo seus caracteres uma única vez.
+
+    Equivale a ``pagina.within_bbox(c).extract_text()`` para cada ``c`` em
+    ``coordenadas``: cada caractere é testado apenas contra as regiões da sua
+    faixa horizontal e o texto de todas as regiões é montado ao final.
+    """
+    faixas = _indice_faixas(pagina, coordenadas)
+    caracteres = {bbox: [] for bbox in coordenadas}
+    for char in pagina.chars:
+        for bbox in faixas.get(math.floor(char['top'] / ALTURA_FAIXA), ()):
+            if _contem(char, bbox):
+                caracteres[bbox].append(char)
+    return _montar_textos(caracteres)
+
+
+def _caracteres_pdfminer(objetos):
+    for objeto in objetos:
+        if isinstance(objeto, LTChar):
+            yield objeto
+        elif isinstance(objeto, LTContainer):
+            yield from _caracteres_pdfminer(objeto)
+
+
+def extrair_textos_minimo(pagina, coordenadas):
+    """Mesmo resultado de ``extrair_textos``, sem converter todos os objetos da página.
+
+    Percorre diretamente os caracteres do pdfminer (sem análise de layout) e
+    só converte para o formato do pdfplumber os que caem em alguma região,
+    o que basta para etapas que leem poucas regiões de uma página.
+    """
+    faixas = _indice_faixas(pagina, coordenadas)
+    caracteres = {bbox: [] for bbox in coordenadas}
+    altura = pagina.height
+    for objeto in _caracteres_pdfminer(pagina.layout):
+        top = altura - objeto.y1
+        candidatas = faixas.get(math.floor(top / ALTURA_FAIXA))
+        if not candidatas:
+            continue
+        posicao = {'x0': objeto.x0, 'x1': objeto.x1, 'top': top, 'bottom': altura - objeto.y0}
+        char = None
+        for bbox in candidatas:
+            if _contem(posicao, bbox):
+                if char is None:
+                    char = pagina.process_object(objeto)
+                caracteres[bbox].append(char)
+    return _montar_textos(caracteres)
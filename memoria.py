@@ -0,0 +1,186 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from io import BytesIO
+
+TAMANHO_PARTE = 64 * 1024
+
+# PDFs (baixados ou enviados) acima deste tamanho vão para um arquivo temporário em vez da memória.
+PDF_LIMITE_MEMORIA = int(os.environ.get('PDF_LIMITE_MEMORIA', 4 * 1024 * 1024))
+
+
+class MemoriaInsuficiente(Exception):
+    """O orçamento de memória do processo não liberou espaço para o documento a tempo."""
+
+
+class DocumentoGrandeDemais(MemoriaInsuficiente):
+    """O documento sozinho excede o orçamento de memória do processo."""
+
+
+class EnvioGrandeDemais(DocumentoGrandeDemais):
+    """O PDF enviado excede o tamanho máximo aceito (o mesmo dos downloads)."""
+
+
+class ArquivoPDF:
+    """PDF em disco, lido por ``mmap`` em vez de carregado na memória.
+
+    Com ``temporario``, o arquivo é removido quando o objeto é descartado.
+    Enviado a outro processo (por exemplo, ao pool de extração), viaja só o
+    caminho, e a cópia não remove o arquivo.
+    """
+
+    def __init__(self, caminho, temporario=False):
+        self.caminho = caminho
+        self.tamanho = os.path.getsize(caminho)
+        if temporario:
+            weakref.finalize(self, _remover, caminho)
+
+    def __reduce__(self):
+        return ArquivoPDF, (self.caminho,)
+
+    def __repr__(self):
+        return f'ArquivoPDF({self.caminho!r}, {self.tamanho} bytes)'
+
+
+def _remover(caminho):
+    try:
+        os.remove(caminho)
+    except FileNotFoundError:
+        pass
+
+
+def resumo_sha256(conteudo):
+    """SHA-256 dos bytes do PDF, em memória ou em um ``ArquivoPDF`` (lido em partes)."""
+    if not isinstance(conteudo, ArquivoPDF):
+        return hashlib.sha256(conteudo)
+    resumo = hashlib.sha256()
+    with open(conteudo.caminho, 'rb') as arquivo:
+        for parte in iter(lambda: arquivo.read(TAMANHO_PARTE), b''):
+            resumo.update(parte)
+    return resumo
+
+
+def tamanho_pdf(conteudo):
+    return conteudo.tamanho if isinstance(conteudo, ArquivoPDF) else len(conteudo)
+
+
+@contextmanager
+def abrir_pdf(conteudo):
+    """Fluxo de leitura do PDF (``bytes`` ou ``ArquivoPDF``), que também serve como buffer para hashing.
+
+    Cada chamada abre um mapeamento próprio, então o mesmo ``ArquivoPDF`` pode
+    ser lido por várias threads ao mesmo tempo.
+    """
+    if not isinstance(conteudo, ArquivoPDF):
+        yield BytesIO(conteudo)
+        return
+    if conteudo.tamanho == 0:
+        yield BytesIO(b'')
+        return
+    with open(conteudo.caminho, 'rb') as arquivo:
+        mapa = mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield mapa
+    finally:
+        mapa.close()
+
+
+def guardar_partes(partes, limite_memoria):
+    """Junta as partes de um PDF em ``bytes`` ou, passando de ``limite_memoria`` bytes, em um ``ArquivoPDF`` temporário."""
+    memoria = []
+    total = 0
+    arquivo = caminho = None
+    try:
+        for parte in partes:
+            total += len(parte)
+            if arquivo is None and total > limite_memoria:
+                descritor, caminho = tempfile.mkstemp(prefix='fatura-', suffix='.pdf')
+                arquivo = os.fdopen(descritor, 'wb')
+                arquivo.writelines(memoria)
+                memoria = None
+            if arquivo is None:
+                memoria.append(parte)
+            else:
+                arquivo.write(parte)
+    except BaseException:
+        if arquivo is not None:
+            arquivo.close()
+            _remover(caminho)
+        raise
+    if arquivo is None:
+        return b''.join(memoria)
+    arquivo.close()
+    return ArquivoPDF(caminho, temporario=True)
+
+
+def ler_fluxo(fluxo, limite_memoria, tamanho_maximo=None):
+    """``guardar_partes`` para um arquivo aberto, como um upload do Flask.
+
+    Passando de ``tamanho_maximo`` bytes, a leitura para com ``EnvioGrandeDemais``.
+    """
+    return guardar_partes(_partes_limitadas(fluxo, tamanho_maximo), limite_memoria)
+
+
+def _partes_limitadas(fluxo, tamanho_maximo):
+    total = 0
+    for parte in iter(lambda: fluxo.read(TAMANHO_PARTE), b''):
+        total += len(parte)
+        if tamanho_maximo is not None and total > tamanho_maximo:
+            raise EnvioGrandeDemais(f'O PDF excede o limite de {tamanho_maximo} bytes.')
+        yield parte
+
+
+class OrcamentoMemoria:
+    """Limita a memória estimada dos documentos extraídos ao mesmo tempo em um processo.
+
+    Cada documento reserva ``fator`` vezes o seu tamanho em bytes (os objetos
+    criados pela análise do PDF ocupam bem mais que o arquivo). Um documento
+    que sozinho excede o ``limite`` é recusado com ``DocumentoGrandeDemais``;
+    os demais esperam até ``espera`` segundos pela liberação de espaço e,
+    depois disso, são recusados com ``MemoriaInsuficiente``. Com ``limite``
+    zero não há orçamento.
+    """
+
+    def __init__(self, limite=0, fator=20, espera=30):
+        self.limite = limite
+        self.fator = fator
+        self.espera = espera
+        self.em_uso = 0
+        self._liberado = threading.Condition()
+
+    @contextmanager
+    def reservar(self, tamanho):
+        if not self.limite:
+            yield
+            return
+        custo = tamanho * self.fator
+        if custo > self.limite:
+            raise DocumentoGrandeDemais(
+                f'O PDF ({tamanho} bytes) excede o orçamento de memória do processo ({self.limite} bytes).')
+        limite_espera = time.monotonic() + self.espera
+        with self._liberado:
+            while self.em_uso + custo > self.limite:
+                restante = limite_espera - time.monotonic()
+                if restante <= 0:
+                    raise MemoriaInsuficiente('Memória insuficiente para extrair o PDF agora; tente novamente.')
+                self._liberado.wait(restante)
+            self.em_uso += custo
+        try:
+            yield
+        finally:
+            with self._liberado:
+                self.em_uso -= custo
+                self._liberado.notify_all()
+
+
+def orcamento_do_ambiente():
+    return OrcamentoMemoria(
+        limite=int(os.environ.get('MEMORIA_ORCAMENTO_BYTES', 0)),
+        fator=float(os.environ.get('MEMORIA_FATOR_PDF', 20)),
+        espera=float(os.environ.get('MEMORIA_ESPERA', 30)),
+    )
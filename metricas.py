@@ -0,0 +1,369 @@
+import bisect
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Limites (em segundos) dos histogramas de duração.
+LIMITES_PADRAO = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DISTRIBUIDORA_DESCONHECIDA = 'desconhecida'
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _formatar_rotulos(nomes, valores, extra=None):
+    pares = list(zip(nomes, valores))
+    if extra:
+        pares.append(extra)
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{nome}="{_escapar(valor)}"' for nome, valor in pares) + '}'
+
+
+def _formatar_numero(valor):
+    if math.isinf(valor):
+        return '+Inf' if valor > 0 else '-Inf'
+    return repr(float(valor)) if not float(valor).is_integer() else str(int(valor))
+
+
+class Contador:
+    tipo = 'counter'
+
+    def __init__(self, nome, descricao, rotulos=()):
+        self.nome = nome
+        self.descricao = descricao
+        self.rotulos = tuple(rotulos)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, valor=1, **rotulos):
+        chave = tuple(str(rotulos.get(nome, '')) for nome in self.rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def valores(self):
+        with self._lock:
+            return dict(self._valores)
+
+    @staticmethod
+    def somar(valor, outro):
+        return outro if valor is None else valor + outro
+
+    def amostras(self, valores=None):
+        valores = self.valores() if valores is None else valores
+        for chave, valor in sorted(valores.items()):
+            yield f'{self.nome}{_formatar_rotulos(self.rotulos, chave)} {_formatar_numero(valor)}'
+
+
+class Histograma:
+    """Histograma cumulativo no formato do Prometheus, com rótulos livres."""
+
+    tipo = 'histogram'
+
+    def __init__(self, nome, descricao, rotulos=(), limites=LIMITES_PADRAO):
+        self.nome = nome
+        self.descricao = descricao
+        self.rotulos = tuple(rotulos)
+        self.limites = tuple(sorted(limites))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, **rotulos):
+        chave = tuple(str(rotulos.get(nome, '')) for nome in self.rotulos)
+        posicao = bisect.bisect_left(self.limites, valor)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = [[0] * (len(self.limites) + 1), 0.0, 0]
+            serie[0][posicao] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def valores(self):
+        with self._lock:
+            return {chave: [list(baldes), soma, total] for chave, (baldes, soma, total) in self._series.items()}
+
+    @staticmethod
+    def somar(serie, outra):
+        if serie is None:
+            return [list(outra[0]), outra[1], outra[2]]
+        return [[a + b for a, b in zip(serie[0], outra[0])], serie[1] + outra[1], serie[2] + outra[2]]
+
+    def amostras(self, valores=None):
+        valores = self.valores() if valores is None else valores
+        for chave, (baldes, soma, total) in sorted(valores.items()):
+            acumulado = 0
+            for limite, quantidade in zip(self.limites + (math.inf,), baldes):
+                acumulado += quantidade
+                rotulos = _formatar_rotulos(self.rotulos, chave, ('le', _formatar_numero(limite)))
+                yield f'{self.nome}_bucket{rotulos} {acumulado}'
+            rotulos = _formatar_rotulos(self.rotulos, chave)
+            yield f'{self.nome}_sum{rotulos} {_formatar_numero(soma)}'
+            yield f'{self.nome}_count{rotulos} {total}'
+
+
+class RegistroMetricas:
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def _registrar(self, metrica):
+        with self._lock:
+            return self._metricas.setdefault(metrica.nome, metrica)
+
+    def contador(self, nome, descricao, rotulos=()):
+        return self._registrar(Contador(nome, descricao, rotulos))
+
+    def histograma(self, nome, descricao, rotulos=(), limites=LIMITES_PADRAO):
+        return self._registrar(Histograma(nome, descricao, rotulos, limites))
+
+    def estado(self):
+        """Valores de todas as métricas em um formato serializável em JSON, para somar em outro processo."""
+        with self._lock:
+            metricas = list(self._metricas.values())
+        return {metrica.nome: [[list(chave), valor] for chave, valor in metrica.valores().items()] for metrica in metricas}
+
+    def somar(self, estado, outro):
+        """Soma ao ``estado`` (de ``estado``) os valores de ``outro``; devolve ``estado``."""
+        with self._lock:
+            metricas = dict(self._metricas)
+        for nome, valores in outro.items():
+            metrica = metricas.get(nome)
+            if metrica is None:
+                continue
+            destino = {tuple(chave): valor for chave, valor in estado.get(nome, ())}
+            for chave, valor in valores:
+                destino[tuple(chave)] = metrica.somar(destino.get(tuple(chave)), valor)
+            estado[nome] = [[list(chave), valor] for chave, valor in destino.items()]
+        return estado
+
+    def exposicao(self, outros=()):
+        """Texto no formato de exposição do Prometheus (``text/plain; version=0.0.4``).
+
+        ``outros`` são estados (``estado``) de outros processos, somados aos deste.
+        """
+        with self._lock:
+            metricas = list(self._metricas.values())
+        linhas = []
+        for metrica in metricas:
+            valores = metrica.valores()
+            for estado in outros:
+                for chave, valor in estado.get(metrica.nome, ()):
+                    valores[tuple(chave)] = metrica.somar(valores.get(tuple(chave)), valor)
+            linhas.append(f'# HELP {metrica.nome} {metrica.descricao}')
+            linhas.append(f'# TYPE {metrica.nome} {metrica.tipo}')
+            linhas.extend(metrica.amostras(valores))
+        return '\n'.join(linhas) + '\n'
+
+
+REGISTRO = RegistroMetricas()
+
+
+def _gravar_json(caminho, dados):
+    temporario = f'{caminho}.{os.getpid()}.tmp'
+    with open(temporario, 'w', encoding='utf-8') as arquivo:
+        json.dump(dados, arquivo)
+    os.replace(temporario, caminho)
+
+
+def _ler_json(caminho):
+    with open(caminho, encoding='utf-8') as arquivo:
+        return json.load(arquivo)
+
+
+class MetricasCompartilhadas:
+    """Métricas dos processos HTTP de um servidor, somadas por meio de um diretório.
+
+    Cada processo grava o estado do seu registro em ``<pid>.json`` a cada
+    ``intervalo`` segundos e ao encerrar; ``exposicao`` soma o registro do
+    processo com os arquivos dos demais. Quando um processo termina, o
+    processo principal soma o arquivo dele em ``encerrados.json``
+    (``incorporar``), de modo que os contadores não voltam a zero quando um
+    processo é reciclado.
+    """
+
+    ENCERRADOS = 'encerrados.json'
+
+    def __init__(self, diretorio, registro=REGISTRO, intervalo=5):
+        self.diretorio = diretorio
+        self.registro = registro
+        self.intervalo = intervalo
+        self._parar = threading.Event()
+        self._thread = None
+
+    def _caminho(self, pid):
+        return os.path.join(self.diretorio, f'{pid}.json')
+
+    def gravar(self):
+        _gravar_json(self._caminho(os.getpid()), self.registro.estado())
+
+    def iniciar(self):
+        def gravar_periodicamente():
+            while not self._parar.wait(self.intervalo):
+                self.gravar()
+
+        self._thread = threading.Thread(target=gravar_periodicamente, name='metricas', daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.gravar()
+
+    def _encerrados(self):
+        try:
+            return _ler_json(os.path.join(self.diretorio, self.ENCERRADOS))
+        except FileNotFoundError:
+            return {'pids': [], 'estado': {}}
+
+    def estados(self, tentativas=3):
+        """Estados dos outros processos: os encerrados e os arquivos dos que estão ativos.
+
+        Sem o diretório (removido por uma limpeza de temporários, por
+        exemplo), não há outros processos a somar.
+        """
+        try:
+            nomes = sorted(os.listdir(self.diretorio))
+        except FileNotFoundError:
+            return []
+        encerrados = self._encerrados()
+        ignorar = {f'{os.getpid()}.json', self.ENCERRADOS}
+        lidos = {}
+        for nome in nomes:
+            if not nome.endswith('.json') or nome in ignorar:
+                continue
+            for _ in range(tentativas):
+                if nome in self._incorporados(encerrados):
+                    break
+                try:
+                    lidos[nome] = _ler_json(os.path.join(self.diretorio, nome))
+                    break
+                except FileNotFoundError:
+                    # Incorporado aos encerrados (e removido) pelo processo principal durante a leitura.
+                    encerrados = self._encerrados()
+        incorporados = self._incorporados(encerrados)
+        return [encerrados['estado'], *(estado for nome, estado in lidos.items() if nome not in incorporados)]
+
+    @staticmethod
+    def _incorporados(encerrados):
+        return {f'{pid}.json' for pid in encerrados['pids']}
+
+    def exposicao(self):
+        return self.registro.exposicao(self.estados())
+
+    def incorporar(self, pid):
+        """No processo principal: soma o último estado do processo ``pid``, que terminou, aos encerrados."""
+        caminho = self._caminho(pid)
+        try:
+            estado = _ler_json(caminho)
+        except (FileNotFoundError, ValueError):
+            return
+        encerrados = self._encerrados()
+        encerrados['estado'] = self.registro.somar(encerrados['estado'], estado)
+        encerrados['pids'].append(pid)
+        _gravar_json(os.path.join(self.diretorio, self.ENCERRADOS), encerrados)
+        os.remove(caminho)
+
+
+DURACAO_ETAPA = REGISTRO.histograma(
+    'fatura_etapa_segundos', 'Duração de cada etapa da extração, sem contar as etapas internas.',
+    ('etapa', 'distribuidora', 'modelo'))
+DURACAO_REGIAO = REGISTRO.histograma(
+    'fatura_regiao_segundos', 'Duração da passada que extrai uma região (e as demais da mesma página).',
+    ('regiao', 'distribuidora', 'modelo'))
+DURACAO_TOTAL = REGISTRO.histograma(
+    'fatura_total_segundos', 'Duração total do processamento de uma fatura.',
+    ('distribuidora', 'modelo'))
+FATURAS_PROCESSADAS = REGISTRO.contador(
+    'faturas_processadas_total', 'Faturas processadas por distribuidora, modelo, status e origem do resultado.',
+    ('distribuidora', 'modelo', 'status', 'cache'))
+
+
+class Medicao:
+    """Durações das etapas do processamento de uma fatura.
+
+    As etapas podem ser aninhadas; cada uma registra apenas o próprio tempo,
+    sem as etapas internas, de modo que a soma das etapas é o tempo medido.
+    A distribuidora e o modelo só são conhecidos depois da classificação,
+    então as observações são guardadas e levadas aos histogramas em
+    ``registrar``. ``dados``/``incorporar`` transportam as medições de um
+    processo de extração para o processo que responde a requisição.
+    """
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.distribuidora = DISTRIBUIDORA_DESCONHECIDA
+        self.modelo = DISTRIBUIDORA_DESCONHECIDA
+        self.cache = False
+        self.etapas = []
+        self._internas = []
+
+    def classificar(self, distribuidora, modelo):
+        self.distribuidora = distribuidora
+        self.modelo = modelo
+
+    @contextmanager
+    def etapa(self, nome, regiao=None):
+        self._internas.append(0.0)
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            duracao = time.perf_counter() - inicio
+            internas = self._internas.pop()
+            if self._internas:
+                self._internas[-1] += duracao
+            self.etapas.append((nome, regiao, duracao - internas))
+
+    def dados(self):
+        return {'distribuidora': self.distribuidora, 'modelo': self.modelo, 'etapas': list(self.etapas)}
+
+    def incorporar(self, dados):
+        self.distribuidora = dados['distribuidora']
+        self.modelo = dados['modelo']
+        self.etapas.extend(tuple(etapa) for etapa in dados['etapas'])
+
+    def registrar(self, status):
+        rotulos = {'distribuidora': self.distribuidora, 'modelo': self.modelo}
+        for nome, regiao, duracao in self.etapas:
+            if regiao is None:
+                DURACAO_ETAPA.observar(duracao, etapa=nome, **rotulos)
+            else:
+                DURACAO_REGIAO.observar(duracao, regiao=regiao, **rotulos)
+        DURACAO_TOTAL.observar(time.perf_counter() - self.inicio, **rotulos)
+        FATURAS_PROCESSADAS.incrementar(status=status, cache='sim' if self.cache else 'nao', **rotulos)
+
+
+_medicao_atual = contextvars.ContextVar('medicao_atual', default=None)
+
+
+def medicao_atual():
+    return _medicao_atual.get()
+
+
+@contextmanager
+def medindo(medicao):
+    """Torna ``medicao`` a medição corrente das funções chamadas dentro do bloco."""
+    token = _medicao_atual.set(medicao)
+    try:
+        yield medicao
+    finally:
+        _medicao_atual.reset(token)
+
+
+@contextmanager
+def etapa(nome, regiao=None):
+    """Mede uma etapa na medição corrente; sem medição corrente, não faz nada."""
+    medicao = _medicao_atual.get()
+    if medicao is None:
+        yield
+        return
+    with medicao.etapa(nome, regiao):
+        yield
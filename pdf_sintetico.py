@@ -0,0 +1,59 @@
+"""PDFs mínimos com texto posicionado, para o benchmark e o aquecimento do servidor.
+
+Não dependem de nenhuma biblioteca de geração de PDF: cada página é um
+fluxo de operadores de texto em Helvetica, com as coordenadas dadas a
+partir do canto superior esquerdo, como nas regiões de ``layouts.json``.
+"""
+import io
+
+ALTURA_PAGINA = 842
+LARGURA_PAGINA = 595
+TAMANHO_FONTE = 6
+
+
+def _escapar(texto):
+    saida = bytearray()
+    for byte in texto.encode('cp1252'):
+        if byte in b'()\\':
+            saida += b'\\' + bytes([byte])
+        elif byte < 32 or byte > 126:
+            saida += b'\\%03o' % byte
+        else:
+            saida.append(byte)
+    return bytes(saida)
+
+
+def gerar_pdf(paginas, tamanho=TAMANHO_FONTE):
+    """PDF mínimo com texto em Helvetica; ``paginas`` é uma lista de listas de ``(x, top, texto)``."""
+    objetos = []
+
+    def adicionar(corpo):
+        objetos.append(corpo)
+        return len(objetos)
+
+    fonte = adicionar(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+    raiz = adicionar(None)
+    filhos = []
+    for textos in paginas:
+        conteudo = b''.join(
+            b'BT /F1 %d Tf %.2f %.2f Td (%s) Tj ET\n' % (tamanho, x, ALTURA_PAGINA - top - tamanho, _escapar(texto))
+            for x, top, texto in textos
+        )
+        fluxo = adicionar(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(conteudo), conteudo))
+        filhos.append(adicionar(
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>'
+            % (raiz, LARGURA_PAGINA, ALTURA_PAGINA, fonte, fluxo)))
+    objetos[raiz - 1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(b'%d 0 R' % f for f in filhos), len(filhos))
+    catalogo = adicionar(b'<< /Type /Catalog /Pages %d 0 R >>' % raiz)
+
+    saida = io.BytesIO()
+    saida.write(b'%PDF-1.4\n')
+    posicoes = []
+    for numero, corpo in enumerate(objetos, 1):
+        posicoes.append(saida.tell())
+        saida.write(b'%d 0 obj\n%s\nendobj\n' % (numero, corpo))
+    xref = saida.tell()
+    saida.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objetos) + 1))
+    saida.write(b''.join(b'%010d 00000 n \n' % posicao for posicao in posicoes))
+    saida.write(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objetos) + 1, catalogo, xref))
+    return saida.getvalue()
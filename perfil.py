@@ -0,0 +1,115 @@
+import contextvars
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class AmostradorPilhas:
+    """Perfilador por amostragem da thread que o inicia.
+
+    Uma thread auxiliar lê a pilha da thread alvo a cada ``intervalo``
+    segundos e conta as pilhas repetidas. ``colapsado`` devolve o resultado
+    no formato de pilhas colapsadas (``a;b;c contagem``) usado pelos
+    geradores de flame graph. Dentro do ``with``, o amostrador é o corrente
+    (``amostrador_atual``), para que as pilhas amostradas em um processo de
+    extração possam ser somadas às da requisição com ``incorporar``.
+    """
+
+    def __init__(self, intervalo=0.005):
+        self.intervalo = intervalo
+        self.pilhas = Counter()
+        self.amostras = 0
+        self._alvo = None
+        self._parar = threading.Event()
+        self._thread = None
+        self._token = None
+
+    def __enter__(self):
+        self._token = _amostrador_atual.set(self)
+        self.iniciar()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.parar()
+        _amostrador_atual.reset(self._token)
+
+    def iniciar(self):
+        self._alvo = threading.get_ident()
+        self._thread = threading.Thread(target=self._amostrar, name='amostrador-pilhas', daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _amostrar(self):
+        while not self._parar.wait(self.intervalo):
+            quadro = sys._current_frames().get(self._alvo)
+            if quadro is None:
+                continue
+            funcoes = []
+            while quadro is not None:
+                codigo = quadro.f_code
+                funcoes.append(f'{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})')
+                quadro = quadro.f_back
+            self.pilhas[';'.join(reversed(funcoes))] += 1
+            self.amostras += 1
+
+    def incorporar(self, pilhas):
+        self.pilhas.update(pilhas)
+        self.amostras += sum(pilhas.values())
+
+    def colapsado(self):
+        return ''.join(f'{pilha} {quantidade}\n' for pilha, quantidade in self.pilhas.most_common())
+
+
+_amostrador_atual = contextvars.ContextVar('amostrador_atual', default=None)
+
+
+def amostrador_atual():
+    return _amostrador_atual.get()
+
+
+class PerfilRequisicoes:
+    """Decide quais requisições são perfiladas e grava os perfis em ``diretorio``.
+
+    Uma requisição é perfilada quando traz o cabeçalho ``X-Perfil`` com o
+    ``token`` configurado, ou por sorteio, com probabilidade ``fracao``. Sem
+    ``diretorio`` nada é perfilado.
+    """
+
+    def __init__(self, diretorio=None, fracao=0.0, token=None, intervalo=0.005):
+        self.diretorio = diretorio
+        self.fracao = fracao
+        self.token = token
+        self.intervalo = intervalo
+
+    def deve_perfilar(self, cabecalho=None):
+        if not self.diretorio:
+            return False
+        if self.token and cabecalho and hmac.compare_digest(cabecalho.encode(), self.token.encode()):
+            return True
+        return self.fracao > 0 and random.random() < self.fracao
+
+    def gravar(self, amostrador, *partes):
+        os.makedirs(self.diretorio, exist_ok=True)
+        nome = '_'.join([time.strftime('%Y%m%dT%H%M%S'), *(str(parte) for parte in partes), f'{os.getpid()}-{time.time_ns()}'])
+        caminho = os.path.join(self.diretorio, f'{nome}.txt')
+        with open(caminho, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(amostrador.colapsado())
+        return caminho
+
+
+def perfil_do_ambiente():
+    return PerfilRequisicoes(
+        diretorio=os.environ.get('PERFIL_DIRETORIO'),
+        fracao=float(os.environ.get('PERFIL_FRACAO', 0)),
+        token=os.environ.get('PERFIL_TOKEN'),
+        intervalo=float(os.environ.get('PERFIL_INTERVALO', 0.005)),
+    )
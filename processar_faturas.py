@@ -0,0 +1,352 @@
+"""Processamento em massa de faturas locais ou por URL.
+
+Lê os PDFs de uma pasta (recursivamente) ou de um manifesto (um caminho ou
+URL por linha), extrai em todos os núcleos e grava cada resultado assim que
+termina em JSONL e, opcionalmente, em Parquet. Uma execução interrompida
+retoma de onde parou com o mesmo comando:
+
+    python processar_faturas.py Faturas --saida resultados.jsonl --parquet resultados_parquet
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from download_pdf import ErroDownload
+from memoria import TAMANHO_PARTE, ArquivoPDF
+from metricas import DISTRIBUIDORA_DESCONHECIDA
+from serializacao import de_json, para_json
+from trabalhadores import ErroTrabalhador, pool_do_ambiente
+
+LINHAS_POR_PARTE_PARQUET = 5000
+
+
+def eh_url(origem):
+    return origem.startswith(('http://', 'https://'))
+
+
+def listar_origens(origem):
+    """Gera os caminhos dos PDFs de uma pasta ou as linhas de um manifesto, sem carregar a lista inteira."""
+    if os.path.isdir(origem):
+        for raiz, pastas, arquivos in os.walk(origem):
+            pastas.sort()
+            for arquivo in sorted(arquivos):
+                if arquivo.lower().endswith('.pdf'):
+                    yield os.path.join(raiz, arquivo)
+        return
+    base = os.path.dirname(os.path.abspath(origem))
+    with open(origem, encoding='utf-8') as manifesto:
+        for linha in manifesto:
+            linha = linha.strip()
+            if not linha or linha.startswith('#'):
+                continue
+            yield linha if eh_url(linha) or os.path.isabs(linha) else os.path.join(base, linha)
+
+
+def processar_origem(origem):
+    """Executado nos processos de extração: lê ou baixa o PDF e devolve o registro do resultado."""
+    import app
+
+    inicio = time.perf_counter()
+    distribuidora = modelo = DISTRIBUIDORA_DESCONHECIDA
+    try:
+        if eh_url(origem):
+            conteudo = app.baixar_pdf(origem)
+        else:
+            conteudo = ArquivoPDF(origem)
+        resultado, medicao = app.extrair_conteudo_medido(conteudo)
+        distribuidora, modelo = medicao['distribuidora'], medicao['modelo']
+    except ErroDownload as erro:
+        resultado = {'status': 400, 'message': f'Não foi possível baixar o PDF: {erro}'}
+    except app.ERROS_EXTRACAO as erro:
+        resultado = app.erro_extracao(erro)
+    except Exception as erro:
+        resultado = {'status': 500, 'message': f'Erro ao extrair os dados da fatura: {erro}'}
+    return {
+        'origem': origem,
+        'distribuidora': distribuidora,
+        'modelo': modelo,
+        'segundos': round(time.perf_counter() - inicio, 4),
+        **resultado,
+    }
+
+
+class SaidaJSONL:
+    """Arquivo JSONL de resultados, que também serve de ponto de controle da execução.
+
+    Ao reabrir, uma última linha incompleta (execução interrompida no meio da
+    escrita) é descartada e o arquivo é percorrido uma vez, linha a linha,
+    guardando só as origens já gravadas (``concluidas``), que são puladas.
+    Com ``repetir_falhas``, as origens que falharam com erro interno ficam de
+    fora. ``registros`` relê do disco os registros a partir de uma linha.
+    """
+
+    def __init__(self, caminho, repetir_falhas=False):
+        self.caminho = caminho
+        self.concluidas = set()
+        self.linhas = 0
+        if os.path.exists(caminho):
+            with open(caminho, 'rb+') as arquivo:
+                _descartar_linha_incompleta(arquivo)
+                arquivo.seek(0)
+                for linha in arquivo:
+                    if not linha.strip():
+                        continue
+                    self.linhas += 1
+                    registro = de_json(linha)
+                    if not repetir_falhas or registro.get('status') in (200, 400):
+                        self.concluidas.add(registro['origem'])
+        self._arquivo = open(caminho, 'ab')
+
+    def registros(self, inicio=0):
+        """Gera os registros já gravados a partir da linha ``inicio`` (contando só as linhas não vazias)."""
+        self._arquivo.flush()
+        numero = 0
+        with open(self.caminho, 'rb') as arquivo:
+            for linha in arquivo:
+                if not linha.strip():
+                    continue
+                if numero >= inicio:
+                    yield de_json(linha)
+                numero += 1
+
+    def gravar(self, registro):
+        self._arquivo.write(para_json(registro) + b'\n')
+        self._arquivo.flush()
+
+    def sincronizar(self):
+        self._arquivo.flush()
+        os.fsync(self._arquivo.fileno())
+
+    def fechar(self):
+        self.sincronizar()
+        self._arquivo.close()
+
+
+def _descartar_linha_incompleta(arquivo):
+    """Trunca o arquivo depois da última quebra de linha, lendo de trás para frente em partes."""
+    tamanho = fim = arquivo.seek(0, os.SEEK_END)
+    completo = 0
+    while fim > 0:
+        inicio = max(0, fim - TAMANHO_PARTE)
+        arquivo.seek(inicio)
+        posicao = arquivo.read(fim - inicio).rfind(b'\n')
+        if posicao >= 0:
+            completo = inicio + posicao + 1
+            break
+        fim = inicio
+    if completo < tamanho:
+        arquivo.truncate(completo)
+
+
+class SaidaParquet:
+    """Grava os registros em partes Parquet de ``linhas_por_parte`` linhas, na ordem do JSONL.
+
+    Cada parte é escrita em um arquivo temporário e renomeada quando
+    completa, então as partes existentes sempre correspondem às primeiras
+    linhas do JSONL; ao retomar, as linhas seguintes são relidas de
+    ``jsonl`` e gravadas de novo, parte a parte.
+    """
+
+    def __init__(self, pasta, jsonl=None, linhas_por_parte=LINHAS_POR_PARTE_PARQUET):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as erro:
+            raise ImportError('A saída Parquet requer o pyarrow (pip install pyarrow).') from erro
+        self._pa = pa
+        self._pq = pq
+        self.pasta = pasta
+        self.linhas_por_parte = linhas_por_parte
+        os.makedirs(pasta, exist_ok=True)
+        partes = sorted(nome for nome in os.listdir(pasta) if nome.startswith('parte-') and nome.endswith('.parquet'))
+        self._proxima = len(partes)
+        gravadas = sum(pq.read_metadata(os.path.join(pasta, nome)).num_rows for nome in partes)
+        self._buffer = []
+        self._esquema = self._criar_esquema()
+        if jsonl is not None:
+            for registro in jsonl.registros(gravadas):
+                self.gravar(registro)
+
+    def _criar_esquema(self):
+        pa = self._pa
+        lancamento = pa.struct([('item_fatura', pa.string()), ('quantidade', pa.float64()), ('valor', pa.float64())])
+        return pa.schema([
+            ('origem', pa.string()), ('distribuidora', pa.string()), ('modelo', pa.string()),
+            ('status', pa.int64()), ('message', pa.string()), ('segundos', pa.float64()),
+            ('referencia', pa.string()), ('unidade_consumidora', pa.string()), ('vencimento', pa.string()),
+            # consumo_total e dias_bandeira chegam como texto ou número conforme a distribuidora.
+            ('consumo_total', pa.string()), ('valor_fatura', pa.float64()), ('bandeira', pa.string()),
+            ('dias_bandeira', pa.string()), ('soma_consumo_total', pa.float64()),
+            ('lancamentos', pa.list_(lancamento)), ('encargos', pa.list_(lancamento)),
+        ])
+
+    @staticmethod
+    def _linha(registro):
+        dados = registro.get('data') or {}
+
+        def texto(valor):
+            return None if valor is None else str(valor)
+
+        return {
+            'origem': registro['origem'],
+            'distribuidora': registro.get('distribuidora'),
+            'modelo': registro.get('modelo'),
+            'status': registro.get('status'),
+            'message': registro.get('message'),
+            'segundos': registro.get('segundos'),
+            'referencia': texto(dados.get('referencia')),
+            'unidade_consumidora': texto(dados.get('unidade_consumidora')),
+            'vencimento': texto(dados.get('vencimento')),
+            'consumo_total': texto(dados.get('consumo_total')),
+            'valor_fatura': dados.get('valor_fatura'),
+            'bandeira': texto(dados.get('bandeira')),
+            'dias_bandeira': texto(dados.get('dias_bandeira')),
+            'soma_consumo_total': dados.get('soma_consumo_total'),
+            'lancamentos': dados.get('lancamentos'),
+            'encargos': dados.get('encargos'),
+        }
+
+    def gravar(self, registro):
+        self._buffer.append(registro)
+        if len(self._buffer) >= self.linhas_por_parte:
+            self._gravar_parte()
+
+    def _gravar_parte(self):
+        if not self._buffer:
+            return
+        tabela = self._pa.Table.from_pylist([self._linha(registro) for registro in self._buffer], schema=self._esquema)
+        caminho = os.path.join(self.pasta, f'parte-{self._proxima:06d}.parquet')
+        self._pq.write_table(tabela, caminho + '.tmp')
+        os.replace(caminho + '.tmp', caminho)
+        self._proxima += 1
+        self._buffer.clear()
+
+    def fechar(self):
+        self._gravar_parte()
+
+
+class Progresso:
+    """Contagem de faturas, falhas e vazão por distribuidora."""
+
+    def __init__(self, anteriores=0):
+        self.inicio = time.monotonic()
+        self.anteriores = anteriores
+        self.faturas = Counter()
+        self.falhas = Counter()
+        self.segundos = defaultdict(float)
+
+    def registrar(self, registro):
+        distribuidora = registro.get('distribuidora') or DISTRIBUIDORA_DESCONHECIDA
+        self.faturas[distribuidora] += 1
+        self.segundos[distribuidora] += registro.get('segundos') or 0
+        if registro.get('status') != 200:
+            self.falhas[distribuidora] += 1
+
+    @property
+    def total(self):
+        return sum(self.faturas.values())
+
+    def resumo(self):
+        decorrido = time.monotonic() - self.inicio
+        vazao = self.total / decorrido if decorrido else 0
+        linhas = [f'{self.total} faturas em {decorrido:.1f}s ({vazao:.1f}/s), '
+                  f'{sum(self.falhas.values())} falhas, {self.anteriores} já processadas antes']
+        for distribuidora, quantidade in self.faturas.most_common():
+            media = self.segundos[distribuidora] / quantidade * 1000
+            linhas.append(f'  {distribuidora:<14} {quantidade:>8} faturas  {self.falhas[distribuidora]:>6} falhas  {media:>8.1f} ms/fatura')
+        return '\n'.join(linhas)
+
+    def dados(self):
+        decorrido = time.monotonic() - self.inicio
+        return {
+            'faturas': self.total,
+            'falhas': sum(self.falhas.values()),
+            'ja_processadas': self.anteriores,
+            'segundos': round(decorrido, 2),
+            'faturas_por_segundo': round(self.total / decorrido, 2) if decorrido else None,
+            'distribuidoras': {
+                distribuidora: {'faturas': quantidade, 'falhas': self.falhas[distribuidora]}
+                for distribuidora, quantidade in self.faturas.most_common()
+            },
+        }
+
+
+def processar(origem, saida, pasta_parquet=None, processos=None, intervalo=10, repetir_falhas=False, relatorio=sys.stderr):
+    processos = processos or os.cpu_count() or 1
+    # Ao repetir as falhas, os registros com erro ficam no JSONL, mas a origem volta a ser processada.
+    jsonl = SaidaJSONL(saida, repetir_falhas)
+    concluidas = jsonl.concluidas
+    parquet = SaidaParquet(pasta_parquet, jsonl) if pasta_parquet else None
+    progresso = Progresso(anteriores=len(concluidas))
+    proximo_relatorio = time.monotonic() + intervalo
+    pendentes = {}
+
+    def aguardar(limite):
+        """Grava os resultados prontos até restarem no máximo ``limite`` faturas em andamento."""
+        nonlocal proximo_relatorio
+        while len(pendentes) > limite:
+            prontos, _ = wait(pendentes, timeout=intervalo or None, return_when=FIRST_COMPLETED)
+            for futuro in prontos:
+                item = pendentes.pop(futuro)
+                try:
+                    registro = futuro.result()
+                except ErroTrabalhador as erro:
+                    # Prazo ou limites do processo de extração excedidos: o processo já foi substituído.
+                    import app
+
+                    registro = {'origem': item, 'distribuidora': DISTRIBUIDORA_DESCONHECIDA,
+                                'modelo': DISTRIBUIDORA_DESCONHECIDA, 'segundos': None, **app.erro_extracao(erro)}
+                jsonl.gravar(registro)
+                if parquet is not None:
+                    parquet.gravar(registro)
+                progresso.registrar(registro)
+            if time.monotonic() >= proximo_relatorio:
+                jsonl.sincronizar()
+                print(progresso.resumo(), file=relatorio, flush=True)
+                proximo_relatorio = time.monotonic() + intervalo
+
+    try:
+        with pool_do_ambiente(processos, precarregar=('app',)) as executor:
+            for item in listar_origens(origem):
+                if item in concluidas:
+                    continue
+                # Mantém poucas faturas em espera para não carregar o manifesto inteiro na memória.
+                aguardar(processos * 4 - 1)
+                pendentes[executor.submit(processar_origem, item)] = item
+            aguardar(0)
+    finally:
+        jsonl.fechar()
+        if parquet is not None:
+            parquet.fechar()
+    print(progresso.resumo(), file=relatorio, flush=True)
+    return progresso
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Extrai em massa faturas de uma pasta ou de um manifesto.')
+    parser.add_argument('origem', help='pasta com PDFs (lida recursivamente) ou manifesto com um caminho ou URL por linha')
+    parser.add_argument('--saida', default='resultados.jsonl', help='arquivo JSONL de resultados e ponto de controle (padrão: resultados.jsonl)')
+    parser.add_argument('--parquet', metavar='PASTA', help='grava também partes Parquet nesta pasta (requer pyarrow)')
+    parser.add_argument('--processos', type=int, help='processos de extração (padrão: número de núcleos)')
+    parser.add_argument('--intervalo', type=float, default=10, help='segundos entre os relatórios de progresso (padrão: 10)')
+    parser.add_argument('--repetir-falhas', action='store_true', help='processa de novo as faturas que falharam com erro interno')
+    parser.add_argument('--resumo', metavar='JSON', help='grava o resumo final por distribuidora neste arquivo')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.origem):
+        parser.error(f'origem não encontrada: {args.origem}')
+    try:
+        progresso = processar(args.origem, args.saida, args.parquet, args.processos, args.intervalo, args.repetir_falhas)
+    except ImportError as erro:
+        parser.error(str(erro))
+    if args.resumo:
+        with open(args.resumo, 'w', encoding='utf-8') as arquivo:
+            json.dump(progresso.dados(), arquivo, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
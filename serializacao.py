@@ -0,0 +1,97 @@
+import json
+import math
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Precisão dos números nas respostas: valores em reais e quantidades (kWh, dias, tarifas).
+CASAS_VALOR = 2
+CASAS_QUANTIDADE = 3
+CASAS_CAMPO = {
+    'valor': CASAS_VALOR,
+    'valor_fatura': CASAS_VALOR,
+    'quantidade': CASAS_QUANTIDADE,
+    'consumo_total': CASAS_QUANTIDADE,
+    'soma_consumo_total': CASAS_QUANTIDADE,
+}
+
+JSON = 'application/json'
+NDJSON = 'application/x-ndjson'
+MSGPACK = 'application/msgpack'
+
+
+def normalizar(valor, casas=None):
+    """Converte um resultado em tipos nativos do Python, uma única vez, antes de guardar ou serializar.
+
+    Escalares do numpy viram ``int`` / ``float``, NaN e infinitos viram
+    ``None`` e os números dos campos de ``CASAS_CAMPO`` são arredondados
+    para a precisão definida.
+    """
+    if isinstance(valor, dict):
+        return {chave: normalizar(item, CASAS_CAMPO.get(chave)) for chave, item in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [normalizar(item) for item in valor]
+    if valor is None or isinstance(valor, (str, bool)):
+        return valor
+    if hasattr(valor, 'item'):
+        valor = valor.item()
+    if isinstance(valor, float):
+        if not math.isfinite(valor):
+            return None
+        return round(valor, casas) if casas is not None else valor
+    return valor
+
+
+def _converter_json(valor):
+    if hasattr(valor, 'item'):
+        return valor.item()
+    raise TypeError(f'Objeto do tipo {type(valor).__name__} não é serializável em JSON')
+
+
+def para_json(dados, ordenar=False):
+    """JSON compacto em ``bytes`` (UTF-8), com o orjson quando instalado."""
+    if orjson is not None:
+        opcoes = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_SORT_KEYS if ordenar else 0)
+        return orjson.dumps(dados, default=_converter_json, option=opcoes)
+    return json.dumps(dados, default=_converter_json, ensure_ascii=False, sort_keys=ordenar,
+                      separators=(',', ':')).encode()
+
+
+def de_json(texto):
+    return orjson.loads(texto) if orjson is not None else json.loads(texto)
+
+
+_FORMATOS = (JSON, NDJSON, MSGPACK) if msgpack is not None else (JSON, NDJSON)
+
+
+def formatos_disponiveis():
+    """Formatos de resposta negociáveis, em ordem de preferência; o msgpack só com o pacote instalado."""
+    return _FORMATOS
+
+
+def codificar(dados, formato=JSON):
+    """Corpo da resposta em ``formato``. Em NDJSON, cada chamada produz uma linha."""
+    if formato == MSGPACK:
+        return msgpack.packb(dados, default=_converter_json, use_bin_type=True)
+    if formato == NDJSON:
+        return para_json(dados) + b'\n'
+    return para_json(dados, ordenar=True)
+
+
+class ProvedorJSON(DefaultJSONProvider):
+    """Provedor JSON do Flask (usado por ``jsonify``) com ``para_json``."""
+
+    def dumps(self, obj, **kwargs):
+        return para_json(obj, ordenar=self.sort_keys).decode()
+
+    def loads(self, s, **kwargs):
+        return de_json(s)
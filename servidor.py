@@ -0,0 +1,269 @@
+"""Servidor de produção da API.
+
+O processo principal importa a aplicação, aquece a leitura de PDFs (layouts,
+expressões regulares, pdfplumber / pdfminer) e só então cria os processos
+HTTP por fork, de modo que todos compartilham essas páginas de memória
+(copy-on-write). Cada processo atende requisições em threads, tem os seus
+próprios processos de extração e é reciclado depois de um número de
+requisições; um processo que termina é substituído:
+
+    python servidor.py --trabalhadores 4 --porta 8080
+"""
+import argparse
+import gc
+import logging
+import os
+import random
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+from werkzeug.serving import make_server
+from werkzeug.wsgi import ClosingIterator
+
+from metricas import MetricasCompartilhadas
+
+logger = logging.getLogger('servidor')
+
+# Um processo que termina antes disso é considerado falha de inicialização e é recriado com atraso.
+VIDA_MINIMA = 1
+
+
+def aquecer():
+    """Importa a aplicação e exercita uma vez a leitura de um PDF, antes do fork."""
+    import app
+    from pdf_sintetico import gerar_pdf
+
+    # Os processos HTTP herdam o estado e só ficam prontos depois de iniciar os executores.
+    app.pronto.clear()
+    conteudo = gerar_pdf([[(10, 100, 'Aquecimento 1.234,56'), (10, 800, 'Copel Distribuição S.A.')]])
+    with app.SessaoDocumento(BytesIO(conteudo)) as sessao:
+        sessao.textos(sorted({regiao.coordenadas for layout in app.LAYOUTS.values()
+                              for regiao in layout.values() if regiao.pagina == 0}))
+        sessao.pagina(0).extract_words()
+    app.app.json.dumps({'aquecimento': 1.5})
+    return app
+
+
+class ContadorRequisicoes:
+    """Middleware WSGI que conta as requisições do processo e as que ainda estão em andamento.
+
+    Ao atender a requisição número ``limite``, chama ``ao_atingir`` (o
+    processo deixa de aceitar conexões e é reciclado); ``aguardar`` espera as
+    respostas em andamento, inclusive as transmitidas aos poucos, terminarem.
+    """
+
+    def __init__(self, aplicacao, limite, ao_atingir):
+        self._aplicacao = aplicacao
+        self.limite = limite
+        self._ao_atingir = ao_atingir
+        self.total = 0
+        self.em_andamento = 0
+        self._concluida = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        with self._concluida:
+            self.total += 1
+            self.em_andamento += 1
+            atingiu = self.total == self.limite
+        if atingiu:
+            self._ao_atingir()
+        try:
+            resposta = self._aplicacao(environ, start_response)
+        except BaseException:
+            self._terminar()
+            raise
+        return ClosingIterator(resposta, self._terminar)
+
+    def _terminar(self):
+        with self._concluida:
+            self.em_andamento -= 1
+            self._concluida.notify_all()
+
+    def aguardar(self, espera):
+        with self._concluida:
+            return self._concluida.wait_for(lambda: self.em_andamento == 0, espera)
+
+
+class Trabalhador:
+    """Processo HTTP criado por fork do processo principal."""
+
+    def __init__(self, aplicacao, soquete, max_requisicoes, variacao, espera_encerramento, metricas):
+        self._aplicacao = aplicacao
+        self._soquete = soquete
+        self._metricas = metricas
+        # A variação evita que todos os processos sejam reciclados ao mesmo tempo.
+        self._limite = max_requisicoes + random.randint(0, variacao) if max_requisicoes else 0
+        self._espera_encerramento = espera_encerramento
+        self._servidor = None
+        self._encerrando = threading.Lock()
+
+    def executar(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda numero, quadro: self.encerrar('sinal de encerramento'))
+        app = self._aplicacao
+        contador = ContadorRequisicoes(app.app, self._limite, lambda: self.encerrar('limite de requisições'))
+        host, porta = self._soquete.getsockname()[:2]
+        self._servidor = make_server(host, porta, contador, threaded=True, fd=self._soquete.fileno())
+        # O forkserver dos processos de extração é iniciado antes das threads do servidor e das tarefas.
+        app.iniciar_executores()
+        app.metricas_compartilhadas = self._metricas
+        self._metricas.iniciar()
+        app.pronto.set()
+        logger.info('Processo %s pronto.', os.getpid())
+        self._servidor.serve_forever()
+
+        if not contador.aguardar(self._espera_encerramento):
+            logger.warning('Processo %s encerrado com %s requisições em andamento.', os.getpid(), contador.em_andamento)
+        app.encerrar_executores()
+        self._metricas.parar()
+        logger.info('Processo %s encerrado depois de %s requisições.', os.getpid(), contador.total)
+
+    def encerrar(self, motivo):
+        """Deixa de aceitar conexões; as requisições em andamento terminam antes de o processo sair."""
+        if not self._encerrando.acquire(blocking=False):
+            return
+        logger.info('Encerrando o processo %s (%s).', os.getpid(), motivo)
+        self._aplicacao.pronto.clear()
+        # ``shutdown`` espera o laço do servidor, que pode estar nesta mesma thread (tratador de sinal).
+        threading.Thread(target=self._servidor.shutdown, daemon=True).start()
+
+
+class Mestre:
+    """Processo principal: mantém ``trabalhadores`` processos HTTP e os encerra com os sinais TERM e INT.
+
+    As métricas dos processos são somadas em ``diretorio_metricas`` (um
+    diretório temporário, se não informado), esvaziado a cada início.
+    """
+
+    def __init__(self, host, porta, trabalhadores, max_requisicoes=1000, variacao=100, espera_encerramento=30,
+                 diretorio_metricas=None):
+        self.host = host
+        self.porta = porta
+        self.trabalhadores = trabalhadores
+        self.max_requisicoes = max_requisicoes
+        self.variacao = variacao
+        self.espera_encerramento = espera_encerramento
+        self.diretorio_metricas = diretorio_metricas
+        self._metricas = None
+        self._processos = {}
+        self._encerrando = False
+
+    def _preparar_metricas(self):
+        if self.diretorio_metricas:
+            os.makedirs(self.diretorio_metricas, exist_ok=True)
+            for nome in os.listdir(self.diretorio_metricas):
+                if nome.endswith(('.json', '.tmp')):
+                    os.remove(os.path.join(self.diretorio_metricas, nome))
+            return MetricasCompartilhadas(self.diretorio_metricas)
+        return MetricasCompartilhadas(tempfile.mkdtemp(prefix='metricas-'))
+
+    def executar(self):
+        soquete = socket.create_server((self.host, self.porta), backlog=2048)
+        self._metricas = self._preparar_metricas()
+        aplicacao = aquecer()
+        # Objetos criados até aqui não são mais visitados pelo coletor, que de outro modo
+        # tocaria nas páginas compartilhadas e as copiaria em cada processo.
+        gc.collect()
+        gc.freeze()
+        signal.signal(signal.SIGTERM, self._encerrar)
+        signal.signal(signal.SIGINT, self._encerrar)
+        logger.info('Servindo em %s:%s com %s processos.', self.host, self.porta, self.trabalhadores)
+        try:
+            while not self._encerrando:
+                while len(self._processos) < self.trabalhadores and not self._encerrando:
+                    self._criar(aplicacao, soquete)
+                self._recolher()
+                time.sleep(0.2)
+        finally:
+            self._finalizar()
+            soquete.close()
+            if not self.diretorio_metricas:
+                shutil.rmtree(self._metricas.diretorio, ignore_errors=True)
+
+    def _criar(self, aplicacao, soquete):
+        pid = os.fork()
+        if pid == 0:
+            codigo = 1
+            try:
+                random.seed()
+                Trabalhador(aplicacao, soquete, self.max_requisicoes, self.variacao, self.espera_encerramento,
+                            self._metricas).executar()
+                codigo = 0
+            except BaseException:
+                logger.exception('Falha no processo %s.', os.getpid())
+            finally:
+                logging.shutdown()
+                os._exit(codigo)
+        self._processos[pid] = time.monotonic()
+
+    def _recolher(self):
+        while self._processos:
+            pid, estado = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            inicio = self._processos.pop(pid, None)
+            if inicio is None:
+                continue
+            self._metricas.incorporar(pid)
+            codigo = os.WEXITSTATUS(estado) if os.WIFEXITED(estado) else -os.WTERMSIG(estado)
+            if codigo == 0:
+                logger.info('Processo %s %s.', pid, 'encerrado' if self._encerrando else 'reciclado')
+                continue
+            logger.warning('Processo %s terminou com o código %s.', pid, codigo)
+            if time.monotonic() - inicio < VIDA_MINIMA:
+                time.sleep(VIDA_MINIMA)
+
+    def _encerrar(self, numero, quadro):
+        self._encerrando = True
+
+    def _finalizar(self):
+        for pid in self._processos:
+            os.kill(pid, signal.SIGTERM)
+        limite = time.monotonic() + self.espera_encerramento + 5
+        while self._processos and time.monotonic() < limite:
+            self._recolher()
+            time.sleep(0.1)
+        for pid in self._processos:
+            logger.warning('Processo %s não terminou a tempo; forçando o encerramento.', pid)
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self._metricas.incorporar(pid)
+        self._processos.clear()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Servidor de produção da API de extração de faturas.')
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'), help='endereço (padrão: 0.0.0.0)')
+    parser.add_argument('--porta', type=int, default=int(os.environ.get('PORT', 8080)), help='porta (padrão: 8080)')
+    parser.add_argument('--trabalhadores', type=int, default=int(os.environ.get('SERVIDOR_TRABALHADORES', os.cpu_count() or 1)),
+                        help='processos HTTP (padrão: número de núcleos)')
+    parser.add_argument('--max-requisicoes', type=int, default=int(os.environ.get('SERVIDOR_MAX_REQUISICOES', 1000)),
+                        help='requisições atendidas antes de reciclar o processo; 0 desliga (padrão: 1000)')
+    parser.add_argument('--variacao', type=int, default=int(os.environ.get('SERVIDOR_VARIACAO_REQUISICOES', 100)),
+                        help='acréscimo aleatório ao limite de requisições de cada processo (padrão: 100)')
+    parser.add_argument('--diretorio-metricas', default=os.environ.get('METRICAS_DIRETORIO') or None,
+                        help='diretório em que as métricas dos processos são somadas (padrão: um diretório temporário)')
+    parser.add_argument('--espera-encerramento', type=float, default=float(os.environ.get('SERVIDOR_ESPERA_ENCERRAMENTO', 30)),
+                        help='segundos para as requisições em andamento terminarem ao encerrar (padrão: 30)')
+    args = parser.parse_args(argv)
+    if args.trabalhadores < 1:
+        parser.error('--trabalhadores deve ser pelo menos 1')
+    if not hasattr(os, 'fork'):
+        parser.error('o servidor de produção requer fork (Linux ou macOS)')
+
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'),
+                        format='%(asctime)s %(process)d %(name)s %(levelname)s %(message)s')
+    # Sem configuração explícita, os núcleos são divididos entre os processos HTTP.
+    os.environ.setdefault('LOTE_PROCESSOS_EXTRACAO', str(max(1, (os.cpu_count() or 1) // args.trabalhadores)))
+    Mestre(args.host, args.porta, args.trabalhadores, args.max_requisicoes, args.variacao,
+           args.espera_encerramento, args.diretorio_metricas).executar()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
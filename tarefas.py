@@ -0,0 +1,332 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from memoria import PDF_LIMITE_MEMORIA, TAMANHO_PARTE, ArquivoPDF, guardar_partes, resumo_sha256
+
+logger = logging.getLogger(__name__)
+
+PENDENTE = 'pendente'
+EXECUTANDO = 'executando'
+CONCLUIDA = 'concluida'
+FALHOU = 'falhou'
+
+Tarefa = namedtuple('Tarefa', [
+    'id', 'inquilino', 'chave_idempotencia', 'url', 'conteudo', 'campos', 'estado', 'resultado',
+    'tentativas', 'criado_em', 'iniciado_em', 'concluido_em',
+])
+
+_COLUNAS = ', '.join(Tarefa._fields)
+# O PDF só é lido ao reservar a tarefa, não a cada consulta.
+_COLUNAS_SEM_CONTEUDO = ', '.join('NULL' if campo == 'conteudo' else campo for campo in Tarefa._fields)
+
+
+class ConflitoIdempotencia(Exception):
+    pass
+
+
+def assinatura_pedido(url, conteudo, campos):
+    """Identifica o pedido, para conferir se uma chave de idempotência reaproveitada pede a mesma coisa."""
+    origem = url if url is not None else resumo_sha256(conteudo).hexdigest()
+    return hashlib.sha256(json.dumps([origem, campos]).encode()).hexdigest()
+
+
+def descrever(tarefa):
+    """Representação pública de uma tarefa (sem o PDF)."""
+    descricao = {
+        'id': tarefa.id,
+        'estado': tarefa.estado,
+        'criado_em': tarefa.criado_em,
+        'iniciado_em': tarefa.iniciado_em,
+        'concluido_em': tarefa.concluido_em,
+    }
+    if tarefa.resultado is not None:
+        descricao['resultado'] = json.loads(tarefa.resultado)
+    return descricao
+
+
+class FilaTarefas:
+    """Fila persistente de extrações em SQLite.
+
+    Uma tarefa reservada recebe um prazo (``prazo_reserva`` segundos), renovado
+    com ``renovar`` enquanto ela é executada; se o processo que a executava
+    morrer, ela volta a ser reservável quando o prazo vence, até
+    ``tentativas`` vezes. Cada inquilino tem no máximo
+    ``limite_inquilino`` tarefas em execução ao mesmo tempo, e uma chave de
+    idempotência repetida pelo mesmo inquilino devolve a tarefa já existente.
+
+    O PDF enviado (``bytes`` ou ``ArquivoPDF``) é copiado em partes para o
+    banco; ao reservar a tarefa, PDFs acima de ``limite_memoria`` bytes são
+    lidos de volta para um ``ArquivoPDF`` temporário.
+    """
+
+    def __init__(self, caminho, limite_inquilino=2, prazo_reserva=300, tentativas=3, retencao=7 * 24 * 3600,
+                 limite_memoria=PDF_LIMITE_MEMORIA):
+        self._caminho = caminho
+        self.limite_memoria = limite_memoria
+        self.limite_inquilino = limite_inquilino
+        self.prazo_reserva = prazo_reserva
+        self.tentativas = tentativas
+        self.retencao = retencao
+        self._concluidas = threading.Condition()
+        conexao = self._conectar()
+        try:
+            conexao.execute('PRAGMA journal_mode=WAL')
+            conexao.execute(
+                'CREATE TABLE IF NOT EXISTS tarefas ('
+                'id TEXT PRIMARY KEY, inquilino TEXT NOT NULL, chave_idempotencia TEXT, assinatura TEXT NOT NULL, '
+                'url TEXT, conteudo BLOB, campos TEXT, estado TEXT NOT NULL, resultado TEXT, '
+                'tentativas INTEGER NOT NULL DEFAULT 0, reservado_ate REAL, '
+                'criado_em REAL NOT NULL, iniciado_em REAL, concluido_em REAL, '
+                'UNIQUE (inquilino, chave_idempotencia))'
+            )
+            conexao.execute('CREATE INDEX IF NOT EXISTS tarefas_fila ON tarefas (estado, criado_em)')
+            conexao.execute('CREATE INDEX IF NOT EXISTS tarefas_inquilino ON tarefas (inquilino, estado)')
+        finally:
+            conexao.close()
+
+    def _conectar(self):
+        return sqlite3.connect(self._caminho, timeout=30, isolation_level=None)
+
+    def _executar(self, funcao):
+        conexao = self._conectar()
+        try:
+            conexao.execute('BEGIN IMMEDIATE')
+            try:
+                resultado = funcao(conexao)
+            except BaseException:
+                conexao.execute('ROLLBACK')
+                raise
+            conexao.execute('COMMIT')
+            return resultado
+        finally:
+            conexao.close()
+
+    @staticmethod
+    def _tarefa(linha):
+        if linha is None:
+            return None
+        tarefa = Tarefa(*linha)
+        return tarefa._replace(campos=tuple(json.loads(tarefa.campos)) if tarefa.campos else None)
+
+    def enviar(self, inquilino, url=None, conteudo=None, campos=None, chave_idempotencia=None):
+        """Enfileira uma extração; devolve ``(tarefa, criada)``."""
+        assinatura = assinatura_pedido(url, conteudo, campos)
+
+        def enviar(conexao):
+            if chave_idempotencia:
+                existente = conexao.execute(
+                    'SELECT assinatura, id FROM tarefas WHERE inquilino = ? AND chave_idempotencia = ?',
+                    (inquilino, chave_idempotencia)).fetchone()
+                if existente:
+                    if existente[0] != assinatura:
+                        raise ConflitoIdempotencia('Chave de idempotência já usada com outro pedido.')
+                    return existente[1], False
+            identificador = uuid.uuid4().hex
+            # Um PDF em disco é copiado em partes para um BLOB do tamanho dele (blobopen: Python 3.11+).
+            em_partes = isinstance(conteudo, ArquivoPDF) and hasattr(conexao, 'blobopen')
+            if em_partes:
+                valor_conteudo, dados = 'zeroblob(?)', conteudo.tamanho
+            elif isinstance(conteudo, ArquivoPDF):
+                with open(conteudo.caminho, 'rb') as arquivo:
+                    valor_conteudo, dados = '?', arquivo.read()
+            else:
+                valor_conteudo, dados = '?', conteudo
+            cursor = conexao.execute(
+                'INSERT INTO tarefas (id, inquilino, chave_idempotencia, assinatura, url, conteudo, campos, estado, criado_em) '
+                f'VALUES (?, ?, ?, ?, ?, {valor_conteudo}, ?, ?, ?)',
+                (identificador, inquilino, chave_idempotencia or None, assinatura, url, dados,
+                 json.dumps(list(campos)) if campos else None, PENDENTE, time.time()))
+            if em_partes:
+                with conexao.blobopen('tarefas', 'conteudo', cursor.lastrowid) as blob, \
+                        open(conteudo.caminho, 'rb') as arquivo:
+                    for parte in iter(lambda: arquivo.read(TAMANHO_PARTE), b''):
+                        blob.write(parte)
+            return identificador, True
+
+        identificador, criada = self._executar(enviar)
+        return self.obter(identificador), criada
+
+    def obter(self, identificador):
+        conexao = self._conectar()
+        try:
+            linha = conexao.execute(f'SELECT {_COLUNAS_SEM_CONTEUDO} FROM tarefas WHERE id = ?', (identificador,)).fetchone()
+        finally:
+            conexao.close()
+        return self._tarefa(linha)
+
+    def reservar(self):
+        """Reserva a tarefa mais antiga de um inquilino que ainda não atingiu o limite de execuções."""
+        agora = time.time()
+
+        def reservar(conexao):
+            # Tarefas cujo processo morreu sem concluir voltam para a fila (ou falham de vez).
+            conexao.execute(
+                'UPDATE tarefas SET estado = ?, concluido_em = ?, conteudo = NULL, resultado = ? '
+                'WHERE estado = ? AND reservado_ate < ? AND tentativas >= ?',
+                (FALHOU, agora, json.dumps({'status': 500, 'message': 'A extração foi interrompida repetidas vezes.'}),
+                 EXECUTANDO, agora, self.tentativas))
+            conexao.execute(
+                'UPDATE tarefas SET estado = ? WHERE estado = ? AND reservado_ate < ?',
+                (PENDENTE, EXECUTANDO, agora))
+            linha = conexao.execute(
+                f'SELECT {_COLUNAS_SEM_CONTEUDO}, rowid, length(conteudo) FROM tarefas AS t WHERE estado = ? AND '
+                '(SELECT COUNT(*) FROM tarefas AS e WHERE e.inquilino = t.inquilino AND e.estado = ?) < ? '
+                'ORDER BY criado_em LIMIT 1',
+                (PENDENTE, EXECUTANDO, self.limite_inquilino)).fetchone()
+            if linha is None:
+                return None
+            *linha, rowid, tamanho = linha
+            conexao.execute(
+                'UPDATE tarefas SET estado = ?, tentativas = tentativas + 1, iniciado_em = ?, reservado_ate = ? WHERE id = ?',
+                (EXECUTANDO, agora, agora + self.prazo_reserva, linha[0]))
+            tarefa = self._tarefa(linha)._replace(estado=EXECUTANDO, iniciado_em=agora, tentativas=linha[8] + 1)
+            if tamanho is not None:
+                tarefa = tarefa._replace(conteudo=self._ler_conteudo(conexao, rowid, tamanho))
+            return tarefa
+
+        return self._executar(reservar)
+
+    def renovar(self, identificadores):
+        """Estende o prazo de reserva das tarefas ainda em execução."""
+        prazo = time.time() + self.prazo_reserva
+        self._executar(lambda conexao: conexao.executemany(
+            'UPDATE tarefas SET reservado_ate = ? WHERE id = ? AND estado = ?',
+            [(prazo, identificador, EXECUTANDO) for identificador in identificadores]))
+
+    def _ler_conteudo(self, conexao, rowid, tamanho):
+        if tamanho <= self.limite_memoria or not hasattr(conexao, 'blobopen'):
+            return conexao.execute('SELECT conteudo FROM tarefas WHERE rowid = ?', (rowid,)).fetchone()[0]
+        with conexao.blobopen('tarefas', 'conteudo', rowid, readonly=True) as blob:
+            return guardar_partes(iter(lambda: blob.read(TAMANHO_PARTE), b''), self.limite_memoria)
+
+    def concluir(self, identificador, resultado, estado=CONCLUIDA):
+        def concluir(conexao):
+            conexao.execute(
+                'UPDATE tarefas SET estado = ?, resultado = ?, conteudo = NULL, concluido_em = ?, reservado_ate = NULL '
+                'WHERE id = ?',
+                (estado, json.dumps(resultado, ensure_ascii=False), time.time(), identificador))
+
+        self._executar(concluir)
+        with self._concluidas:
+            self._concluidas.notify_all()
+
+    def aguardar(self, identificador, timeout, intervalo=0.5):
+        """Espera até ``timeout`` segundos pela conclusão da tarefa e a devolve no estado em que estiver."""
+        limite = time.monotonic() + timeout
+        while True:
+            tarefa = self.obter(identificador)
+            restante = limite - time.monotonic()
+            if tarefa is None or tarefa.estado in (CONCLUIDA, FALHOU) or restante <= 0:
+                return tarefa
+            # Conclusões neste processo acordam a espera na hora; as de outros processos, no próximo intervalo.
+            with self._concluidas:
+                self._concluidas.wait(min(intervalo, restante))
+
+    def limpar(self):
+        """Remove as tarefas concluídas há mais de ``retencao`` segundos."""
+        limite = time.time() - self.retencao
+        self._executar(lambda conexao: conexao.execute(
+            'DELETE FROM tarefas WHERE estado IN (?, ?) AND concluido_em < ?', (CONCLUIDA, FALHOU, limite)))
+
+
+class ExecutorTarefas:
+    """Threads que consomem a fila e executam ``processar(tarefa)``, que devolve o resultado da extração.
+
+    Uma thread à parte renova a reserva das tarefas em execução a cada terço
+    do prazo, para que uma extração demorada não seja reservada de novo por
+    outro processo.
+    """
+
+    def __init__(self, fila, processar, threads=4, intervalo_limpeza=3600):
+        self.fila = fila
+        self._processar = processar
+        self._threads = threads
+        self._intervalo_limpeza = intervalo_limpeza
+        self._nova_tarefa = threading.Event()
+        self._parar = threading.Event()
+        self._workers = []
+        self._em_execucao = set()
+        self._em_execucao_lock = threading.Lock()
+
+    def iniciar(self):
+        for numero in range(self._threads):
+            worker = threading.Thread(target=self._consumir, name=f'tarefas-{numero}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        renovacao = threading.Thread(target=self._renovar_reservas, name='tarefas-reservas', daemon=True)
+        renovacao.start()
+        self._workers.append(renovacao)
+        return self
+
+    def parar(self):
+        self._parar.set()
+        self._nova_tarefa.set()
+        for worker in self._workers:
+            worker.join()
+        self._workers.clear()
+
+    def enviar(self, *args, **kwargs):
+        tarefa, criada = self.fila.enviar(*args, **kwargs)
+        if criada:
+            self._nova_tarefa.set()
+        return tarefa, criada
+
+    def _consumir(self):
+        proxima_limpeza = time.monotonic() + self._intervalo_limpeza
+        while not self._parar.is_set():
+            try:
+                if time.monotonic() >= proxima_limpeza:
+                    self.fila.limpar()
+                    proxima_limpeza = time.monotonic() + self._intervalo_limpeza
+                tarefa = self.fila.reservar()
+            except sqlite3.Error:
+                logger.exception('Erro ao consultar a fila de tarefas')
+                tarefa = None
+            if tarefa is None:
+                # Sem tarefa disponível: espera um envio neste processo ou o próximo intervalo.
+                self._nova_tarefa.wait(1)
+                self._nova_tarefa.clear()
+                continue
+            # Pode haver mais tarefas na fila: acorda as demais threads.
+            self._nova_tarefa.set()
+            with self._em_execucao_lock:
+                self._em_execucao.add(tarefa.id)
+            try:
+                resultado = self._processar(tarefa)
+                estado = CONCLUIDA
+            except Exception as erro:
+                logger.exception('Erro ao processar a tarefa %s', tarefa.id)
+                resultado = {'status': 500, 'message': f'Erro ao extrair os dados da fatura: {erro}'}
+                estado = FALHOU
+            finally:
+                with self._em_execucao_lock:
+                    self._em_execucao.discard(tarefa.id)
+            self.fila.concluir(tarefa.id, resultado, estado)
+
+    def _renovar_reservas(self):
+        while not self._parar.wait(self.fila.prazo_reserva / 3):
+            with self._em_execucao_lock:
+                identificadores = list(self._em_execucao)
+            if not identificadores:
+                continue
+            try:
+                self.fila.renovar(identificadores)
+            except sqlite3.Error:
+                logger.exception('Erro ao renovar a reserva das tarefas')
+
+
+def fila_do_ambiente():
+    return FilaTarefas(
+        os.environ.get('TAREFAS_SQLITE', 'tarefas.sqlite3'),
+        limite_inquilino=int(os.environ.get('TAREFAS_LIMITE_INQUILINO', 2)),
+        prazo_reserva=float(os.environ.get('TAREFAS_PRAZO_RESERVA', 300)),
+        tentativas=int(os.environ.get('TAREFAS_TENTATIVAS', 3)),
+        retencao=float(os.environ.get('TAREFAS_RETENCAO', 7 * 24 * 3600)),
+    )
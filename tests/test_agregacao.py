@@ -0,0 +1,171 @@
+"""Equivalência de ``agregacao`` com o agrupamento em pandas que ele substituiu.
+
+``agregar_pandas`` reproduz o trecho de ``busca_itens_fatura`` /
+``transforma_em_json`` da versão com pandas; cada caso compara o resultado
+dele com o das funções de ``agregacao``. A única diferença esperada é a
+tabela sem nenhum item: a versão com pandas falhava (``AttributeError`` no
+acessor ``.str`` ou ``KeyError`` na seleção de um ``DataFrame`` vazio) e a
+atual devolve listas vazias. O pandas não faz parte de ``requirements.txt``:
+vem de ``requirements-dev.txt``, e sem ele estes testes são pulados.
+"""
+import math
+import random
+
+import pytest
+
+from agregacao import (LinhaFatura, agrupar_por_item, montar_linhas, para_dataframe, separar_categorias,
+                       somar_consumo, somar_total_valor)
+
+pd = pytest.importorskip('pandas')
+
+ITENS_FATURA = [
+    'Consumo Ponta TUSD', 'Consumo Fora Ponta TUSD', 'Consumo Ponta TE', 'Consumo Fora Ponta TE',
+    'Consumo Reservado TUSD', 'Demanda Fora Ponta TUSD', 'Energia Injetada Ponta TE',
+]
+ITENS_CONSUMO = {'Consumo Ponta TUSD', 'Consumo Fora Ponta TUSD', 'Consumo Ponta TE', 'Consumo Fora Ponta TE'}
+ITENS_TOTAL = ['TOTAL', 'Total a Pagar', 'Total']
+ITENS_EXCLUSAO = ['SUBTOTAL', 'TOTAL', 'Subtotal', 'Total', 'Total', 'Total Devoluções/Ajustes', 'Total a Pagar',
+                  'Total Distribuidora', 'L ANÇAMENTOS E SERVIÇO']
+
+
+def converter_para_float(valor):
+    if valor is None:
+        return 0.0
+    if isinstance(valor, str):
+        valor = valor.replace('.', '').replace(',', '.')
+    try:
+        return float(valor)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def agregar_pandas(itens, quantidades, valores):
+    tamanho = max(len(itens), len(quantidades), len(valores))
+    df = pd.DataFrame({
+        'item_fatura': itens + [None] * (tamanho - len(itens)),
+        'quantidade': quantidades + [None] * (tamanho - len(quantidades)),
+        'valor': valores + [None] * (tamanho - len(valores)),
+    })
+    df['quantidade'] = df['quantidade'].apply(converter_para_float)
+    df['valor'] = df['valor'].apply(converter_para_float)
+    df = df[~((df['quantidade'].isna()) & (df['valor'].isna()))]
+    df = df.groupby('item_fatura').agg({'quantidade': 'sum', 'valor': 'sum'}).reset_index()
+
+    df_consumo_total = df.copy()
+    df_consumo_total = df_consumo_total.drop_duplicates(subset=['item_fatura'])
+    df_consumo_total = df_consumo_total.drop_duplicates(subset=['quantidade'])
+    filtro = (df_consumo_total['item_fatura'].isin(ITENS_CONSUMO)
+              & df_consumo_total['item_fatura'].str.contains('Ponta|Fora Ponta|FPonta', case=False, na=False))
+    soma_consumo_total = df_consumo_total.loc[filtro]['quantidade'].sum()
+
+    soma_total_valor = df.loc[df['item_fatura'].isin(ITENS_TOTAL)]
+    soma_total = df_consumo_total.loc[~df['item_fatura'].isin(ITENS_EXCLUSAO)]['valor'].sum()
+    soma_total_valor = tuple(soma_total_valor.values[0]) if not soma_total_valor.empty else soma_total if soma_total else None
+
+    categoria = df['item_fatura'].apply(lambda item: item in ITENS_FATURA)
+    encargo_valido = df.apply(
+        lambda linha: (linha['item_fatura'] not in ITENS_FATURA and pd.notnull(linha['quantidade'])
+                       and pd.notnull(linha['valor']) and linha['item_fatura'] not in ITENS_EXCLUSAO), axis=1)
+    colunas = ['item_fatura', 'quantidade', 'valor']
+    return {
+        'itens_fatura': df[categoria][colunas].to_dict(orient='records'),
+        'encargos': df[encargo_valido][colunas].to_dict(orient='records'),
+        'soma_consumo_total': float(soma_consumo_total),
+        'soma_total_valor': soma_total_valor,
+    }
+
+
+def agregar(itens, quantidades, valores):
+    linhas = agrupar_por_item(montar_linhas(itens, quantidades, valores, converter_para_float))
+    total = somar_total_valor(linhas, ITENS_TOTAL, ITENS_EXCLUSAO)
+    return {
+        **separar_categorias(linhas, set(ITENS_FATURA), ITENS_EXCLUSAO),
+        'soma_consumo_total': somar_consumo(linhas, ITENS_CONSUMO),
+        'soma_total_valor': tuple(total) if isinstance(total, LinhaFatura) else total,
+    }
+
+
+def assert_equivalente(itens, quantidades, valores):
+    obtido = agregar(itens, quantidades, valores)
+    try:
+        esperado = agregar_pandas(list(itens), list(quantidades), list(valores))
+    except (AttributeError, KeyError):
+        assert obtido == {'itens_fatura': [], 'encargos': [], 'soma_consumo_total': 0.0, 'soma_total_valor': None}
+        return
+    assert obtido['itens_fatura'] == esperado['itens_fatura']
+    assert obtido['encargos'] == esperado['encargos']
+    assert obtido['soma_consumo_total'] == esperado['soma_consumo_total']
+    if isinstance(esperado['soma_total_valor'], float):
+        assert math.isclose(obtido['soma_total_valor'], esperado['soma_total_valor'], rel_tol=1e-12)
+    else:
+        assert obtido['soma_total_valor'] == esperado['soma_total_valor']
+
+
+def test_listas_vazias():
+    with pytest.raises((AttributeError, KeyError)):
+        agregar_pandas([], [], [])
+    assert_equivalente([], [], [])
+    assert_equivalente([None, None], ['1'], ['2'])
+    assert agregar([], [], []) == {'itens_fatura': [], 'encargos': [], 'soma_consumo_total': 0.0,
+                                   'soma_total_valor': None}
+
+
+def test_itens_repetidos_sao_somados():
+    itens = ['Consumo Ponta TUSD', 'COSIP', 'Consumo Ponta TUSD', 'COSIP', 'Consumo Fora Ponta TE']
+    assert_equivalente(itens, ['100', '1', '50', '1', '200'], ['10,50', '3,00', '5,25', '3,00', '20,00'])
+    resultado = agregar(itens, ['100', '1', '50', '1', '200'], ['10,50', '3,00', '5,25', '3,00', '20,00'])
+    assert resultado['itens_fatura'][0] == {'item_fatura': 'Consumo Fora Ponta TE', 'quantidade': 200.0, 'valor': 20.0}
+    assert resultado['encargos'] == [{'item_fatura': 'COSIP', 'quantidade': 2.0, 'valor': 6.0}]
+
+
+def test_ordem_alfabetica_dos_itens():
+    itens = ['Multa', 'Consumo Ponta TE', 'COSIP', 'Consumo Fora Ponta TUSD', 'Juros']
+    assert_equivalente(itens, ['1'] * 5, ['2'] * 5)
+    resultado = agregar(itens, ['1'] * 5, ['2'] * 5)
+    assert [linha['item_fatura'] for linha in resultado['encargos']] == ['COSIP', 'Juros', 'Multa']
+
+
+def test_quantidades_repetidas_contam_uma_vez_no_consumo():
+    itens = ['Consumo Ponta TUSD', 'Consumo Ponta TE', 'Consumo Fora Ponta TUSD']
+    assert_equivalente(itens, ['120', '120', '300'], ['1', '2', '3'])
+    assert agregar(itens, ['120', '120', '300'], ['1', '2', '3'])['soma_consumo_total'] == 420.0
+
+
+def test_colunas_de_tamanhos_diferentes():
+    assert_equivalente(['Consumo Ponta TE', 'COSIP', 'Multa'], ['10'], ['1,00', '2,00'])
+    assert_equivalente(['COSIP'], ['1', '2', '3'], ['4', '5', '6'])
+
+
+def test_linha_de_total():
+    itens = ['COSIP', 'Total a Pagar', 'TOTAL', 'Multa']
+    assert_equivalente(itens, ['1', '', '', '1'], ['10,00', '1.234,56', '1.234,56', '2,00'])
+    assert agregar(itens, ['1', '', '', '1'], ['10,00', '1.234,56', '1.234,56', '2,00'])['soma_total_valor'] == (
+        'TOTAL', 0.0, 1234.56)
+
+
+def test_casos_sorteados():
+    nomes = ITENS_FATURA + ITENS_TOTAL + ['SUBTOTAL', 'COSIP', 'Multa', 'Juros', 'L ANÇAMENTOS E SERVIÇO', None]
+    sorteio = random.Random(0)
+
+    def numero():
+        escolha = sorteio.random()
+        if escolha < 0.1:
+            return None
+        if escolha < 0.15:
+            return 'abc'
+        valor = sorteio.choice([sorteio.randint(0, 3000), round(sorteio.uniform(0, 5000), 2), 0.1, 0.2, 0.3])
+        return f'{valor:,.2f}'.replace(',', 'X').replace('.', ',').replace('X', '.')
+
+    for _ in range(300):
+        tamanho = sorteio.randint(0, 20)
+        itens = [sorteio.choice(nomes) for _ in range(tamanho)]
+        quantidades = [numero() for _ in range(max(0, tamanho + sorteio.randint(-3, 3)))]
+        valores = [numero() for _ in range(max(0, tamanho + sorteio.randint(-3, 3)))]
+        assert_equivalente(itens, quantidades, valores)
+
+
+def test_para_dataframe():
+    linhas = [LinhaFatura('COSIP', 1.0, 2.0), LinhaFatura('Multa', 3.0, 4.0)]
+    df = para_dataframe(linhas)
+    assert list(df.columns) == ['item_fatura', 'quantidade', 'valor']
+    assert df.to_dict(orient='records') == [linha._asdict() for linha in linhas]
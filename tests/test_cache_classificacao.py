@@ -0,0 +1,13 @@
+import app
+from metricas import Medicao, medindo
+
+
+def test_acerto_no_cache_usa_a_classificacao_guardada():
+    chave = app.cache_extracoes.chave(b'%PDF-teste-classificacao')
+    extracao = Medicao()
+    extracao.classificar('CELESC', 'CELESC1')
+    app.guardar_cache(chave, {'status': 200, 'data': {}}, extracao)
+
+    with medindo(Medicao()) as medicao:
+        assert app.consulta_cache(chave) == {'status': 200, 'data': {}}
+    assert (medicao.distribuidora, medicao.modelo, medicao.cache) == ('CELESC', 'CELESC1', True)
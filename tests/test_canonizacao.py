@@ -0,0 +1,25 @@
+from canonizacao import Canonizador
+
+FATURA_DICT = {1: 'Consumo Ponta TUSD', 2: 'Consumo Fora Ponta TUSD'}
+REGRAS = {'COPEL': {'itens': {'Cons Ponta TUSD': 1}}}
+
+
+def test_itens_nao_mapeados_sao_contados():
+    canonizador = Canonizador(REGRAS, FATURA_DICT)
+    assert canonizador.canonizar('COPEL', ['Cons Ponta TUSD', 'ILUM PUBLICA', 'ILUM PUBLICA']) == [
+        'Consumo Ponta TUSD', 'ILUM PUBLICA', 'ILUM PUBLICA']
+    assert canonizador.relatorio_nao_mapeados() == [
+        {'distribuidora': 'COPEL', 'item_fatura': 'ILUM PUBLICA', 'ocorrencias': 2}]
+
+
+def test_coleta_devolve_os_itens_para_outro_processo_contar():
+    trabalhador = Canonizador(REGRAS, FATURA_DICT)
+    with trabalhador.coletando() as nao_mapeados:
+        trabalhador.canonizar('COPEL', ['ILUM PUBLICA', 'Consumo Fora Ponta TUSD'])
+    assert nao_mapeados == [('COPEL', 'ILUM PUBLICA')]
+    assert trabalhador.relatorio_nao_mapeados() == []
+
+    principal = Canonizador(REGRAS, FATURA_DICT)
+    principal.contar([tuple(par) for par in nao_mapeados])
+    assert principal.relatorio_nao_mapeados() == [
+        {'distribuidora': 'COPEL', 'item_fatura': 'ILUM PUBLICA', 'ocorrencias': 1}]
@@ -0,0 +1,55 @@
+from deteccao_colunas import Coluna, LayoutsDetectados, agrupar_colunas, ajustar_regioes
+from layouts import Regiao
+
+REGIOES = [
+    Regiao('item_fatura', 0, (27, 400, 105, 582)),
+    Regiao('quantidade', 0, (130, 400, 170, 582)),
+    Regiao('valor', 0, (200, 400, 241, 582)),
+]
+LIMITES = (0, 595)
+
+
+def palavras(*colunas):
+    return [{'x0': x0, 'x1': x1, 'text': texto} for x0, x1, textos in colunas for texto in textos]
+
+
+def test_colunas_dentro_das_regioes_nao_mudam_nada():
+    colunas = agrupar_colunas(palavras((30, 100, ['Consumo', 'COSIP']), (140, 165, ['150', '1']),
+                                       (210, 238, ['1.234,56', '10,00'])))
+    ajustadas = ajustar_regioes(colunas, REGIOES, LIMITES)
+    assert [regiao.coordenadas for regiao in ajustadas.values()] == [regiao.coordenadas for regiao in REGIOES]
+
+
+def test_coluna_deslocada_alarga_a_regiao_sem_estreitar():
+    # O valor começa antes da região configurada, que cortaria o número.
+    colunas = agrupar_colunas(palavras((30, 100, ['Consumo', 'COSIP']), (140, 165, ['150', '1']),
+                                       (185, 225, ['1.234,56', '10,00'])))
+    ajustadas = ajustar_regioes(colunas, REGIOES, LIMITES)
+    assert ajustadas['valor'].coordenadas == (184, 400, 241, 582)
+    for regiao in REGIOES:
+        x0, _, x1, _ = ajustadas[regiao.nome].coordenadas
+        assert x0 <= regiao.coordenadas[0] and x1 >= regiao.coordenadas[2]
+
+
+def test_alargamento_que_alcanca_outra_coluna_e_descartado():
+    # O grupo associado ao valor encosta na quantidade: alargar a região misturaria as colunas.
+    colunas = [Coluna(30, 100, 2, 0), Coluna(140, 168, 2, 2), Coluna(169, 214, 2, 2)]
+    assert ajustar_regioes(colunas, REGIOES, LIMITES) is None
+
+
+def test_colunas_incoerentes_sao_descartadas():
+    colunas = agrupar_colunas(palavras((30, 100, ['10', '20']), (140, 165, ['150', '1']), (210, 238, ['1,00', '2,00'])))
+    assert ajustar_regioes(colunas, REGIOES, LIMITES) is None
+    assert ajustar_regioes([], REGIOES, LIMITES) is None
+
+
+def test_primeira_deteccao_vale_e_identificador_nao_muda(tmp_path):
+    caminho = str(tmp_path / 'layouts.sqlite3')
+    primeiro, segundo = LayoutsDetectados(caminho), LayoutsDetectados(caminho)
+    identificador = primeiro.identificador()
+    colunas = {'valor': Regiao('valor', 0, (184, 400, 241, 582))}
+    assert primeiro.guardar('impressao', 'CELESC1', colunas) == colunas
+    # Outro processo que detectou ao mesmo tempo fica com as colunas já guardadas.
+    assert segundo.guardar('impressao', 'CELESC1', None) == colunas
+    assert segundo.identificador() == identificador
+    assert LayoutsDetectados(str(tmp_path / 'outro.sqlite3')).identificador() != identificador
@@ -0,0 +1,31 @@
+import pytest
+
+from historico import HistoricoFaturas, normalizar_fatura
+
+
+@pytest.mark.parametrize('texto, esperado', [
+    ('450 kWh', 450.0),
+    ('1.200kWh', 1200.0),
+    ('1.234,56', 1234.56),
+    ('R$ 987,65', 987.65),
+    (1500.5, 1500.5),
+    ('', None),
+    ('sem consumo', None),
+    (None, None),
+])
+def test_consumo_e_valor_com_unidade(texto, esperado):
+    fatura = normalizar_fatura('COPEL', 'COPEL', {
+        'unidade_consumidora': '123', 'referencia': '09/2023', 'consumo_total': texto, 'valor_fatura': texto})
+    assert fatura['consumo_total'] == esperado
+    assert fatura['valor_fatura'] == esperado
+
+
+def test_consumo_em_kwh_entra_nos_agregados(tmp_path):
+    historico = HistoricoFaturas(str(tmp_path / 'historico.sqlite3'))
+    for unidade, consumo in (('1', '450 kWh'), ('2', '50 kWh')):
+        assert historico.registrar('CELESC', 'CELESC1', {
+            'unidade_consumidora': unidade, 'referencia': '09/2023', 'consumo_total': consumo,
+            'valor_fatura': '100,00', 'dias_bandeira': '30'})
+    assert historico.faturas('1')[0]['consumo_total'] == 450.0
+    assert historico.agregados() == [
+        {'periodo': '2023-09', 'faturas': 2, 'unidades': 2, 'consumo_total': 500.0, 'valor_fatura': 200.0}]
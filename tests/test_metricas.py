@@ -0,0 +1,63 @@
+import json
+
+import metricas
+from metricas import MetricasCompartilhadas, RegistroMetricas
+
+
+def registro(processadas, duracao):
+    registro = RegistroMetricas()
+    registro.contador('processadas_total', 'Faturas processadas.', ('status',)).incrementar(processadas, status='200')
+    registro.histograma('duracao_segundos', 'Duração.', limites=(1.0,)).observar(duracao)
+    return registro
+
+
+def amostras(texto):
+    return [linha for linha in texto.splitlines() if not linha.startswith('#')]
+
+
+def test_soma_os_processos_e_mantem_os_encerrados(tmp_path):
+    local = MetricasCompartilhadas(str(tmp_path), registro(2, 0.5))
+    (tmp_path / '111.json').write_text(json.dumps(registro(3, 2.0).estado()))
+    esperado = [
+        'processadas_total{status="200"} 5',
+        'duracao_segundos_bucket{le="1"} 1',
+        'duracao_segundos_bucket{le="+Inf"} 2',
+        'duracao_segundos_sum 2.5',
+        'duracao_segundos_count 2',
+    ]
+    assert amostras(local.exposicao()) == esperado
+
+    # O processo 111 terminou: o estado dele passa para os encerrados e continua somado.
+    local.incorporar(111)
+    assert not (tmp_path / '111.json').exists()
+    assert amostras(local.exposicao()) == esperado
+
+
+def test_arquivo_ja_incorporado_nao_e_somado_duas_vezes(tmp_path):
+    local = MetricasCompartilhadas(str(tmp_path), registro(1, 0.5))
+    (tmp_path / '222.json').write_text(json.dumps(registro(4, 0.5).estado()))
+    local.incorporar(222)
+    # Janela entre gravar os encerrados e remover o arquivo do processo.
+    (tmp_path / '222.json').write_text(json.dumps(registro(4, 0.5).estado()))
+    assert 'processadas_total{status="200"} 5' in amostras(local.exposicao())
+
+
+def test_diretorio_removido_responde_so_o_processo(tmp_path):
+    local = MetricasCompartilhadas(str(tmp_path / 'removido'), registro(2, 0.5))
+    assert local.estados() == []
+    assert 'processadas_total{status="200"} 2' in amostras(local.exposicao())
+
+
+def test_arquivo_removido_durante_a_leitura_vem_dos_encerrados(tmp_path, monkeypatch):
+    local = MetricasCompartilhadas(str(tmp_path), registro(1, 0.5))
+    (tmp_path / '333.json').write_text(json.dumps(registro(4, 0.5).estado()))
+    listar = metricas.os.listdir
+
+    def listar_e_incorporar(caminho):
+        # O processo principal incorpora o arquivo logo depois da listagem.
+        nomes = listar(caminho)
+        MetricasCompartilhadas(str(tmp_path), registro(0, 0.5)).incorporar(333)
+        return nomes
+
+    monkeypatch.setattr(metricas.os, 'listdir', listar_e_incorporar)
+    assert 'processadas_total{status="200"} 5' in amostras(local.exposicao())
@@ -0,0 +1,34 @@
+"""Faturas com menos páginas do que o layout prevê: as regiões das páginas ausentes ficam vazias."""
+import io
+
+import pytest
+
+import app
+from benchmark import ENTRELINHA, FATURAS_SINTETICAS
+from pdf_sintetico import gerar_pdf
+
+
+def fatura_curta(nome, paginas):
+    fatura = FATURAS_SINTETICAS[nome]
+    conteudo = [[] for _ in range(paginas)]
+    for (layout, regiao), linhas in fatura['regioes'].items():
+        regiao = app.LAYOUTS[layout][regiao]
+        if regiao.pagina >= paginas:
+            continue
+        x0, top = regiao.coordenadas[:2]
+        conteudo[regiao.pagina].extend(
+            (x0 + 1, top + 4 + numero * ENTRELINHA, linha) for numero, linha in enumerate(linhas) if linha)
+    for pagina, x, top, texto in fatura['textos']:
+        if pagina < paginas:
+            conteudo[pagina].append((x, top, texto))
+    return gerar_pdf(conteudo)
+
+
+@pytest.mark.parametrize('nome, paginas', [('COPEL', 1), ('COPEL', 2), ('CPFL', 1)])
+def test_paginas_ausentes_nao_falham_a_extracao(nome, paginas):
+    maximo = max(app.LAYOUTS[layout][regiao].pagina for layout, regiao in FATURAS_SINTETICAS[nome]['regioes'])
+    assert paginas <= maximo, 'a fatura curta deve omitir alguma página com regiões'
+    resultado = app.APILeitorFaturas(io.BytesIO(fatura_curta(nome, paginas))).extrair_documento()
+    assert resultado['status'] == 200
+    assert resultado['data']['referencia'] == '08/2023'
+    assert resultado['data']['bandeira'] is None
@@ -0,0 +1,14 @@
+from perfil import PerfilRequisicoes
+
+
+def test_token_no_cabecalho(tmp_path):
+    perfil = PerfilRequisicoes(str(tmp_path), token='segredo')
+    assert perfil.deve_perfilar('segredo')
+    assert not perfil.deve_perfilar('outro')
+    assert not perfil.deve_perfilar(None)
+
+
+def test_cabecalho_com_texto_nao_ascii(tmp_path):
+    perfil = PerfilRequisicoes(str(tmp_path), token='segredo')
+    assert not perfil.deve_perfilar('seg\xe9do')
+    assert PerfilRequisicoes(str(tmp_path), token='s\xe9gredo').deve_perfilar('s\xe9gredo')
@@ -0,0 +1,18 @@
+import app
+
+
+def test_pronto_depois_de_importar_a_aplicacao():
+    cliente = app.app.test_client()
+    assert cliente.get('/healthz').status_code == 200
+    assert cliente.get('/readyz').status_code == 200
+
+
+def test_nao_pronto_durante_o_encerramento():
+    cliente = app.app.test_client()
+    app.pronto.clear()
+    try:
+        resposta = cliente.get('/readyz')
+        assert resposta.status_code == 503
+        assert resposta.json['status'] == 503
+    finally:
+        app.pronto.set()
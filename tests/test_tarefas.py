@@ -0,0 +1,27 @@
+import threading
+import time
+
+from tarefas import CONCLUIDA, ExecutorTarefas, FilaTarefas
+
+
+def test_tarefa_demorada_nao_e_reservada_de_novo(tmp_path):
+    fila = FilaTarefas(str(tmp_path / 'tarefas.sqlite3'), prazo_reserva=0.3)
+    iniciada = threading.Event()
+
+    def processar(tarefa):
+        iniciada.set()
+        time.sleep(1)
+        return {'status': 200}
+
+    executor = ExecutorTarefas(fila, processar, threads=1).iniciar()
+    try:
+        tarefa, _ = executor.enviar('inquilino', conteudo=b'%PDF')
+        assert iniciada.wait(5)
+        time.sleep(0.6)
+        # Outro processo consultando a fila depois do prazo original não pega a tarefa em execução.
+        assert FilaTarefas(str(tmp_path / 'tarefas.sqlite3'), prazo_reserva=0.3).reservar() is None
+        tarefa = fila.aguardar(tarefa.id, 5)
+    finally:
+        executor.parar()
+    assert tarefa.estado == CONCLUIDA
+    assert tarefa.tentativas == 1
@@ -0,0 +1,27 @@
+import sys
+import types
+
+import pytest
+
+from trabalhadores import _metodo_inicio
+
+
+@pytest.fixture
+def principal(monkeypatch):
+    modulo = types.ModuleType('__main__')
+    monkeypatch.setitem(sys.modules, '__main__', modulo)
+    return modulo
+
+
+def test_script_em_arquivo_e_importado_pelo_forkserver(principal):
+    principal.__file__ = __file__
+    assert _metodo_inicio() == ('forkserver', ['__main__'])
+
+
+def test_sem_arquivo_principal_nao_importa_main(principal):
+    assert _metodo_inicio() == ('forkserver', [])
+
+
+def test_script_lido_da_entrada_padrao_usa_fork(principal):
+    principal.__file__ = '<stdin>'
+    assert _metodo_inicio() == ('fork', [])
@@ -0,0 +1,268 @@
+import atexit
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+class ErroTrabalhador(Exception):
+    pass
+
+
+class PrazoExcedido(ErroTrabalhador):
+    def __init__(self, prazo):
+        super().__init__(f'A extração excedeu o prazo de {prazo:g} segundos.')
+        self.prazo = prazo
+
+    def __reduce__(self):
+        return PrazoExcedido, (self.prazo,)
+
+
+class LimiteExcedido(ErroTrabalhador):
+    """O documento excedeu o limite de CPU (``cpu``) ou de memória (``memoria``) do processo."""
+
+    def __init__(self, limite):
+        descricao = {'cpu': 'tempo de CPU', 'memoria': 'memória'}.get(limite, limite)
+        super().__init__(f'A extração excedeu o limite de {descricao} do processo.')
+        self.limite = limite
+
+    def __reduce__(self):
+        return LimiteExcedido, (self.limite,)
+
+
+class TrabalhadorEncerrado(ErroTrabalhador):
+    def __init__(self, codigo_saida):
+        super().__init__(f'O processo de extração terminou inesperadamente (código {codigo_saida}).')
+        self.codigo_saida = codigo_saida
+
+    def __reduce__(self):
+        return TrabalhadorEncerrado, (self.codigo_saida,)
+
+
+def _cpu_excedida(numero, quadro):
+    raise LimiteExcedido('cpu')
+
+
+def _definir_limite_cpu(segundos):
+    _, maximo = resource.getrlimit(resource.RLIMIT_CPU)
+    resource.setrlimit(resource.RLIMIT_CPU, (segundos, maximo))
+
+
+def _trabalhar(conexao, limite_cpu, limite_memoria):
+    """Laço de um processo de extração: executa ``(funcao, args)`` recebidos pela conexão até ela ser fechada."""
+    # Ctrl+C e SIGTERM enviados ao grupo de processos são tratados pelo processo principal, que
+    # encerra os trabalhadores depois de terminar os documentos em andamento.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    if resource is not None:
+        if limite_memoria:
+            resource.setrlimit(resource.RLIMIT_AS, (limite_memoria, limite_memoria))
+        if limite_cpu:
+            signal.signal(signal.SIGXCPU, _cpu_excedida)
+    pai = os.getppid()
+    while True:
+        # Outros processos podem herdar a outra ponta da conexão e o EOF pode nunca chegar: se o
+        # processo principal morrer sem encerrar o pool, o forkserver (o pai) sai e o trabalhador percebe.
+        while not conexao.poll(1):
+            if os.getppid() != pai:
+                return
+        try:
+            pedido = conexao.recv()
+        except EOFError:
+            return
+        if pedido is None:
+            return
+        funcao, args = pedido
+        if resource is not None and limite_cpu:
+            uso = resource.getrusage(resource.RUSAGE_SELF)
+            _definir_limite_cpu(int(uso.ru_utime + uso.ru_stime + limite_cpu) + 1)
+        try:
+            resposta = ('ok', funcao(*args))
+        except LimiteExcedido as erro:
+            resposta = ('reciclar', erro)
+        except MemoryError:
+            resposta = ('reciclar', LimiteExcedido('memoria'))
+        except Exception as erro:
+            resposta = ('erro', erro)
+        finally:
+            if resource is not None and limite_cpu:
+                _definir_limite_cpu(resource.RLIM_INFINITY)
+        try:
+            conexao.send(resposta)
+        except Exception as erro:
+            # Resultado ou exceção que não pode ser serializado.
+            conexao.send(('erro', RuntimeError(f'{type(erro).__name__}: {erro}')))
+        if resposta[0] == 'reciclar':
+            # Depois de estourar um limite, o estado do processo não é confiável.
+            return
+
+
+def _metodo_inicio():
+    """Como criar os processos: ``(metodo, preload do forkserver)``.
+
+    O forkserver importa também ``__main__`` quando o script principal é um
+    arquivo, para os processos executarem funções dele. Com ``__file__``
+    que não existe em disco (``<stdin>``), o multiprocessing tentaria
+    reexecutar o script em cada processo novo, então só resta o fork; sem
+    ``__file__`` (``python -c``, REPL, interpretadores embutidos), basta
+    não importar ``__main__``.
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return 'spawn', []
+    caminho = getattr(sys.modules.get('__main__'), '__file__', None)
+    if caminho is None:
+        return 'forkserver', []
+    if not os.path.isfile(caminho):
+        logger.warning('Script principal sem arquivo (%s); os processos de extração serão criados por fork.', caminho)
+        return 'fork', []
+    return 'forkserver', ['__main__']
+
+
+class _Trabalhador:
+    def __init__(self, contexto, limite_cpu, limite_memoria):
+        self.conexao, conexao_filho = contexto.Pipe()
+        self.processo = contexto.Process(
+            target=_trabalhar, args=(conexao_filho, limite_cpu, limite_memoria), name='extracao', daemon=True)
+        self.processo.start()
+        conexao_filho.close()
+        self.documentos = 0
+
+    def encerrar(self, forcar=False):
+        if forcar:
+            self.processo.kill()
+        else:
+            try:
+                self.conexao.send(None)
+            except OSError:
+                pass
+        self.processo.join(5)
+        if self.processo.is_alive():
+            self.processo.kill()
+            self.processo.join()
+        self.conexao.close()
+
+
+class PoolSupervisionado:
+    """Pool de processos de extração com prazo por documento e limites de recursos.
+
+    Cada documento roda em um processo próprio do pool, com até ``prazo``
+    segundos de relógio, ``limite_cpu`` segundos de CPU e ``limite_memoria``
+    bytes de espaço de endereçamento. Um processo que excede o prazo é
+    morto; um que excede os limites se encerra. Nos dois casos, o documento
+    falha com um ``ErroTrabalhador`` e o processo é substituído, assim
+    como os que já processaram ``max_documentos``.
+
+    Os processos são criados por um forkserver (onde disponível): um
+    processo de uma só thread, iniciado junto com o pool, que importa os
+    módulos de ``precarregar`` e cria cada processo do pool por fork. Assim
+    um processo novo, inclusive um reciclado, já começa com o pdfplumber e
+    as tabelas de layout carregados, sem herdar as threads (e os locks que
+    elas seguravam) do processo que atende as requisições. ``submit`` tem a
+    mesma interface de um ``concurrent.futures.Executor``.
+    """
+
+    def __init__(self, processos, prazo=60, limite_cpu=60, limite_memoria=0, max_documentos=500, precarregar=()):
+        self.processos = processos
+        self.prazo = prazo
+        self.limite_cpu = limite_cpu
+        self.limite_memoria = limite_memoria
+        self.max_documentos = max_documentos
+        metodo, principal = _metodo_inicio()
+        self._contexto = multiprocessing.get_context(metodo)
+        if metodo == 'forkserver':
+            self._contexto.set_forkserver_preload([*principal, *precarregar])
+        else:
+            for modulo in precarregar:
+                importlib.import_module(modulo)
+        self._livres = queue.Queue()
+        self._trabalhadores = set()
+        self._lock = threading.Lock()
+        for _ in range(processos):
+            self._livres.put(self._novo_trabalhador())
+        self._despacho = ThreadPoolExecutor(max_workers=processos, thread_name_prefix='despacho-extracao')
+        # Os processos ignoram SIGTERM, então o encerramento do multiprocessing na saída do interpretador
+        # (SIGTERM e join) esperaria para sempre por um pool que não foi encerrado.
+        atexit.register(self.shutdown, wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def _novo_trabalhador(self):
+        trabalhador = _Trabalhador(self._contexto, self.limite_cpu, self.limite_memoria)
+        with self._lock:
+            self._trabalhadores.add(trabalhador)
+        return trabalhador
+
+    def _substituir(self, trabalhador, forcar=False):
+        with self._lock:
+            self._trabalhadores.discard(trabalhador)
+        trabalhador.encerrar(forcar)
+        return self._novo_trabalhador()
+
+    def submit(self, funcao, *args):
+        return self._despacho.submit(self.executar, funcao, *args)
+
+    def executar(self, funcao, *args):
+        """Executa ``funcao(*args)`` em um processo do pool e devolve o resultado, respeitando o prazo."""
+        trabalhador = self._livres.get()
+        try:
+            try:
+                trabalhador.conexao.send((funcao, args))
+                if not trabalhador.conexao.poll(self.prazo):
+                    logger.warning('Extração excedeu o prazo de %s s; reciclando o processo %s.',
+                                   self.prazo, trabalhador.processo.pid)
+                    trabalhador = self._substituir(trabalhador, forcar=True)
+                    raise PrazoExcedido(self.prazo)
+                estado, valor = trabalhador.conexao.recv()
+            except (EOFError, BrokenPipeError, ConnectionResetError):
+                # O processo morreu: limite do sistema operacional, sinal externo ou falha na extensão C.
+                trabalhador.processo.join(5)
+                codigo = trabalhador.processo.exitcode
+                trabalhador = self._substituir(trabalhador, forcar=True)
+                raise TrabalhadorEncerrado(codigo) from None
+            trabalhador.documentos += 1
+            if estado == 'reciclar':
+                logger.warning('%s Reciclando o processo %s.', valor, trabalhador.processo.pid)
+                trabalhador = self._substituir(trabalhador)
+            elif trabalhador.documentos >= self.max_documentos:
+                trabalhador = self._substituir(trabalhador)
+            if estado != 'ok':
+                raise valor
+            return valor
+        finally:
+            self._livres.put(trabalhador)
+
+    def shutdown(self, wait=True):
+        atexit.unregister(self.shutdown)
+        self._despacho.shutdown(wait=wait)
+        with self._lock:
+            trabalhadores = list(self._trabalhadores)
+            self._trabalhadores.clear()
+        for trabalhador in trabalhadores:
+            trabalhador.encerrar(forcar=not wait)
+
+
+def pool_do_ambiente(processos, precarregar=()):
+    return PoolSupervisionado(
+        processos,
+        prazo=float(os.environ.get('EXTRACAO_PRAZO', 60)),
+        limite_cpu=int(os.environ.get('EXTRACAO_LIMITE_CPU', 60)),
+        limite_memoria=int(os.environ.get('EXTRACAO_LIMITE_MEMORIA', 0)),
+        max_documentos=int(os.environ.get('EXTRACAO_MAX_DOCUMENTOS', 500)),
+        precarregar=precarregar,
+    )